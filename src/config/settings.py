@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.postgres',
     # allauth
     'allauth',
     'allauth.account',
@@ -58,6 +59,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 全てのミドルウェアを含めた処理時間を計測するため最初に置く
+    'cook.metrics.MetricsMiddleware',
+    # セッション・認証のクエリも含めて数えるため認証より前に置く
+    'cook.middleware.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -152,6 +157,102 @@ STATICFILES_DIRS = [
 
 # 画像のための設定
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # レシピ画像は内容のハッシュを名前にして保存し、同じ内容の画像は1つのファイルを共有する
+    'images': {
+        'BACKEND': 'cook.storage.ContentAddressedStorage',
+    },
+}
+# 参照されなくなった画像の削除(gc_images)で、同じ内容の画像がアップロードされてから
+# この秒数が経つまではファイルを残す
+IMAGE_GC_GRACE_SECONDS = int(os.getenv('IMAGE_GC_GRACE_SECONDS', 600))
+# レシピ画像のレンディション(サムネイル)をバックグラウンドのスレッドで作成する
+IMAGE_RENDITION_BACKGROUND = True
+IMAGE_RENDITION_WORKERS = 2
+
+# レシピ・ユーザの削除(cook.deletion)
+# 削除したレシピ・ユーザはすぐに見えなくし、レシピ・材料・画像はバックグラウンドのスレッドで
+# DELETION_BATCH_SIZE件のレシピずつ削除する(中断した場合はpurge_deletedで再開する)
+DELETION_BACKGROUND = os.getenv('DELETION_BACKGROUND', 'true').lower() == 'true'
+DELETION_WORKERS = 1
+DELETION_BATCH_SIZE = int(os.getenv('DELETION_BATCH_SIZE', 500))
+
+# レシピ一覧のページネーション方式
+# 'offset': ?page=n(ページ番号を表示、小規模向け)
+# 'cursor': ?after=<cursor>(COUNT(*)とOFFSETを使わない、大規模向け)
+RECIPE_LIST_PAGINATION = os.getenv('RECIPE_LIST_PAGINATION', 'offset')
+# レシピ一覧のページ・レシピのカードのキャッシュの有効期限(秒)
+# レシピ・材料の保存・削除時にはシグナルで該当するキャッシュを無効にする
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 300))
+
+# レシピ・ユーザの一覧・詳細ページに非同期のビュー(cook.async_views, user.async_views)を使う
+# uvicorn(ASGI)で動かす場合のみ有効にする
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'false').lower() == 'true'
+
+# 材料の登録フォームの追加・削除をブラウザで行う(フォームの数はRedisに保存せず、送信時に検証する)
+INGREDIENT_FORMSET_CLIENT_SIDE = os.getenv(
+    'INGREDIENT_FORMSET_CLIENT_SIDE', 'true'
+).lower() == 'true'
+
+# リクエストごとのクエリ数・DB時間(cook.middleware.QueryCountMiddleware)
+# Server-Timingヘッダーを返す相手: 'off' / 'staff'(スタッフのみ) / 'all'
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'all' if DEBUG else 'off').lower()
+# 同じSQLとパラメータのクエリ(N+1)を数える(クエリごとにパラメータを文字列にするため本番では無効)
+QUERY_STATS_DUPLICATES = os.getenv(
+    'QUERY_STATS_DUPLICATES', str(DEBUG)
+).lower() == 'true'
+# URL名ごとのクエリ数の上限(ログインユーザの取得を含む。セッションはRedisから読む)
+# 超えた場合は警告のログを出力し、QUERY_BUDGET_STRICTがTrueの場合(テスト)は例外にする
+# 材料の数・レシピの数によらない上限(削除は関連する行をcook.deletionで後から消す)
+# 材料を保存するビューは次を含む
+#   辞書にない材料名の登録(cook.catalog): 別名の参照・辞書の登録・辞書の参照・別名の登録・別名の参照の5
+#   検索用のカラムと更新日時の更新(cook.search.update_search_vectors): 3
+#   transaction.atomicのSAVEPOINT / RELEASE: 2
+# (値は辞書にない材料名を保存する場合の件数。辞書にある材料名だけなら辞書は1クエリ)
+QUERY_BUDGET_STRICT = False
+QUERY_BUDGETS = {
+    'cook:recipe_list': 2,
+    'cook:recipe_search': 4,
+    'cook:recipe_suggest': 3,
+    'cook:recipe_detail': 4,
+    'cook:recipe_new': 5,
+    # ログイン 1 + レシピ 1 + 画像の参照数 1 + 材料 1 + 辞書 5 + 検索用のカラム 3 + SAVEPOINT 2
+    'cook:recipe_publish': 14,
+    'cook:recipe_edit': 8,
+    'cook:recipe_destroy': 11,
+    'cook:recipe_export': 1,
+    # ログイン 1 + レシピ 1 + 材料 1 + 辞書 5 + 検索用のカラム 3 + SAVEPOINT 2
+    'cook:ingredient_new': 13,
+    # ログイン・レシピ・材料の読み込み 3 + 更新・追加・削除 3 + 辞書 5 + 検索用のカラム 3 + SAVEPOINT 2
+    'cook:ingredient_bulk_edit': 16,
+    # ログイン 1 + 材料とレシピ 1 + 辞書 5 + 更新 1 + 検索用のカラム 3
+    'cook:ingredient_edit': 11,
+    # ログイン 1 + 材料とレシピ 1 + 削除 1 + 検索用のカラム 3
+    'cook:ingredient_destroy': 6,
+    'cook:api_recipe_list': 2,
+    'cook:api_recipe_detail': 1,
+    'user:user_list': 3,
+    'user:user_detail': 4,
+    'user:user_update': 5,
+    'user:user_delete': 13,
+}
+
+# レシピ・ユーザの詳細ページ(cook.conditional)を未ログインのリクエストに対して
+# 共有キャッシュ(nginx)が保存してよい秒数(ブラウザには毎回再検証させる)
+PAGE_CACHE_SHARED_MAX_AGE = int(os.getenv('PAGE_CACHE_SHARED_MAX_AGE', 10))
+
+# /metrics(cook.metrics)
+# ワーカーごとの集計をRedisに足し込む間隔(秒)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+METRICS_KEY_PREFIX = 'cook_metrics'
+# スタッフ以外はAuthorization: Bearer <METRICS_TOKEN>で取得する(空の場合はスタッフのみ)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -183,6 +284,12 @@ SITE_ID = 1
 REDIS_HOST = 'redis'
 REDIS_PORT = '6379'
 REDIS_DB = 1
+# RedisHandlerのコネクションプールの設定
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 1.0))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(
+    os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT', 1.0)
+)
 
 CACHES = {
     'default': {
@@ -191,8 +298,26 @@ CACHES = {
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient'
         }
+    },
+    # セッション(cook.sessions)。orjsonで保存し、大きい場合は圧縮する
+    'sessions': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SERIALIZER': 'cook.sessions.SessionSerializer',
+            'COMPRESSOR': 'cook.sessions.SessionCompressor',
+        }
     }
 }
 
+# セッションはRedisから読み、変更された場合のみDBとRedisに書く
+# Redisだけに保存する場合は'django.contrib.sessions.backends.cache'を指定する
+SESSION_ENGINE = os.getenv('SESSION_ENGINE', 'cook.sessions')
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_COOKIE_AGE = int(os.getenv('SESSION_COOKIE_AGE', 60 * 60 * 24 * 14))
+# これを超えるセッションは保存しない(cook.sessions.SessionTooLarge)
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', 16 * 1024))
+
 # CSRF settings for docker
 CSRF_TRUSTED_ORIGINS = [os.getenv("GCE_EXTERNAL_IP", "http://localhost:8080")]
@@ -17,10 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from cook.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('config.allauth_urls')),
     path('', include('home.urls')),
     path('cook/', include('cook.urls')),
     path('users/', include('user.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,6 +1,10 @@
 from django.contrib import admin
 
-from .models import Recipe, Ingredient
+from .models import (
+    DeletionJob, Recipe, Ingredient, IngredientAlias, IngredientCatalog
+)
+from .search import BigramSearchQuery
+from .signals import batch_ingredient_changes
 
 
 class IngredientInline(admin.TabularInline):
@@ -12,6 +16,8 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display = ["name", "description", "posted_at"]
     list_filter = ["posted_at", "user"]
     search_fields = ["name"]
+    # recipe_posted_at_idx / recipe_user_posted_at_idxの順に読む
+    ordering = ["-posted_at", "-id"]
     fieldsets = [
         (
             None,
@@ -30,10 +36,23 @@ class RecipeAdmin(admin.ModelAdmin):
 
     inlines = [IngredientInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        # ILIKEによる全件走査ではなく、検索用のカラム(GINインデックス)で検索する
+        if not BigramSearchQuery.build_query(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        query = BigramSearchQuery(search_term)
+        return queryset.filter(search_vector=query), False
+
+    def save_related(self, request, form, formsets, change):
+        # 材料の行ごとにレシピの検索用のカラム・更新日時を更新せず、最後に1回だけ更新する
+        with batch_ingredient_changes():
+            super().save_related(request, form, formsets, change)
+
 
 class IngredientAdmin(admin.ModelAdmin):
-    list_display = ["name", "amount"]
+    list_display = ["name", "amount", "catalog"]
     list_filter = ["recipe"]
+    # 材料名の部分一致(UPPER(name) LIKE '%XX%')はingredient_name_trgm_idxで絞り込む
     search_fields = ["name"]
     readonly_fields = ["recipe"]
     fieldsets = [
@@ -53,6 +72,36 @@ class IngredientAdmin(admin.ModelAdmin):
     ]
 
 
+class IngredientAliasInline(admin.TabularInline):
+    model = IngredientAlias
+    extra = 1
+
+
+class IngredientCatalogAdmin(admin.ModelAdmin):
+    list_display = ["name"]
+    search_fields = ["^name", "^aliases__key"]
+    ordering = ["name"]
+    inlines = [IngredientAliasInline]
+
+
+class DeletionJobAdmin(admin.ModelAdmin):
+    # 進捗の確認用(削除はcook.deletionのワーカー・purge_deletedで行う)
+    list_display = [
+        "kind", "object_id", "deleted_recipes", "total_recipes",
+        "deleted_ingredients", "deleted_files", "updated_at", "finished_at"
+    ]
+    list_filter = ["kind"]
+    ordering = ["-id"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # Register your models here.
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
+admin.site.register(IngredientCatalog, IngredientCatalogAdmin)
+admin.site.register(DeletionJob, DeletionJobAdmin)
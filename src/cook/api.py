@@ -0,0 +1,191 @@
+"""
+レシピの読み取り専用のJSON API
+
+GET /cook/api/recipes/            一覧(カーソルによるページネーション)
+GET /cook/api/recipes/?ids=1,2,3  IDを指定してまとめて取得
+GET /cook/api/recipes/<id>/       詳細
+
+?fields=id,name,...  返すフィールド(省略時はすべて)。指定したフィールドのカラムだけを読み込む
+?embed=ingredients   材料を含める(一覧でもクエリは1回だけ追加される)
+"""
+import orjson
+from django.core.paginator import InvalidPage
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.utils.http import urlencode
+from django.views.generic import View
+
+from .models import Recipe, Ingredient
+from .pagination import CursorPaginator
+
+# {フィールド名: (読み込むカラム, 値を返す関数)}
+FIELDS = {
+    'id': (['id'], lambda recipe: recipe.id),
+    'name': (['name'], lambda recipe: recipe.name),
+    'description': (['description'], lambda recipe: recipe.description),
+    'posted_at': (['posted_at'], lambda recipe: recipe.posted_at),
+    'updated_at': (['updated_at'], lambda recipe: recipe.updated_at),
+    'image_url': (
+        ['image', 'image_renditions_ready'],
+        lambda recipe: recipe.get_image_url()
+    ),
+    'user': (
+        ['user__id', 'user__username'],
+        lambda recipe: {'id': recipe.user.id, 'username': recipe.user.username}
+    ),
+}
+EMBEDS = ['ingredients']
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def json_response(data, status=200):
+    """
+    orjsonで直列化する(datetimeはRFC 3339の文字列になる)
+    """
+    return HttpResponse(
+        orjson.dumps(data), status=status, content_type='application/json'
+    )
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class RecipeApiMixin:
+    ordering = ['id']
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            self.fields = self.get_fields()
+            self.embeds = self.get_embeds()
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as e:
+            return json_response({'error': e.message}, status=e.status)
+
+    def get_fields(self):
+        fields = _split(self.request.GET.get('fields', '')) or list(FIELDS)
+        unknown = [field for field in fields if field not in FIELDS]
+        if unknown:
+            raise ApiError(f'不明なフィールドです: {", ".join(unknown)}')
+        return fields
+
+    def get_embeds(self):
+        embeds = _split(self.request.GET.get('embed', ''))
+        unknown = [embed for embed in embeds if embed not in EMBEDS]
+        if unknown:
+            raise ApiError(f'埋め込めない関連です: {", ".join(unknown)}')
+        return embeds
+
+    def get_queryset(self):
+        """
+        指定されたフィールドのカラムだけを読み込み、投稿者はJOIN、材料は1回のクエリでまとめて取得する
+        """
+        columns = {'id'}
+        for field in self.fields:
+            columns.update(FIELDS[field][0])
+        queryset = Recipe.objects.only(*columns)
+        if 'user' in self.fields:
+            queryset = queryset.select_related('user')
+        if 'ingredients' in self.embeds:
+            queryset = queryset.prefetch_related(Prefetch(
+                'ingredients',
+                queryset=Ingredient.objects.only(
+                    'id', 'name', 'amount', 'recipe_id'
+                ).order_by('id')
+            ))
+        return queryset
+
+    def serialize(self, recipe):
+        data = {field: FIELDS[field][1](recipe) for field in self.fields}
+        if 'ingredients' in self.embeds:
+            data['ingredients'] = [
+                {
+                    'id': ingredient.id,
+                    'name': ingredient.name,
+                    'amount': ingredient.amount,
+                }
+                for ingredient in recipe.ingredients.all()
+            ]
+        return data
+
+
+class RecipeApiListView(RecipeApiMixin, View):
+    paginate_by = 20
+    max_paginate_by = 100
+    max_ids = 100
+
+    def get(self, request, *args, **kwargs):
+        if 'ids' in request.GET:
+            return self.get_batch(request.GET['ids'])
+
+        paginator = CursorPaginator(
+            self.get_queryset(), self.get_limit(), ordering=self.ordering
+        )
+        try:
+            page = paginator.get_page(
+                after=request.GET.get('after') or None,
+                before=request.GET.get('before') or None
+            )
+        except InvalidPage as e:
+            raise ApiError(str(e))
+        return json_response({
+            'results': [self.serialize(recipe) for recipe in page],
+            'next': self.get_page_url(after=page.next_cursor),
+            'previous': self.get_page_url(before=page.previous_cursor),
+        })
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.GET.get('limit', self.paginate_by))
+        except ValueError:
+            raise ApiError('limitは整数で指定してください。')
+        if not 1 <= limit <= self.max_paginate_by:
+            raise ApiError(f'limitは1〜{self.max_paginate_by}で指定してください。')
+        return limit
+
+    def get_page_url(self, **cursor):
+        name, value = next(iter(cursor.items()))
+        if value is None:
+            return None
+        params = {
+            key: param for key, param in self.request.GET.items()
+            if key not in ('after', 'before')
+        }
+        params[name] = value
+        return f'{self.request.path}?{urlencode(params)}'
+
+    def get_batch(self, value):
+        """
+        指定した順にまとめて返す。存在しないIDは結果に含めない
+        """
+        try:
+            ids = [int(recipe_id) for recipe_id in _split(value)]
+        except ValueError:
+            raise ApiError('idsはカンマ区切りの整数で指定してください。')
+        if len(ids) > self.max_ids:
+            raise ApiError(f'idsは{self.max_ids}件まで指定できます。')
+        recipes = {
+            recipe.id: recipe
+            for recipe in self.get_queryset().filter(id__in=ids)
+        }
+        return json_response({
+            'results': [
+                self.serialize(recipes[recipe_id])
+                for recipe_id in dict.fromkeys(ids) if recipe_id in recipes
+            ],
+        })
+
+
+class RecipeApiDetailView(RecipeApiMixin, View):
+
+    def get(self, request, recipe_id, *args, **kwargs):
+        recipe = self.get_queryset().filter(id=recipe_id).first()
+        if recipe is None:
+            raise ApiError('レシピが見つかりません。', status=404)
+        return json_response(self.serialize(recipe))
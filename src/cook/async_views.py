@@ -0,0 +1,125 @@
+"""
+読み取り系のビューの非同期版(ASGI / uvicorn用)
+
+データベースには非同期のORM API、キャッシュ(django-redis)には同期APIを
+スレッドプールで呼び出す。テンプレートとコンテキストは同期版と同じものを使う
+どちらを使うかはsettings.ASYNC_READ_VIEWSでURLconfごとに切り替える
+"""
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.http import Http404
+from django.shortcuts import aget_object_or_404
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
+
+from . import cache as recipe_cache
+from .conditional import (
+    conditional_page,
+    arecipe_etag,
+    arecipe_last_modified
+)
+from .pagination import CursorPaginator
+from .views import RecipeListView, RecipeDetailView
+
+# Redisへのアクセスはイベントループのスレッドを塞がないように別スレッドで行う
+_get_page_key = sync_to_async(recipe_cache.get_page_key, thread_sensitive=False)
+_get_page = sync_to_async(recipe_cache.get_page, thread_sensitive=False)
+_set_page = sync_to_async(recipe_cache.set_page, thread_sensitive=False)
+# キャッシュにないカードはデータベースから取得するため、ORMと同じスレッドで行う
+_get_cards = sync_to_async(recipe_cache.get_cards)
+
+
+class AsyncMultipleObjectMixin:
+    """
+    ListViewのページネーションを非同期のORMで行う
+    件数とページのオブジェクトだけを非同期に取得し、ページの計算は同期版の処理を使う
+    """
+
+    async def apaginate_queryset(self, queryset, page_size):
+        self._object_count = await queryset.acount()
+        paginator, page, object_list, is_paginated = \
+            self.paginate_queryset(queryset, page_size)
+        page.object_list = [obj async for obj in object_list]
+        return paginator, page, page.object_list, is_paginated
+
+    def get_paginator(self, *args, **kwargs):
+        paginator = super().get_paginator(*args, **kwargs)
+        # countはcached_propertyのため、先に数えた件数を入れておくとクエリを発行しない
+        paginator.count = self._object_count
+        return paginator
+
+    async def aget_list_context(self, queryset):
+        paginator, page, object_list, is_paginated = \
+            await self.apaginate_queryset(queryset, self.paginate_by)
+        return {
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': is_paginated,
+            'object_list': object_list,
+            self.context_object_name: object_list,
+            'view': self,
+        }
+
+
+class AsyncRecipeListView(AsyncMultipleObjectMixin, RecipeListView):
+
+    async def apaginate_queryset(self, queryset, page_size):
+        if self.get_pagination_mode() != 'cursor':
+            return await super().apaginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(
+            queryset, page_size, ordering=self.get_ordering()
+        )
+        try:
+            page = await paginator.aget_page(
+                after=self.request.GET.get('after') or None,
+                before=self.request.GET.get('before') or None
+            )
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    async def get(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        page_cache_key = await _get_page_key(
+            'recipe_list', self.get_pagination_mode(), request.GET
+        )
+        cached_page = await _get_page(page_cache_key)
+        if cached_page is not None:
+            return TemplateResponse(request, self.template_name, {
+                'view': self,
+                'recipe_cards': await _get_cards(cached_page['ids']),
+                'pagination': mark_safe(cached_page['pagination']),
+            })
+
+        context = await self.aget_list_context(self.get_queryset())
+        recipes = context['recipes']
+        recipe_ids = [recipe.id for recipe in recipes]
+        context['recipe_cards'] = await _get_cards(recipe_ids, recipes=recipes)
+        context['pagination'] = render_to_string(
+            'common/pagination-button.html', {'page_obj': context['page_obj']}
+        )
+        await _set_page(page_cache_key, recipe_ids, context['pagination'])
+        return TemplateResponse(request, self.template_name, context)
+
+
+@method_decorator(
+    conditional_page(
+        etag_func=arecipe_etag, last_modified_func=arecipe_last_modified
+    ),
+    name='get'
+)
+class AsyncRecipeDetailView(RecipeDetailView):
+
+    async def get(self, request, *args, **kwargs):
+        recipe = await aget_object_or_404(
+            self.get_queryset(), id=self.kwargs[self.pk_url_kwarg]
+        )
+        return TemplateResponse(request, self.template_name, {
+            'object': recipe,
+            'recipe': recipe,
+            'view': self,
+            'is_author': recipe.user_id == request.user.id,
+        })
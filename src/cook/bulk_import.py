@@ -0,0 +1,202 @@
+"""
+レシピ・材料の一括取り込み(import_recipesコマンド)
+
+入力は1行1レシピのJSONL、または1行1材料のCSV(同じrecipe_idの行が連続する)
+{"user": "taro", "name": "肉じゃが", "description": "...", "posted_at": "...",
+ "ingredients": [{"name": "じゃがいも", "amount": "3個"}]}
+
+recipe_id,user,name,description,posted_at,ingredient_name,ingredient_amount
+"""
+import csv
+import json
+import logging
+from itertools import groupby
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from . import cache as recipe_cache
+from .catalog import CatalogResolver
+from .forms import RecipeForm, IngredientForm
+from .ingredient_index import IngredientIndex
+from .models import Recipe, Ingredient
+from .search import build_search_vector
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+CSV_COLUMNS = [
+    'recipe_id', 'user', 'name', 'description', 'posted_at',
+    'ingredient_name', 'ingredient_amount',
+]
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield None, f'JSONの形式が不正です: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield None, 'JSONのオブジェクトではありません'
+            continue
+        yield record, None
+
+
+def read_csv(stream):
+    """
+    同じrecipe_idの連続する行を1つのレシピにまとめる
+    recipe_idの列がない場合は1行を1つのレシピとする
+    """
+    reader = csv.DictReader(stream)
+    if 'recipe_id' in (reader.fieldnames or []):
+        groups = groupby(reader, key=lambda row: row['recipe_id'])
+    else:
+        groups = ((None, [row]) for row in reader)
+
+    for _, rows in groups:
+        rows = list(rows)
+        first = rows[0]
+        yield {
+            'user': first.get('user'),
+            'name': first.get('name'),
+            'description': first.get('description'),
+            'posted_at': first.get('posted_at'),
+            'ingredients': [
+                {
+                    'name': row.get('ingredient_name'),
+                    'amount': row.get('ingredient_amount'),
+                }
+                for row in rows
+                if row.get('ingredient_name') or row.get('ingredient_amount')
+            ],
+        }, None
+
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+
+def _form_errors(form):
+    return {field: list(errors) for field, errors in form.errors.items()}
+
+
+def validate_record(record):
+    """
+    RecipeForm / IngredientFormと同じ規則で検証する
+    (保存前のRecipe, [保存前のIngredient, ...], エラー)を返す
+    """
+    errors = {}
+    recipe_form = RecipeForm(data={
+        'name': record.get('name'),
+        'description': record.get('description'),
+    })
+    if not recipe_form.is_valid():
+        errors.update(_form_errors(recipe_form))
+
+    posted_at = None
+    if record.get('posted_at'):
+        try:
+            posted_at = parse_datetime(str(record['posted_at']))
+        except ValueError:
+            # 形式は正しいが存在しない日時(13月など)
+            posted_at = None
+        if posted_at is None:
+            errors['posted_at'] = ['日時の形式が不正です。']
+        elif timezone.is_naive(posted_at):
+            posted_at = timezone.make_aware(posted_at)
+
+    ingredients = []
+    ingredient_records = record.get('ingredients') or []
+    if not isinstance(ingredient_records, list):
+        errors['ingredients'] = ['材料はリストで指定してください。']
+        ingredient_records = []
+    for i, data in enumerate(ingredient_records):
+        form = IngredientForm(data=data if isinstance(data, dict) else {})
+        if form.is_valid():
+            ingredients.append(form.save(commit=False))
+        else:
+            errors[f'ingredients.{i}'] = _form_errors(form)
+
+    if not record.get('user'):
+        errors['user'] = ['投稿ユーザーを指定してください。']
+
+    if errors:
+        return None, None, errors
+    recipe = recipe_form.save(commit=False)
+    if posted_at:
+        recipe.posted_at = posted_at
+    return recipe, ingredients, None
+
+
+def save_batch(batch):
+    """
+    検証済みの[(Recipe, [Ingredient, ...]), ...]を保存する。呼び出し側のトランザクション内で実行する
+    レシピと材料はそれぞれ1回のINSERTで保存し、検索用のカラムも同じINSERTで設定する
+    (bulk_createではシグナルが送られないため)
+    """
+    resolver = CatalogResolver()
+    catalog_ids = resolver.resolve(
+        ingredient.name for _, ingredients in batch for ingredient in ingredients
+    )
+    catalog_names = dict(
+        resolver.catalogs.filter(id__in=set(catalog_ids.values()))
+        .values_list('id', 'name')
+    )
+    for recipe, ingredients in batch:
+        for ingredient in ingredients:
+            ingredient.catalog_id = catalog_ids[ingredient.name]
+        recipe.search_vector = build_search_vector(
+            recipe.name,
+            recipe.description,
+            [ingredient.name for ingredient in ingredients] + [
+                catalog_names[ingredient.catalog_id] for ingredient in ingredients
+            ]
+        )
+    # PostgreSQLではbulk_createで各Recipeにidが設定される
+    Recipe.objects.bulk_create([recipe for recipe, _ in batch])
+    new_ingredients = []
+    for recipe, ingredients in batch:
+        for ingredient in ingredients:
+            ingredient.recipe = recipe
+            new_ingredients.append(ingredient)
+    Ingredient.objects.bulk_create(new_ingredients)
+    # {レシピID: [材料の辞書のid, ...]}(転置インデックスの更新用)
+    return {
+        recipe.id: [ingredient.catalog_id for ingredient in ingredients]
+        for recipe, ingredients in batch
+    }
+
+
+def resolve_users(usernames):
+    """
+    {ユーザー名: ID}をまとめて取得する
+    """
+    return dict(
+        User.objects.filter(username__in=set(usernames))
+        .values_list('username', 'id')
+    )
+
+
+def after_import(recipe_catalogs):
+    """
+    コミット後に材料名の転置インデックスと一覧のキャッシュを更新する
+    (bulk_createではシグナルが送られないため)
+    """
+    try:
+        IngredientIndex().index_recipes(recipe_catalogs)
+        recipe_cache.invalidate_recipes(list(recipe_catalogs), list_changed=True)
+    except (RedisError, ConnectionInterrupted):
+        logger.warning(
+            'Failed to update ingredient index or cache after import '
+            '(run rebuild_ingredient_index)', exc_info=True
+        )
@@ -0,0 +1,212 @@
+"""
+レシピ一覧のページとレシピのカードのキャッシュ(Redis)
+
+Redisに接続できない場合、読み出し(get_page_key / get_page / set_page / get_cards)は
+キャッシュを使わずにデータベースから描画する。無効化(invalidate_recipes)のエラーは
+呼び出し側(cook.signalsなど)で処理する
+"""
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'recipe_cache'
+CARD_TEMPLATE = 'recipe/card.html'
+# カードのテンプレートを変更したときは上げる(古いキャッシュを使わないため)
+CARD_VERSION = 1
+
+GENERATION_KEY = f'{PREFIX}:generation'
+LIST_VERSION_KEY = f'{PREFIX}:list_version'
+
+
+def _timeout():
+    return getattr(settings, 'RECIPE_CACHE_TIMEOUT', 300)
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def get_versions():
+    """
+    (世代, 一覧のバージョン)を返す
+    世代を変えるとすべてのキャッシュが、一覧のバージョンを変えると一覧ページが無効になる
+    """
+    versions = cache.get_many([GENERATION_KEY, LIST_VERSION_KEY])
+    missing = {
+        key: _new_version()
+        for key in (GENERATION_KEY, LIST_VERSION_KEY)
+        if key not in versions
+    }
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions[GENERATION_KEY], versions[LIST_VERSION_KEY]
+
+
+def _card_key(generation, recipe_id):
+    return f'{PREFIX}:{generation}:card:v{CARD_VERSION}:{recipe_id}'
+
+
+def record(kind, hits=0, misses=0):
+    """
+    ヒット数・ミス数を全プロセスで共有するカウンタに加算する
+    """
+    for result, count in (('hit', hits), ('miss', misses)):
+        if not count:
+            continue
+        key = f'{PREFIX}:stats:{kind}:{result}'
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            cache.add(key, count, None)
+
+
+def get_stats():
+    """
+    {'card': {'hit': 10, 'miss': 2}, 'page': {...}}
+    """
+    kinds = ('card', 'page')
+    keys = {
+        (kind, result): f'{PREFIX}:stats:{kind}:{result}'
+        for kind in kinds
+        for result in ('hit', 'miss')
+    }
+    values = cache.get_many(keys.values())
+    return {
+        kind: {
+            result: values.get(keys[(kind, result)], 0)
+            for result in ('hit', 'miss')
+        }
+        for kind in kinds
+    }
+
+
+def get_page_key(name, mode, params):
+    """
+    一覧ページのキャッシュのキー(ページ番号・カーソルごと)
+    Redisに接続できない場合はNone(そのページはキャッシュしない)
+    """
+    try:
+        generation, list_version = get_versions()
+    except (RedisError, ConnectionInterrupted):
+        logger.warning('Recipe cache is unavailable', exc_info=True)
+        return None
+    query = '&'.join(
+        f'{key}={params.get(key, "")}' for key in ('page', 'after', 'before')
+    )
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return f'{PREFIX}:{generation}:{name}:{list_version}:{mode}:{digest}'
+
+
+def get_page(key):
+    if key is None:
+        return None
+    try:
+        page = cache.get(key)
+        if page is None:
+            record('page', misses=1)
+        else:
+            record('page', hits=1)
+    except (RedisError, ConnectionInterrupted):
+        logger.warning('Failed to read recipe list page cache', exc_info=True)
+        return None
+    return page
+
+
+def set_page(key, recipe_ids, pagination):
+    if key is None:
+        return
+    try:
+        cache.set(
+            key, {'ids': list(recipe_ids), 'pagination': pagination}, _timeout()
+        )
+    except (RedisError, ConnectionInterrupted):
+        logger.warning('Failed to write recipe list page cache', exc_info=True)
+
+
+def _render_cards(recipe_ids, recipes=None):
+    """
+    {レシピID: カードのHTML}。recipesが渡されていない場合はまとめて取得する
+    """
+    from .models import Recipe
+
+    if recipes is None:
+        objects = Recipe.objects.in_bulk(recipe_ids)
+    else:
+        objects = {recipe.id: recipe for recipe in recipes}
+    return {
+        recipe_id: render_to_string(CARD_TEMPLATE, {'recipe': objects[recipe_id]})
+        for recipe_id in recipe_ids
+        if recipe_id in objects
+    }
+
+
+def get_cards(recipe_ids, recipes=None):
+    """
+    レシピのカードのHTMLを返す。キャッシュにないものだけを描画する
+    recipesが渡されていない場合はキャッシュにないレシピをまとめて取得する
+    """
+    try:
+        generation, _ = get_versions()
+        keys = {
+            recipe_id: _card_key(generation, recipe_id) for recipe_id in recipe_ids
+        }
+        cards = cache.get_many(keys.values())
+    except (RedisError, ConnectionInterrupted):
+        logger.warning('Failed to read recipe card cache', exc_info=True)
+        rendered = _render_cards(recipe_ids, recipes)
+        return [
+            mark_safe(rendered[recipe_id])
+            for recipe_id in recipe_ids if recipe_id in rendered
+        ]
+
+    missing_ids = [
+        recipe_id for recipe_id, key in keys.items() if key not in cards
+    ]
+    rendered = {
+        keys[recipe_id]: card
+        for recipe_id, card in _render_cards(missing_ids, recipes).items()
+    } if missing_ids else {}
+    cards.update(rendered)
+    try:
+        if rendered:
+            cache.set_many(rendered, _timeout())
+        record('card', hits=len(keys) - len(missing_ids), misses=len(missing_ids))
+    except (RedisError, ConnectionInterrupted):
+        logger.warning('Failed to write recipe card cache', exc_info=True)
+    return [
+        mark_safe(cards[key]) for key in keys.values() if key in cards
+    ]
+
+
+def invalidate_recipes(recipe_ids, list_changed=False):
+    """
+    レシピのカードのキャッシュを削除する
+    レシピの追加・削除で一覧に表示するレシピが変わる場合は一覧のバージョンを上げる
+    (レシピの更新ではカードだけが変わるため一覧のページはそのまま使える)
+    """
+    generation, _ = get_versions()
+    cache.delete_many([
+        _card_key(generation, recipe_id) for recipe_id in recipe_ids
+    ])
+    if list_changed:
+        cache.set(LIST_VERSION_KEY, _new_version(), None)
+
+
+def clear():
+    """
+    世代を変えてすべてのキャッシュを無効にする(古いキーは期限切れで消える)
+    """
+    cache.set_many(
+        {GENERATION_KEY: _new_version(), LIST_VERSION_KEY: _new_version()},
+        None
+    )
@@ -0,0 +1,198 @@
+"""
+材料名の辞書(IngredientCatalog / IngredientAlias)
+
+材料の行(Ingredient)は入力どおりの表記をnameに残し、同じ材料を指す表記を
+まとめた辞書の行のid(catalog_id)を持つ。表記の揺れのうち全角・半角、大文字・小文字、
+カタカナ・ひらがな、空白はnormalize_ingredient_nameで吸収し、漢字・かなの違いなどは
+ALIASESに登録した別名で吸収する
+別名のテーブルは正規化した表記 -> 辞書のidの対応で、代表の表記自身も含む。
+表記から辞書のidを引く処理は別名のテーブルの1回の検索で済む
+"""
+import logging
+import time
+
+from django.apps import apps as global_apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .ingredient_index import normalize_ingredient_name
+
+logger = logging.getLogger(__name__)
+
+# 代表の表記: [同じ材料の別の表記, ...]
+# (カタカナ・ひらがなや全角・半角の違いは正規化で吸収されるため登録しなくてよい)
+ALIASES = {
+    '玉ねぎ': ['たまねぎ', '玉葱'],
+    '長ねぎ': ['長葱', '白ねぎ', '白葱'],
+    'にんじん': ['人参'],
+    'じゃがいも': ['じゃが芋', '馬鈴薯'],
+    'しいたけ': ['椎茸'],
+    'しめじ': ['占地'],
+    'ごぼう': ['牛蒡'],
+    'れんこん': ['蓮根'],
+    'なす': ['茄子'],
+    'しょうが': ['生姜'],
+    'にんにく': ['大蒜'],
+    'しょうゆ': ['醤油', 'しょう油', '醬油'],
+    'みりん': ['味醂'],
+    '味噌': ['みそ'],
+    '砂糖': ['さとう'],
+    'こしょう': ['胡椒'],
+    'ごま油': ['胡麻油'],
+    '白ごま': ['白胡麻', 'いりごま'],
+    '片栗粉': ['かたくり粉'],
+    '卵': ['玉子', 'たまご', '鶏卵'],
+    '豆腐': ['とうふ'],
+}
+
+
+def catalog_key(name):
+    """
+    辞書を引くキー(正規化した表記)
+    """
+    return normalize_ingredient_name(name)
+
+
+class CatalogResolver:
+    """
+    材料名 -> 辞書のid。辞書にない材料名は代表の表記として登録する
+    マイグレーションでは履歴のモデルとマイグレーションの接続(using)を渡して使う
+    """
+
+    def __init__(self, catalog_model=None, alias_model=None, using=None):
+        self.catalog_model = catalog_model or global_apps.get_model(
+            'cook', 'IngredientCatalog'
+        )
+        self.alias_model = alias_model or global_apps.get_model(
+            'cook', 'IngredientAlias'
+        )
+        self.using = using
+
+    @property
+    def catalogs(self):
+        return self.catalog_model.objects.using(self.using)
+
+    @property
+    def aliases(self):
+        return self.alias_model.objects.using(self.using)
+
+    def lookup(self, keys):
+        """
+        {キー: 辞書のid}(辞書にないキーは含まない)
+        """
+        return dict(
+            self.aliases.filter(key__in=set(keys))
+            .values_list('key', 'catalog_id')
+        )
+
+    def lookup_names(self, keys):
+        """
+        {キー: 代表の表記}(辞書にないキーは含まない)
+        """
+        return dict(
+            self.aliases.filter(key__in=set(keys))
+            .values_list('key', 'catalog__name')
+        )
+
+    def create(self, names_by_key):
+        """
+        {キー: 表記}を代表の表記として登録し、{キー: 辞書のid}を返す
+        同時に登録された場合は一意制約で片方を無視し、登録後に引き直す
+        """
+        self.catalogs.bulk_create([
+            self.catalog_model(name=name) for name in names_by_key.values()
+        ], ignore_conflicts=True)
+        catalog_ids = dict(
+            self.catalogs.filter(name__in=names_by_key.values())
+            .values_list('name', 'id')
+        )
+        self.aliases.bulk_create([
+            self.alias_model(key=key, catalog_id=catalog_ids[name])
+            for key, name in names_by_key.items()
+        ], ignore_conflicts=True)
+        return self.lookup(names_by_key)
+
+    def resolve(self, names):
+        """
+        {材料名: 辞書のid}。全て辞書にある場合は1回のクエリで済む
+        """
+        keys = {name: catalog_key(name) for name in set(names)}
+        found = self.lookup(keys.values())
+        missing = {}
+        for name, key in keys.items():
+            if key not in found:
+                missing.setdefault(key, name.strip())
+        if missing:
+            found.update(self.create(missing))
+        return {name: found[key] for name, key in keys.items()}
+
+    def assign(self, ingredients):
+        """
+        材料の行(保存前)のcatalog_idを設定する(bulk_create・bulk_updateの前に呼ぶ)
+        """
+        catalog_ids = self.resolve(ingredient.name for ingredient in ingredients)
+        for ingredient in ingredients:
+            ingredient.catalog_id = catalog_ids[ingredient.name]
+        return ingredients
+
+    def seed_aliases(self, aliases=ALIASES):
+        """
+        ALIASESを登録する。既に登録されている別名は変更しない
+        """
+        with transaction.atomic(using=self.using):
+            catalog_ids = self.resolve(aliases)
+            self.aliases.bulk_create([
+                self.alias_model(key=catalog_key(alias), catalog_id=catalog_ids[name])
+                for name, names in aliases.items()
+                for alias in names
+            ], ignore_conflicts=True)
+
+
+def backfill(ingredient_model, resolver, batch_size=20000, progress=None,
+             connection=None):
+    """
+    catalog_idが未設定の材料の行に、idの範囲ごとにcatalog_idを設定する
+    バッチごとにコミットするため、中断しても未設定の行から再開できる
+    progressには(処理済みの範囲の最後のid, 最大のid, 更新した行数)を渡す
+    マイグレーションではschema_editor.connectionを渡す
+    """
+    connection = connection or connections[DEFAULT_DB_ALIAS]
+    ingredients = ingredient_model.objects.using(connection.alias)
+    table = ingredient_model._meta.db_table
+    bounds = ingredients.filter(catalog__isnull=True).order_by('id')
+    first = bounds.values_list('id', flat=True).first()
+    last = bounds.order_by('-id').values_list('id', flat=True).first()
+    if first is None:
+        return 0
+
+    total = 0
+    start = time.perf_counter()
+    for lower in range(first, last + 1, batch_size):
+        upper = lower + batch_size
+        with transaction.atomic(using=connection.alias):
+            pending = ingredients.filter(
+                id__gte=lower, id__lt=upper, catalog__isnull=True
+            )
+            names = list(pending.values_list('name', flat=True).distinct())
+            if not names:
+                continue
+            catalog_ids = resolver.resolve(names)
+            # 範囲内の材料名ごとの辞書のidをVALUESで渡し、1回のUPDATEで設定する
+            values = ', '.join(['(%s, %s)'] * len(catalog_ids))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {table} AS i SET catalog_id = v.catalog_id '
+                    f'FROM (VALUES {values}) AS v (name, catalog_id) '
+                    f'WHERE i.name = v.name AND i.id >= %s AND i.id < %s '
+                    f'AND i.catalog_id IS NULL',
+                    [
+                        value for item in catalog_ids.items() for value in item
+                    ] + [lower, upper]
+                )
+                total += cursor.rowcount
+        if progress:
+            progress(min(upper - 1, last), last, total)
+    logger.info(
+        'Backfilled ingredient catalog: %d rows in %.1fs',
+        total, time.perf_counter() - start
+    )
+    return total
@@ -0,0 +1,133 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import Recipe
+
+# ページのテンプレートを変更したときは上げる(古いETagを一致させないため)
+CONTENT_VERSION = 1
+
+
+def make_etag(request, *parts):
+    """
+    ページの内容を決める値とログイン中のユーザからETagを作る
+    未表示のメッセージがある場合は毎回描画するためNoneを返す
+    """
+    if len(get_messages(request)):
+        return None
+    user = request.user
+    # 投稿者のページにはCSRFトークンが含まれるため、トークンが変わったら作り直す
+    csrf_cookie = request.META.get('CSRF_COOKIE') if user.is_authenticated else None
+    value = repr((CONTENT_VERSION, user.id, csrf_cookie) + parts)
+    return hashlib.sha1(value.encode()).hexdigest()
+
+
+def _recipe_validator(request, recipe_id):
+    """
+    (更新日時, 投稿者名)をリクエストごとに一度だけ取得する
+    """
+    if not hasattr(request, '_recipe_validator'):
+        request._recipe_validator = Recipe.objects.filter(
+            id=recipe_id
+        ).values_list('updated_at', 'user__username').first()
+    return request._recipe_validator
+
+
+async def _arecipe_validator(request, recipe_id):
+    if not hasattr(request, '_recipe_validator'):
+        request._recipe_validator = await Recipe.objects.filter(
+            id=recipe_id
+        ).values_list('updated_at', 'user__username').afirst()
+    return request._recipe_validator
+
+
+def recipe_etag(request, recipe_id):
+    validator = _recipe_validator(request, recipe_id)
+    if validator is None:
+        return None
+    updated_at, username = validator
+    return make_etag(request, recipe_id, updated_at.isoformat(), username)
+
+
+def recipe_last_modified(request, recipe_id):
+    validator = _recipe_validator(request, recipe_id)
+    if validator is None or len(get_messages(request)):
+        return None
+    return validator[0]
+
+
+async def arecipe_etag(request, recipe_id):
+    await _arecipe_validator(request, recipe_id)
+    return recipe_etag(request, recipe_id)
+
+
+async def arecipe_last_modified(request, recipe_id):
+    await _arecipe_validator(request, recipe_id)
+    return recipe_last_modified(request, recipe_id)
+
+
+def _patch_cache_control(request, response):
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        # no-cacheを返すとnginxが保存しないため、ブラウザにはmax-age=0で再検証させ、
+        # nginxにはs-maxageの間だけ保存させる
+        patch_cache_control(
+            response, public=True, max_age=0, must_revalidate=True,
+            s_maxage=settings.PAGE_CACHE_SHARED_MAX_AGE
+        )
+
+
+def conditional_page(etag_func=None, last_modified_func=None):
+    """
+    If-None-Match / If-Modified-Since が一致した場合はビューを実行せずに304を返す
+    ページはユーザごとに異なるため、ブラウザには毎回再検証させる
+    非同期のビューにはetag_func / last_modified_funcも非同期関数を渡す
+    """
+    def decorator(view_func):
+        if not iscoroutinefunction(view_func):
+            conditional_view = condition(
+                etag_func=etag_func, last_modified_func=last_modified_func
+            )(view_func)
+
+            @wraps(view_func)
+            def inner(request, *args, **kwargs):
+                response = conditional_view(request, *args, **kwargs)
+                _patch_cache_control(request, response)
+                return response
+            return inner
+
+        # conditionは検証用の値を同期的に求めるため、先に非同期で求めた値を渡す
+        conditional_view = condition(
+            etag_func=etag_func and (
+                lambda request, *args, **kwargs: request._conditional_etag
+            ),
+            last_modified_func=last_modified_func and (
+                lambda request, *args, **kwargs: request._conditional_last_modified
+            )
+        )(view_func)
+
+        @wraps(view_func)
+        async def ainner(request, *args, **kwargs):
+            # 以降の同期的な参照(ETagやテンプレートのcontext processor)で
+            # ログインユーザのクエリを発行しないように先に取得しておく
+            request.user = await request.auser()
+            if etag_func:
+                request._conditional_etag = await etag_func(
+                    request, *args, **kwargs
+                )
+            if last_modified_func:
+                request._conditional_last_modified = await last_modified_func(
+                    request, *args, **kwargs
+                )
+            response = await conditional_view(request, *args, **kwargs)
+            _patch_cache_control(request, response)
+            return response
+        return ainner
+    return decorator
@@ -0,0 +1,199 @@
+"""
+レシピ・ユーザの削除
+
+Model.deleteは関連するレシピ・材料をすべて読み込み、1件ずつシグナルを送ってから削除するため、
+投稿の多いユーザの削除はリクエストを長く止め、ワーカーのメモリも多く使う。
+削除のリクエストでは対象を見えなくして(Recipe.deleted_at / User.is_active)DeletionJobを
+作るだけにし、レシピ・材料はpurgeでレシピのidの順にバッチごとに削除する
+画像は参照数(ImageBlob)を減らし、どのレシピからも参照されなくなったファイルを削除する
+各バッチの削除と進捗の更新は同じトランザクションで行うため、中断しても続きから再開できる
+(purge_deletedで未完了のジョブを再開する)
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from . import cache as recipe_cache
+from .db_utils import raw_delete
+from .images import collect_images, release_images
+from .ingredient_index import IngredientIndex
+from .models import DeletionJob, Ingredient, Recipe
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+_executor = None
+
+
+def _invalidate_lists():
+    try:
+        recipe_cache.invalidate_recipes([], list_changed=True)
+    except (RedisError, ConnectionInterrupted):
+        logger.warning('Failed to invalidate recipe list cache', exc_info=True)
+
+
+def _hide(kind, object_id, recipes):
+    """
+    レシピを見えなくしてジョブを作り、コミット後に一覧のキャッシュを無効にして削除を始める
+    """
+    now = timezone.now()
+    total = recipes.update(deleted_at=now, updated_at=now)
+    job, _ = DeletionJob.objects.get_or_create(
+        kind=kind, object_id=object_id, defaults={'total_recipes': total}
+    )
+    _invalidate_lists()
+    transaction.on_commit(_invalidate_lists)
+    transaction.on_commit(partial(schedule_purge, job.id))
+    return job
+
+
+@transaction.atomic
+def delete_recipe(recipe):
+    job = _hide(
+        DeletionJob.KIND_RECIPE, recipe.id, Recipe.objects.filter(id=recipe.id)
+    )
+    # 削除を待つ間も材料からの提案(RecipeSuggestView)の上位に残らないようにする
+    # (ユーザのレシピはpurge_batchでバッチごとに消す。それまでは提案の表示から除く)
+    transaction.on_commit(partial(_remove_from_index, [recipe.id]))
+    return job
+
+
+@transaction.atomic
+def delete_user(user):
+    """
+    ログインできないようにし、ユーザとレシピを見えなくする
+    (レシピは1回のUPDATEで、行を読み込まずに更新する)
+    """
+    User.objects.filter(id=user.id).update(is_active=False)
+    return _hide(
+        DeletionJob.KIND_USER, user.id, Recipe.all_objects.filter(user_id=user.id)
+    )
+
+
+def _job_recipes(job):
+    if job.kind == DeletionJob.KIND_USER:
+        return Recipe.all_objects.filter(user_id=job.object_id)
+    return Recipe.all_objects.filter(id=job.object_id)
+
+
+def _remove_from_index(recipe_ids):
+    try:
+        IngredientIndex().remove_recipes(recipe_ids)
+    except RedisError:
+        logger.warning(
+            'Failed to remove deleted recipes from ingredient index '
+            '(run rebuild_ingredient_index)', exc_info=True
+        )
+
+
+def purge_batch(job_id, batch_size):
+    """
+    ジョブのレシピをbatch_size件削除する。レシピが残っていない場合はユーザを削除して完了にする
+    他のワーカーが処理中のジョブ・完了済みのジョブはNoneを返す
+    """
+    with transaction.atomic():
+        job = DeletionJob.objects.select_for_update(skip_locked=True).filter(
+            id=job_id, finished_at__isnull=True
+        ).first()
+        if job is None:
+            return None
+        recipes = list(
+            _job_recipes(job).order_by('id').values_list('id', 'image')[:batch_size]
+        )
+        recipe_ids = [recipe_id for recipe_id, _ in recipes]
+        image_names = [image for _, image in recipes if image]
+        if recipe_ids:
+            # 画像の参照数は行の削除と同じトランザクションで減らす
+            release_images(image_names)
+            # QuerySet.deleteはレシピ・材料を読み込んでシグナルを送るため、1回のDELETEで削除する
+            job.deleted_ingredients += raw_delete(
+                Ingredient, recipe_ids, field='recipe'
+            )
+            job.deleted_recipes += raw_delete(Recipe, recipe_ids)
+        else:
+            if job.kind == DeletionJob.KIND_USER:
+                # レシピは削除済みのため、残りの関連(メールアドレスなど)は少ない
+                User.objects.filter(id=job.object_id).delete()
+            job.finished_at = timezone.now()
+            job.error = ''
+        job.save()
+    if recipe_ids:
+        _remove_from_index(recipe_ids)
+    if image_names:
+        # 他のレシピが使っていない画像とレンディションを削除する
+        # (アップロードされたばかりの画像など、ここで消せなかったものはgc_imagesで削除する)
+        deleted, _ = collect_images(image_names)
+        if deleted:
+            DeletionJob.objects.filter(id=job.id).update(
+                deleted_files=F('deleted_files') + deleted
+            )
+            job.deleted_files += deleted
+    return job
+
+
+def purge(job_id, batch_size=None, progress=None):
+    """
+    ジョブが完了するまでpurge_batchを繰り返す。progressには各バッチの後のジョブを渡す
+    """
+    batch_size = batch_size or getattr(settings, 'DELETION_BATCH_SIZE', 500)
+    while True:
+        try:
+            job = purge_batch(job_id, batch_size)
+        except Exception as e:
+            DeletionJob.objects.filter(id=job_id).update(
+                error=f'{type(e).__name__}: {e}', updated_at=timezone.now()
+            )
+            raise
+        if job is None:
+            return None
+        if progress:
+            progress(job)
+        if job.finished_at:
+            logger.info(
+                'Deleted %s %s: %d recipes, %d ingredients, %d files',
+                job.kind, job.object_id, job.deleted_recipes,
+                job.deleted_ingredients, job.deleted_files
+            )
+            return job
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'DELETION_WORKERS', 1),
+            thread_name_prefix='deletion'
+        )
+    return _executor
+
+
+def schedule_purge(job_id):
+    """
+    削除をリクエストの処理とは別のスレッドで実行する
+    DELETION_BACKGROUND = Falseの場合はその場で実行する
+    """
+    if not getattr(settings, 'DELETION_BACKGROUND', True):
+        purge(job_id)
+        return
+    _get_executor().submit(_run_in_background, job_id)
+
+
+def _run_in_background(job_id):
+    from django.db import close_old_connections
+
+    try:
+        purge(job_id)
+    except Exception:
+        # ジョブは未完了のまま残り、purge_deletedで再開できる
+        logger.exception('Failed to purge deletion job %s', job_id)
+    finally:
+        close_old_connections()
@@ -0,0 +1,174 @@
+"""
+レシピ・材料の書き出し(エクスポート用のビューとexport_recipesコマンド)
+
+レシピはidのキーセットでbatch_size件ずつ、材料はそのレシピ分を1回のクエリで取得し、
+1行ずつ文字列を返すため、件数が増えてもメモリの使用量は変わらない
+ASGI(uvicorn)ではaexport_recipesの非同期イテレータを返す(同期のイテレータを渡すと
+StreamingHttpResponseはすべての行をリストにしてから送信するため)
+出力の形式はcook.bulk_importの入力と同じ(import_recipesでそのまま取り込める)
+"""
+import csv
+import json
+from itertools import groupby
+
+from asgiref.sync import sync_to_async
+from django import forms
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .bulk_import import CSV_COLUMNS
+from .models import Recipe, Ingredient
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class ExportFilterForm(forms.Form):
+    format = forms.ChoiceField(
+        choices=[(fmt, fmt) for fmt in CONTENT_TYPES], required=False
+    )
+    user = forms.CharField(required=False, label='投稿ユーザー')
+    since = forms.DateTimeField(required=False, label='投稿日(から)')
+    until = forms.DateTimeField(required=False, label='投稿日(より前)')
+
+    def clean_format(self):
+        return self.cleaned_data['format'] or 'csv'
+
+    def get_queryset(self):
+        return filter_recipes(
+            user=self.cleaned_data['user'],
+            since=self.cleaned_data['since'],
+            until=self.cleaned_data['until']
+        )
+
+
+def filter_recipes(user=None, since=None, until=None):
+    """
+    user(ユーザー名)と投稿日の範囲 since <= posted_at < until で絞り込む
+    """
+    queryset = Recipe.objects.all()
+    if user:
+        queryset = queryset.filter(user__username=user)
+    if since:
+        queryset = queryset.filter(posted_at__gte=since)
+    if until:
+        queryset = queryset.filter(posted_at__lt=until)
+    return queryset
+
+
+def fetch_batch(queryset, last_id, batch_size):
+    """
+    idがlast_idより大きいレシピbatch_size件の[{レシピの値, 'ingredients': [...]}]
+    OFFSETやサーバサイドカーソルを使わずに、前のバッチの最後のidから続きを取得する
+    (トランザクションを開いたままにしないため、レスポンスの送信中も接続を占有しない)
+    """
+    recipes = list(
+        queryset.filter(id__gt=last_id)
+        .order_by('id')
+        .values(
+            'id', 'user__username', 'name', 'description', 'posted_at'
+        )[:batch_size]
+    )
+    if not recipes:
+        return []
+    ingredients = (
+        Ingredient.objects.filter(
+            recipe_id__in=[recipe['id'] for recipe in recipes]
+        )
+        .order_by('recipe_id', 'id')
+        .values_list('recipe_id', 'name', 'amount')
+    )
+    ingredients_by_recipe = {
+        recipe_id: [{'name': name, 'amount': amount} for _, name, amount in rows]
+        for recipe_id, rows in groupby(ingredients, key=lambda row: row[0])
+    }
+    return [
+        {
+            'id': recipe['id'],
+            'user': recipe['user__username'],
+            'name': recipe['name'],
+            'description': recipe['description'],
+            'posted_at': recipe['posted_at'],
+            'ingredients': ingredients_by_recipe.get(recipe['id'], []),
+        }
+        for recipe in recipes
+    ]
+
+
+def iter_recipes(queryset, batch_size=1000):
+    """
+    {レシピの値, 'ingredients': [...]}をid順に返す
+    """
+    last_id = 0
+    while True:
+        recipes = fetch_batch(queryset, last_id, batch_size)
+        if not recipes:
+            return
+        yield from recipes
+        last_id = recipes[-1]['id']
+
+
+class _Echo:
+    """
+    csv.writerが書き込んだ文字列をそのまま返す
+    """
+
+    def write(self, value):
+        return value
+
+
+def to_csv(recipes, header=True):
+    """
+    1行1材料(材料のないレシピは材料の列を空にした1行)
+    """
+    writer = csv.writer(_Echo())
+    if header:
+        yield writer.writerow(CSV_COLUMNS)
+    for recipe in recipes:
+        values = [
+            recipe['id'],
+            recipe['user'],
+            recipe['name'],
+            recipe['description'],
+            recipe['posted_at'].isoformat(),
+        ]
+        for ingredient in recipe['ingredients'] or [{'name': '', 'amount': ''}]:
+            yield writer.writerow(
+                values + [ingredient['name'], ingredient['amount']]
+            )
+
+
+def to_jsonl(recipes, header=True):
+    """
+    1行1レシピ(ヘッダーの行はない)
+    """
+    for recipe in recipes:
+        yield json.dumps(
+            recipe, cls=DjangoJSONEncoder, ensure_ascii=False
+        ) + '\n'
+
+
+WRITERS = {
+    'csv': to_csv,
+    'jsonl': to_jsonl,
+}
+
+
+def export_recipes(queryset, fmt='csv', batch_size=1000):
+    return WRITERS[fmt](iter_recipes(queryset, batch_size))
+
+
+async def aexport_recipes(queryset, fmt='csv', batch_size=1000):
+    """
+    export_recipesの非同期版。バッチの取得だけをORMのスレッドで行い、1バッチずつ送信する
+    """
+    write = WRITERS[fmt]
+    fetch = sync_to_async(fetch_batch)
+    recipes = await fetch(queryset, 0, batch_size)
+    for line in write(recipes):
+        yield line
+    while recipes:
+        recipes = await fetch(queryset, recipes[-1]['id'], batch_size)
+        for line in write(recipes, header=False):
+            yield line
@@ -1,7 +1,11 @@
 from django import forms
-from django.forms import ModelForm
+from django.core.exceptions import ValidationError
+from django.forms import BaseFormSet, BaseInlineFormSet, ModelForm
 
+from .catalog import CatalogResolver
+from .db_utils import raw_delete
 from .models import Recipe, Ingredient
+from .signals import ingredients_bulk_changed
 from .redis_utils import RedisHandler
 
 
@@ -64,3 +68,90 @@ class IngredientForm(ModelForm):
 
     def set_num_of_forms(self, user_id, count):
         self.redis_handler.set_key_and_value(f'form_count_{user_id}', count)
+
+
+class IngredientFormSet(BaseInlineFormSet):
+    """
+    送信されたフォームの数(TOTAL_FORMS)がIngredientFormの最小数〜最大数の範囲にあることを検証する
+    (ブラウザでフォームを追加・削除するため、送信時にサーバで確認する)
+    """
+
+    def clean(self):
+        super().clean()
+        count = self.total_form_count()
+        if not IngredientForm.min_form_num <= count <= IngredientForm.max_form_num:
+            raise ValidationError(
+                f'材料のフォームは{IngredientForm.min_form_num}〜'
+                f'{IngredientForm.max_form_num}個にしてください。'
+            )
+
+
+class IngredientBulkForm(IngredientForm):
+    """
+    一括編集の1行(idがない行は追加する材料)
+    """
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput)
+
+
+class IngredientBulkFormSet(BaseFormSet):
+    """
+    レシピの材料をまとめて編集するフォームセット
+    モデルフォームセットは行ごとにidの存在を確認するクエリを実行するため、
+    レシピの材料を1回で取得して渡し、idはその中にあることだけを確認する
+    """
+
+    def __init__(self, *args, ingredients=(), **kwargs):
+        self.ingredients = {ingredient.id: ingredient for ingredient in ingredients}
+        kwargs.setdefault('initial', [
+            {'id': ingredient.id, 'name': ingredient.name, 'amount': ingredient.amount}
+            for ingredient in self.ingredients.values()
+        ])
+        super().__init__(*args, **kwargs)
+
+    def clean(self):
+        super().clean()
+        ids = [
+            form.cleaned_data['id'] for form in self.forms
+            if form.cleaned_data.get('id') is not None
+        ]
+        if any(id_ not in self.ingredients for id_ in ids) or len(ids) != len(set(ids)):
+            raise ValidationError('このレシピの材料ではない材料が含まれています。')
+
+    def save(self, recipe):
+        """
+        変更した行をbulk_update、追加した行をbulk_create、削除した行を1回のDELETEで保存する
+        行数によらずクエリ数は一定。材料のシグナルの処理はレシピごとに1回まとめて行う
+        """
+        changed, created, deleted_ids = [], [], []
+        for form in self.forms:
+            data = form.cleaned_data
+            if not data:
+                continue
+            ingredient = self.ingredients.get(data['id'])
+            if self.can_delete and self._should_delete_form(form):
+                if ingredient is not None:
+                    deleted_ids.append(ingredient.id)
+            elif ingredient is None:
+                created.append(Ingredient(
+                    recipe=recipe, name=data['name'], amount=data['amount']
+                ))
+            elif (ingredient.name, ingredient.amount) != (data['name'], data['amount']):
+                ingredient.name, ingredient.amount = data['name'], data['amount']
+                changed.append(ingredient)
+
+        if changed or created:
+            CatalogResolver().assign(changed + created)
+        if changed:
+            Ingredient.objects.bulk_update(changed, ['name', 'amount', 'catalog'])
+        if created:
+            Ingredient.objects.bulk_create(created)
+        if deleted_ids:
+            # QuerySet.deleteは材料ごとにシグナルを送るため、1回のDELETEで削除する
+            raw_delete(Ingredient, deleted_ids)
+        if changed or created or deleted_ids:
+            ingredients_bulk_changed(recipe.id)
+        return {
+            'updated': len(changed),
+            'created': len(created),
+            'deleted': len(deleted_ids),
+        }
@@ -0,0 +1,232 @@
+import logging
+import posixpath
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from django_redis.exceptions import ConnectionInterrupted
+from PIL import Image, ImageOps
+from redis.exceptions import RedisError
+
+from .cache import invalidate_recipes
+from .storage import image_storage
+
+logger = logging.getLogger(__name__)
+
+# 一覧(100px)・詳細(200px)・拡大表示(800px)用の正方形の画像を作成する
+RENDITION_WIDTHS = (100, 200, 800)
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+
+def rendition_name(image_name, width, fmt):
+    """
+    images/foo.png -> renditions/images/foo_200.webp
+    """
+    stem, _ = posixpath.splitext(image_name)
+    return f'renditions/{stem}_{width}.{fmt}'
+
+
+def rendition_names(image_name):
+    return [
+        rendition_name(image_name, width, fmt)
+        for width in RENDITION_WIDTHS
+        for fmt in RENDITION_FORMATS
+    ]
+
+
+def generate_renditions(image_name, storage=default_storage):
+    """
+    元の画像(image_storage)からすべてのサイズ・形式の画像を作成してstorageに保存する
+    レンディションの名前は元の画像の名前から決めるため、内容のハッシュは使わない
+    元の画像は内容のハッシュの名前で複数のレシピが共有するため、作成済みのレンディションは
+    削除・上書きせずにそのまま使い、足りないものだけを作成する
+    """
+    missing = [
+        name for name in rendition_names(image_name) if not storage.exists(name)
+    ]
+    if not missing:
+        return
+    with image_storage().open(image_name) as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image = image.convert('RGB')
+
+    for width in RENDITION_WIDTHS:
+        resized = ImageOps.fit(image, (width, width), Image.Resampling.LANCZOS)
+        for fmt, (pil_format, options) in RENDITION_FORMATS.items():
+            name = rendition_name(image_name, width, fmt)
+            if name not in missing:
+                continue
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def delete_renditions(image_name, storage=default_storage):
+    for name in rendition_names(image_name):
+        if storage.exists(name):
+            storage.delete(name)
+
+
+def generate_recipe_renditions(recipe_id):
+    """
+    レシピの画像のレンディションを作成し、作成済みのフラグを立てる
+    作成中に画像が変更された場合はフラグを立てない
+    """
+    from .models import Recipe
+
+    recipe = Recipe.objects.filter(id=recipe_id).only('id', 'image').first()
+    if recipe is None or not recipe.image:
+        return
+    try:
+        generate_renditions(recipe.image.name)
+    except (OSError, Image.DecompressionBombError):
+        logger.warning(
+            'Failed to generate renditions for recipe %s', recipe_id,
+            exc_info=True
+        )
+        return
+    updated = Recipe.objects.filter(
+        id=recipe_id, image=recipe.image.name
+    ).update(image_renditions_ready=True, updated_at=timezone.now())
+    if updated:
+        # 一覧のカードをレンディションを使うHTMLに描画し直す
+        # (失敗してもフラグは立っているため、キャッシュの期限切れ後に反映される)
+        try:
+            invalidate_recipes([recipe_id])
+        except (RedisError, ConnectionInterrupted):
+            logger.warning(
+                'Failed to invalidate cache for recipe %s', recipe_id,
+                exc_info=True
+            )
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_RENDITION_WORKERS', 2),
+            thread_name_prefix='image-rendition'
+        )
+    return _executor
+
+
+def schedule_recipe_renditions(recipe_id):
+    """
+    レンディションの作成をリクエストの処理とは別のスレッドで実行する
+    IMAGE_RENDITION_BACKGROUND = Falseの場合はその場で実行する
+    """
+    if not getattr(settings, 'IMAGE_RENDITION_BACKGROUND', True):
+        generate_recipe_renditions(recipe_id)
+        return
+    _get_executor().submit(_run_in_background, recipe_id)
+
+
+def _run_in_background(recipe_id):
+    from django.db import close_old_connections
+
+    try:
+        generate_recipe_renditions(recipe_id)
+    except Exception:
+        # Futureの結果は誰も読まないため、ここで記録しないと例外が失われる
+        logger.exception('Failed to generate renditions for recipe %s', recipe_id)
+    finally:
+        close_old_connections()
+
+
+def acquire_images(names):
+    """
+    画像ファイルの参照数を増やす(ImageBlobがない場合は作る)
+    """
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+    storage = image_storage()
+    now = timezone.now()
+    rows = []
+    for name, count in counts.items():
+        try:
+            size = storage.size(name)
+        except OSError:
+            size = 0
+        rows.extend([name, size, count, now])
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(counts))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO cook_imageblob (name, size, refcount, updated_at) '
+            f'VALUES {values} ON CONFLICT (name) DO UPDATE SET '
+            f'refcount = cook_imageblob.refcount + EXCLUDED.refcount, '
+            f'updated_at = EXCLUDED.updated_at', rows
+        )
+
+
+def release_images(names):
+    """
+    画像ファイルの参照数を減らす(ファイルはcollect_imagesで削除する)
+    """
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+    values = ', '.join(['(%s, %s)'] * len(counts))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE cook_imageblob AS b SET refcount = b.refcount - v.count, '
+            f'updated_at = %s FROM (VALUES {values}) AS v (name, count) '
+            f'WHERE b.name = v.name',
+            [timezone.now()] + [value for item in counts.items() for value in item]
+        )
+
+
+def collect_images(names=None, grace=None, limit=1000):
+    """
+    参照数が0以下の画像ファイルとレンディションを削除し、(削除した数, バイト数)を返す
+    参照数がずれていてもレシピから参照されているファイルは削除せず、参照数を直す
+    同じ内容の画像がアップロードされたばかりのファイル(更新日時がgrace秒以内)は次回に回す
+    """
+    from .models import ImageBlob, Recipe
+
+    if grace is None:
+        grace = getattr(settings, 'IMAGE_GC_GRACE_SECONDS', 600)
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    storage = image_storage()
+    deleted_ids = []
+    freed = 0
+    with transaction.atomic():
+        blobs = ImageBlob.objects.select_for_update(skip_locked=True).filter(
+            refcount__lte=0
+        )
+        if names is not None:
+            blobs = blobs.filter(name__in=set(names))
+        blobs = list(blobs.order_by('updated_at')[:limit])
+        referenced = Counter(
+            Recipe.all_objects.filter(image__in=[blob.name for blob in blobs])
+            .values_list('image', flat=True)
+        )
+        for blob in blobs:
+            if referenced[blob.name]:
+                blob.refcount = referenced[blob.name]
+                blob.save(update_fields=['refcount', 'updated_at'])
+                continue
+            try:
+                if storage.exists(blob.name):
+                    if storage.get_modified_time(blob.name) > cutoff:
+                        continue
+                    storage.delete(blob.name)
+                delete_renditions(blob.name)
+            except OSError:
+                logger.warning('Failed to delete image %s', blob.name, exc_info=True)
+                continue
+            deleted_ids.append(blob.id)
+            freed += blob.size
+        ImageBlob.objects.filter(id__in=deleted_ids).delete()
+    return len(deleted_ids), freed
@@ -0,0 +1,267 @@
+import re
+
+from django.conf import settings
+
+from .metrics import observe_redis
+from .redis_utils import RedisHandler
+from .search import normalize
+
+SPACE_PATTERN = re.compile(r'\s+')
+
+# 手持ちの材料のZSETをスコアの高い順に少しずつ読み、カバー率の上位limit件を求める
+# (Threshold Algorithm)。まだ読んでいないレシピのカバー率は各ZSETで最後に読んだ
+# スコアの合計を超えないため、上位limit件がその値以上になった時点で打ち切る。
+# 定番の材料を含む検索でもZSET全体を合計(ZUNIONSTORE)せずに済む
+# KEYS: 材料のZSET, ARGV: limit, batch_size, レシピのキーのprefix, 材料の辞書のid...
+SEARCH_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local batch = tonumber(ARGV[2])
+local prefix = ARGV[3]
+local names = {}
+for i = 4, #ARGV do names[#names + 1] = ARGV[i] end
+
+local positions, bounds, seen, top = {}, {}, {}, {}
+for i = 1, #KEYS do
+  positions[i] = 0
+  bounds[i] = 1
+end
+
+local function insert(id, coverage, match, size)
+  local pos = #top + 1
+  for i = 1, #top do
+    if coverage > top[i][2] or
+        (coverage == top[i][2] and match > top[i][3]) then
+      pos = i
+      break
+    end
+  end
+  if pos <= limit then
+    table.insert(top, pos, {id, coverage, match, size})
+    if #top > limit then table.remove(top) end
+  end
+end
+
+while true do
+  local threshold = 0
+  for i = 1, #KEYS do
+    if bounds[i] > 0 then
+      local rows = redis.call(
+        'ZREVRANGE', KEYS[i], positions[i], positions[i] + batch - 1,
+        'WITHSCORES'
+      )
+      positions[i] = positions[i] + batch
+      if #rows < batch * 2 then
+        bounds[i] = 0
+      else
+        bounds[i] = tonumber(rows[#rows])
+      end
+      for j = 1, #rows, 2 do
+        local id = rows[j]
+        if not seen[id] then
+          seen[id] = true
+          local flags = redis.call('SMISMEMBER', prefix .. id, unpack(names))
+          local match = 0
+          for _, flag in ipairs(flags) do match = match + flag end
+          local size = redis.call('SCARD', prefix .. id)
+          if size > 0 then insert(id, match / size, match, size) end
+        end
+      end
+    end
+    threshold = threshold + bounds[i]
+  end
+  if threshold == 0 or
+      (#top >= limit and top[#top][2] >= math.min(threshold, 1)) then
+    break
+  end
+end
+
+local result = {}
+for _, row in ipairs(top) do
+  result[#result + 1] = row[1]
+  result[#result + 1] = row[3]
+  result[#result + 1] = row[4] - row[3]
+end
+return result
+"""
+
+
+def normalize_ingredient_name(name):
+    """
+    材料名を転置インデックスのキー用に正規化する
+    全角・半角(NFKC)、大文字・小文字、カタカナ・ひらがなの違いと空白を無視する
+    """
+    name = SPACE_PATTERN.sub('', normalize(name))
+    return ''.join(
+        chr(ord(char) - 0x60) if 'ァ' <= char <= 'ヶ' else char
+        for char in name
+    )
+
+
+def resolve_catalog_ids(names, max_names=None):
+    """
+    手持ちの材料名 -> 材料の辞書のid(1回のクエリ)
+    辞書にない材料名はどのレシピの材料にも一致しないため除く
+    """
+    from .catalog import CatalogResolver, catalog_key
+
+    keys = sorted({catalog_key(name) for name in names} - {''})[:max_names]
+    if not keys:
+        return []
+    return sorted(set(CatalogResolver().lookup(keys).values()))
+
+
+def search_database(catalog_ids, limit=10):
+    """
+    IngredientIndex.search_catalogsと同じ結果をデータベースから求める(Redisに接続できない場合用)
+    手持ちの材料を含むレシピだけを材料の辞書のidの索引で絞り込み、レシピごとに数える
+    """
+    from django.db.models import Count, F, FloatField, Q
+    from django.db.models.functions import Cast
+
+    from .models import Ingredient
+
+    if not catalog_ids:
+        return []
+    rows = (
+        Ingredient.objects.filter(
+            recipe_id__in=Ingredient.objects.filter(
+                catalog_id__in=catalog_ids, recipe__deleted_at__isnull=True
+            ).values('recipe_id')
+        )
+        .values('recipe_id')
+        .annotate(
+            size=Count('catalog_id', distinct=True),
+            match=Count(
+                'catalog_id', distinct=True, filter=Q(catalog_id__in=catalog_ids)
+            ),
+        )
+        .annotate(coverage=Cast('match', FloatField()) / F('size'))
+        .order_by('-coverage', '-match', 'recipe_id')
+        .values_list('recipe_id', 'match', 'size')[:limit]
+    )
+    return [(recipe_id, match, size - match) for recipe_id, match, size in rows]
+
+
+class IngredientIndex:
+    """
+    材料の辞書のid(Ingredient.catalog_id) -> レシピIDの転置インデックス(Redis)
+
+    {prefix}catalog:<辞書のid>  ZSET  member: レシピID, score: 1 / レシピの材料数
+    {prefix}recipe:<ID>         SET   レシピの材料の辞書のid(更新・削除時に古い材料を消すため)
+
+    手持ちの材料のZSETでのスコアの合計が、レシピの材料のうち手持ちで揃う割合
+    (カバー率)になる。検索はSEARCH_SCRIPTで上位のレシピだけを読み込む
+    材料名の表記の揺れと別名(人参 / にんじんなど)は辞書のidで吸収されるため、
+    インデックスの作成でも検索でも材料名の文字列は扱わない
+    """
+
+    # 検索時に1回で読み込むZSETの要素数
+    batch_size = 200
+    # 検索に使う材料の最大数
+    max_names = 50
+    _search_script = None
+
+    def __init__(self, redis_handler=None):
+        self.redis_handler = redis_handler or RedisHandler()
+        self.prefix = getattr(
+            settings, 'INGREDIENT_INDEX_PREFIX', 'ingredient_index:'
+        )
+
+    def _catalog_key(self, catalog_id):
+        return f'{self.prefix}catalog:{catalog_id}'
+
+    def _recipe_key(self, recipe_id):
+        return f'{self.prefix}recipe:{recipe_id}'
+
+    def _remove(self, pipe, recipe_id, old_catalog_ids):
+        for catalog_id in old_catalog_ids:
+            pipe.zrem(self._catalog_key(catalog_id.decode()), recipe_id)
+        pipe.delete(self._recipe_key(recipe_id))
+
+    def _add(self, pipe, recipe_id, catalog_ids):
+        if not catalog_ids:
+            return
+        score = 1 / len(catalog_ids)
+        for catalog_id in catalog_ids:
+            pipe.zadd(self._catalog_key(catalog_id), {recipe_id: score})
+        pipe.sadd(self._recipe_key(recipe_id), *catalog_ids)
+
+    @observe_redis('ingredient_index')
+    def index_recipes(self, recipe_catalogs):
+        """
+        {レシピID: [材料の辞書のid, ...]}をインデックスに登録し直す
+        """
+        recipe_ids = list(recipe_catalogs)
+        with self.redis_handler.pipeline() as pipe:
+            for recipe_id in recipe_ids:
+                pipe.smembers(self._recipe_key(recipe_id))
+            old_catalog_ids = pipe.execute()
+
+            for recipe_id, old in zip(recipe_ids, old_catalog_ids):
+                catalog_ids = {
+                    catalog_id for catalog_id in recipe_catalogs[recipe_id]
+                    if catalog_id is not None
+                }
+                self._remove(pipe, recipe_id, old)
+                self._add(pipe, recipe_id, catalog_ids)
+            pipe.execute()
+
+    def remove_recipes(self, recipe_ids):
+        self.index_recipes({recipe_id: [] for recipe_id in recipe_ids})
+
+    def reindex_recipes(self, recipe_ids):
+        """
+        データベースの材料からレシピのインデックスを作り直す(材料名の列は読まない)
+        """
+        from .models import Ingredient
+
+        recipe_catalogs = {recipe_id: [] for recipe_id in recipe_ids}
+        ingredients = Ingredient.objects.filter(
+            recipe_id__in=recipe_catalogs
+        ).values_list('recipe_id', 'catalog_id')
+        for recipe_id, catalog_id in ingredients:
+            recipe_catalogs[recipe_id].append(catalog_id)
+        self.index_recipes(recipe_catalogs)
+
+    def search(self, names, limit=10):
+        """
+        手持ちの材料で作れるレシピをカバー率の高い順にlimit件返す
+        戻り値は(レシピID, 揃っている材料数, 足りない材料数)のリスト
+        """
+        return self.search_catalogs(resolve_catalog_ids(names, self.max_names), limit)
+
+    @observe_redis('ingredient_search')
+    def search_catalogs(self, catalog_ids, limit=10):
+        """
+        searchの材料を辞書のidで指定する版
+        """
+        catalog_ids = sorted(set(catalog_ids))[:self.max_names]
+        if not catalog_ids:
+            return []
+
+        client = self.redis_handler.redis_client
+        if self._search_script is None:
+            type(self)._search_script = client.register_script(SEARCH_SCRIPT)
+        rows = self._search_script(
+            keys=[self._catalog_key(catalog_id) for catalog_id in catalog_ids],
+            args=[limit, self.batch_size, self._recipe_key('')] + catalog_ids,
+            client=client
+        )
+        return [
+            (int(recipe_id), match, missing)
+            for recipe_id, match, missing in zip(
+                rows[0::3], rows[1::3], rows[2::3]
+            )
+        ]
+
+    @observe_redis('ingredient_clear')
+    def clear(self):
+        client = self.redis_handler.redis_client
+        batch = []
+        for key in client.scan_iter(match=f'{self.prefix}*', count=1000):
+            batch.append(key)
+            if len(batch) == 1000:
+                client.delete(*batch)
+                batch = []
+        if batch:
+            client.delete(*batch)
@@ -0,0 +1,375 @@
+"""
+負荷試験用の簡易HTTPクライアントと集計(標準ライブラリのみ)
+
+asyncioのKeep-Aliveの接続をconcurrency本開き、指定した時間だけ
+リクエストを送り続けてスループット(RPS)とレイテンシのパーセンタイルを求める
+run_scenariosはCookieを保持するSessionで重み付きのシナリオ(ページ遷移の流れ)を繰り返し、
+エンドポイントごとに集計する
+"""
+import asyncio
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+
+class HTTPConnection:
+    """
+    HTTP/1.1のKeep-Aliveの接続。1リクエストずつ順番に送る
+    """
+
+    def __init__(self, host, port, host_header=None):
+        self.host = host
+        self.port = port
+        # ALLOWED_HOSTSに含まれるホスト名を送る
+        self.host_header = host_header or f'{host}:{port}'
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port
+        )
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+    async def request(self, method, path, headers=None, body=b''):
+        """
+        (ステータスコード, {小文字のヘッダ名: [値, ...]}, 本文)を返す
+        """
+        if self.writer is None:
+            await self.connect()
+        lines = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host_header}',
+            f'Content-Length: {len(body)}',
+        ]
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('接続が閉じられました')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers.setdefault(name.strip().lower(), []).append(
+                value.strip()
+            )
+
+        if 'chunked' in response_headers.get('transfer-encoding', [''])[0]:
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            content = b''.join(chunks)
+        else:
+            length = int(response_headers.get('content-length', ['0'])[0])
+            content = await self.reader.readexactly(length)
+
+        if response_headers.get('connection', [''])[0].lower() == 'close':
+            await self.close()
+        return status, response_headers, content
+
+
+def percentile(sorted_values, p):
+    """
+    最近順位法によるパーセンタイル(sorted_valuesは昇順)
+    """
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def summarize(latencies, errors, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'elapsed': round(elapsed, 2),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+    }
+
+
+async def run_load(host, port, paths, concurrency=50, duration=10.0,
+                   warmup=1.0, seed=0, host_header=None):
+    """
+    pathsからランダムに選んだGETリクエストをconcurrency本の接続で送り続ける
+    warmup秒の間の結果は集計に含めない
+    """
+    rng = random.Random(seed)
+    latencies = []
+    statuses = {}
+    errors = 0
+    start = time.perf_counter()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    async def worker():
+        nonlocal errors
+        connection = HTTPConnection(host, port, host_header)
+        try:
+            while True:
+                sent = time.perf_counter()
+                if sent >= deadline:
+                    break
+                try:
+                    status, _, _ = await connection.request(
+                        'GET', rng.choice(paths)
+                    )
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    await connection.close()
+                    if sent >= measure_from:
+                        errors += 1
+                    continue
+                if sent >= measure_from:
+                    latencies.append(time.perf_counter() - sent)
+                    statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            await connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, statuses, duration)
+
+
+async def wait_until_ready(host, port, path='/', timeout=30.0,
+                           host_header=None):
+    """
+    サーバが起動してリクエストに応答するまで待つ
+    """
+    deadline = time.perf_counter() + timeout
+    while True:
+        connection = HTTPConnection(host, port, host_header)
+        try:
+            await connection.request('GET', path)
+            return
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f'{host}:{port}が起動しませんでした')
+            await asyncio.sleep(0.2)
+        finally:
+            await connection.close()
+
+
+class ScenarioError(Exception):
+    """
+    想定外のステータスなどでシナリオを続けられない
+    """
+
+
+class Recorder:
+    """
+    エンドポイント名ごとのレイテンシ・ステータス・エラーの数
+    measure_fromより前に送ったリクエストは集計に含めない(ウォームアップ)
+    """
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.endpoints = {}
+
+    def _endpoint(self, name):
+        return self.endpoints.setdefault(
+            name, {'latencies': [], 'statuses': {}, 'errors': 0}
+        )
+
+    def record(self, name, sent, status):
+        if sent < self.measure_from:
+            return
+        endpoint = self._endpoint(name)
+        endpoint['latencies'].append(time.perf_counter() - sent)
+        endpoint['statuses'][status] = endpoint['statuses'].get(status, 0) + 1
+
+    def error(self, name, sent):
+        if sent >= self.measure_from:
+            self._endpoint(name)['errors'] += 1
+
+    def summary(self, elapsed):
+        endpoints = {
+            name: summarize(
+                endpoint['latencies'], endpoint['errors'],
+                endpoint['statuses'], elapsed
+            )
+            for name, endpoint in sorted(self.endpoints.items())
+        }
+        latencies, statuses, errors = [], {}, 0
+        for endpoint in self.endpoints.values():
+            latencies += endpoint['latencies']
+            errors += endpoint['errors']
+            for status, count in endpoint['statuses'].items():
+                statuses[status] = statuses.get(status, 0) + count
+        return {
+            'total': summarize(latencies, errors, statuses, elapsed),
+            'endpoints': endpoints,
+        }
+
+
+class Response:
+
+    def __init__(self, status, headers, content):
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    @property
+    def location(self):
+        return self.headers.get('location', [None])[0]
+
+
+CSRF_PATTERN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class Session:
+    """
+    Cookie(セッション・CSRF)を保持し、リクエストごとの結果をRecorderに記録するクライアント
+    """
+
+    def __init__(self, host, port, recorder, host_header=None):
+        self.connection = HTTPConnection(host, port, host_header)
+        self.recorder = recorder
+        self.cookies = {}
+
+    def _update_cookies(self, headers):
+        for header in headers.get('set-cookie', []):
+            name, _, rest = header.partition('=')
+            value, _, attributes = rest.partition(';')
+            if 'max-age=0' in attributes.lower().replace(' ', '') or not value:
+                self.cookies.pop(name.strip(), None)
+            else:
+                self.cookies[name.strip()] = value.strip().strip('"')
+
+    async def request(self, name, method, path, data=None, expect=(200,)):
+        """
+        レスポンスのステータスがexpectに含まれない場合はScenarioErrorを送出する
+        """
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                f'{key}={value}' for key, value in self.cookies.items()
+            )
+        body = b''
+        if data is not None:
+            body = urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        sent = time.perf_counter()
+        try:
+            status, response_headers, content = await self.connection.request(
+                method, path, headers=headers, body=body
+            )
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            await self.connection.close()
+            self.recorder.error(name, sent)
+            raise ScenarioError(f'{name}: {e!r}')
+        self.recorder.record(name, sent, status)
+        self._update_cookies(response_headers)
+        if status not in expect:
+            self.recorder.error(name, sent)
+            raise ScenarioError(f'{name}: ステータス{status}')
+        return Response(status, response_headers, content)
+
+    async def get(self, name, path, expect=(200,)):
+        return await self.request(name, 'GET', path, expect=expect)
+
+    async def post(self, name, path, data, expect=(302,)):
+        return await self.request(name, 'POST', path, data=data, expect=expect)
+
+    def csrf_token(self, response):
+        match = CSRF_PATTERN.search(response.text)
+        if match is None:
+            raise ScenarioError('CSRFトークンがありません')
+        return match.group(1)
+
+    def logout(self):
+        self.cookies.clear()
+
+    async def close(self):
+        await self.connection.close()
+
+
+async def run_scenarios(host, port, scenarios, make_context, concurrency=10,
+                        duration=10.0, warmup=1.0, seed=0, host_header=None):
+    """
+    scenarios: [(重み, async def scenario(session, context)), ...]
+    make_context(worker_index, rng)はワーカーごとのcontext(ログインするユーザなど)を返す
+    """
+    master = random.Random(seed)
+    start = time.perf_counter()
+    recorder = Recorder(start + warmup)
+    deadline = start + warmup + duration
+    weights = [weight for weight, _ in scenarios]
+    funcs = [func for _, func in scenarios]
+    failures = {}
+
+    async def worker(index):
+        rng = random.Random(master.random())
+        session = Session(host, port, recorder, host_header)
+        context = make_context(index, rng)
+        try:
+            while time.perf_counter() < deadline:
+                scenario = rng.choices(funcs, weights=weights)[0]
+                try:
+                    await scenario(session, context)
+                except ScenarioError as e:
+                    failures[str(e)] = failures.get(str(e), 0) + 1
+                    session.logout()
+        finally:
+            await session.close()
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    result = recorder.summary(duration)
+    result['failures'] = dict(sorted(failures.items()))
+    return result
+
+
+def start_uvicorn(host, port, workers=1, cwd=None, env=None):
+    """
+    config.asgi:applicationをuvicornで起動する(呼び出し側でterminateする)
+    """
+    env = {
+        **os.environ,
+        'PYTHONPATH': os.pathsep.join(sys.path),
+        **(env or {}),
+    }
+    return subprocess.Popen(
+        [
+            sys.executable, '-m', 'uvicorn', 'config.asgi:application',
+            '--host', host, '--port', str(port),
+            '--workers', str(workers), '--no-access-log',
+            '--log-level', 'warning',
+        ],
+        cwd=cwd,
+        env=env,
+    )
@@ -0,0 +1,96 @@
+import multiprocessing
+import time
+from functools import reduce
+from operator import or_
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from cook.cache import invalidate_recipes
+from cook.images import generate_renditions
+from cook.models import Recipe
+
+
+def _generate(task):
+    """
+    子プロセスで実行する。データベースには触れず、画像の作成だけを行う
+    """
+    recipe_id, image_name = task
+    try:
+        generate_renditions(image_name)
+    except Exception as e:
+        return recipe_id, image_name, f'{type(e).__name__}: {e}'
+    return recipe_id, image_name, None
+
+
+class Command(BaseCommand):
+    help = '既存のレシピ画像のレンディション(サムネイル)を複数プロセスで作成する'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=multiprocessing.cpu_count()
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--force', action='store_true',
+            help='作成済みのレシピも対象にする(存在しないレンディションだけを作成する)'
+        )
+
+    def get_queryset(self, force):
+        queryset = Recipe.objects.exclude(image='').exclude(image__isnull=True)
+        if not force:
+            queryset = queryset.filter(image_renditions_ready=False)
+        return queryset.order_by('id')
+
+    def handle(self, *args, **options):
+        queryset = self.get_queryset(options['force'])
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        done = failed = 0
+        last_id = 0
+
+        # forkした子プロセスに接続を引き継がないように閉じておく
+        connections.close_all()
+        with multiprocessing.Pool(options['processes']) as pool:
+            while True:
+                tasks = list(
+                    queryset.filter(id__gt=last_id)
+                    .values_list('id', 'image')[:batch_size]
+                )
+                if not tasks:
+                    break
+                last_id = tasks[-1][0]
+
+                completed = []
+                for recipe_id, image_name, error in pool.imap_unordered(
+                    _generate, tasks
+                ):
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'recipe {recipe_id}: {error}')
+                    else:
+                        completed.append((recipe_id, image_name))
+
+                # 作成中に画像が変更されたレシピはフラグを立てない
+                if completed:
+                    done += Recipe.objects.filter(reduce(or_, [
+                        Q(id=recipe_id, image=image_name)
+                        for recipe_id, image_name in completed
+                    ])).update(
+                        image_renditions_ready=True, updated_at=timezone.now()
+                    )
+                    invalidate_recipes(
+                        [recipe_id for recipe_id, _ in completed]
+                    )
+
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'{done}件作成 / {failed}件失敗 '
+                    f'({done / elapsed:.1f}件/秒)'
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{done}件のレシピのレンディションを作成しました'
+        ))
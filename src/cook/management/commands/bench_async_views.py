@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from cook.loadtest import run_load, start_uvicorn, wait_until_ready
+from cook.models import Recipe
+
+User = get_user_model()
+
+HOST = '127.0.0.1'
+
+
+class Command(BaseCommand):
+    help = (
+        '同期版・非同期版の読み取り系のビューをそれぞれuvicornで起動し、'
+        '同じ負荷をかけてスループットとレイテンシを比較する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=10.0)
+        parser.add_argument('--warmup', type=float, default=2.0)
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--port', type=int, default=8101)
+        parser.add_argument(
+            '--sample', type=int, default=20,
+            help='詳細ページへのリクエストに使うレシピ・ユーザの数'
+        )
+        parser.add_argument(
+            '--host-header', default='localhost',
+            help='HostヘッダーとしてALLOWED_HOSTSに含まれるホスト名を送る'
+        )
+        parser.add_argument('--json', action='store_true')
+
+    def get_paths(self, sample):
+        recipe_ids = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True
+        )[:sample]
+        user_ids = User.objects.filter(is_superuser=False).order_by(
+            '-id'
+        ).values_list('id', flat=True)[:sample]
+        paths = [reverse('cook:recipe_list'), reverse('user:user_list')]
+        paths += [
+            reverse('cook:recipe_list') + f'?page={page}' for page in (2, 3)
+        ]
+        paths += [
+            reverse('cook:recipe_detail', kwargs={'recipe_id': recipe_id})
+            for recipe_id in recipe_ids
+        ]
+        paths += [
+            reverse('user:user_detail', kwargs={'pk': user_id})
+            for user_id in user_ids
+        ]
+        return paths
+
+    def start_server(self, port, async_views, workers):
+        return start_uvicorn(
+            HOST, port, workers, cwd=settings.BASE_DIR,
+            env={
+                'ASYNC_READ_VIEWS': 'true' if async_views else 'false',
+                'DJANGO_SETTINGS_MODULE': os.environ.get(
+                    'DJANGO_SETTINGS_MODULE', 'config.settings'
+                ),
+            }
+        )
+
+    def bench(self, async_views, port, paths, options):
+        server = self.start_server(port, async_views, options['workers'])
+        try:
+            asyncio.run(wait_until_ready(
+                HOST, port, paths[0], host_header=options['host_header']
+            ))
+            return asyncio.run(run_load(
+                HOST, port, paths,
+                concurrency=options['concurrency'],
+                duration=options['duration'],
+                warmup=options['warmup'],
+                host_header=options['host_header'],
+            ))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    def handle(self, *args, **options):
+        paths = self.get_paths(options['sample'])
+        results = {
+            'sync': self.bench(False, options['port'], paths, options),
+            'async': self.bench(True, options['port'] + 1, paths, options),
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(
+            f'並列数: {options["concurrency"]} / 計測時間: {options["duration"]}秒 / '
+            f'uvicornのワーカー数: {options["workers"]} / URL: {len(paths)}件'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:>5}: {result["rps"]:8.1f} req/s  '
+                f'p50 {result["p50_ms"]}ms  p95 {result["p95_ms"]}ms  '
+                f'p99 {result["p99_ms"]}ms  エラー {result["errors"]}  '
+                f'ステータス {result["statuses"]}'
+            )
+        if results['sync']['rps']:
+            ratio = results['async']['rps'] / results['sync']['rps']
+            self.stdout.write(f'非同期版のスループット: 同期版の{ratio:.2f}倍')
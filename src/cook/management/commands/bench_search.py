@@ -0,0 +1,113 @@
+import json
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from cook.models import Recipe
+from cook.search import search_recipes, update_search_vectors
+
+User = get_user_model()
+
+INDEX_NAME = 'recipe_search_vector_idx'
+
+DISHES = [
+    '肉じゃが', '親子丼', 'カレーライス', '味噌汁', '唐揚げ', '生姜焼き',
+    '筑前煮', '茶碗蒸し', 'オムライス', 'ハンバーグ', '焼きそば', '麻婆豆腐',
+]
+ADJECTIVES = ['簡単', '本格', 'ヘルシー', '時短', '絶品', '基本の', '節約']
+INGREDIENTS = [
+    '玉ねぎ', '人参', 'じゃがいも', '豚肉', '鶏もも肉', '卵', '豆腐',
+    '醤油', '味噌', 'みりん', '砂糖', '生姜', 'にんにく', '長ねぎ',
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = '大量のレシピを作成して全文検索の実行計画と実行時間を計測する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--query', default='茶碗蒸し')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='作成したレシピを削除せずに残す'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options)
+                self.report(options['query'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('作成したレシピを削除しました')
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        user, _ = User.objects.get_or_create(username='bench_search')
+        batch_size = options['batch_size']
+        created = 0
+        start = time.perf_counter()
+        while created < options['recipes']:
+            size = min(batch_size, options['recipes'] - created)
+            recipes = Recipe.objects.bulk_create([
+                Recipe(
+                    name=f'{rng.choice(ADJECTIVES)}{rng.choice(DISHES)}',
+                    description='、'.join(rng.sample(INGREDIENTS, 5))
+                    + 'を炒めて煮込みます。',
+                    user=user
+                )
+                for _ in range(size)
+            ])
+            update_search_vectors(Recipe, [recipe.id for recipe in recipes])
+            created += size
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Recipe._meta.db_table}')
+        self.stdout.write(
+            f'{created}件のレシピを作成しました '
+            f'({time.perf_counter() - start:.1f}秒)'
+        )
+
+    def explain(self, query):
+        queryset = search_recipes(Recipe.objects.all(), query)[:5]
+        plan = json.loads(queryset.explain(analyze=True, format='json'))[0]
+        return plan, self.find_index_names(plan['Plan'])
+
+    def find_index_names(self, node):
+        names = set()
+        if 'Index Name' in node:
+            names.add(node['Index Name'])
+        for child in node.get('Plans', []):
+            names |= self.find_index_names(child)
+        return names
+
+    def report(self, query):
+        plan, index_names = self.explain(query)
+        self.stdout.write(
+            f'検索語: {query} / 実行時間: {plan["Execution Time"]:.2f}ms / '
+            f'使用したインデックス: {", ".join(sorted(index_names)) or "なし"}'
+        )
+
+        # 比較のためインデックスを使わない場合の実行時間を計測する
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+            cursor.execute('SET LOCAL enable_indexscan = off')
+        seq_plan, _ = self.explain(query)
+        self.stdout.write(
+            f'インデックスなし: {seq_plan["Execution Time"]:.2f}ms'
+        )
+
+        if INDEX_NAME in index_names:
+            self.stdout.write(self.style.SUCCESS(f'{INDEX_NAME}が使用されました'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{INDEX_NAME}が使用されませんでした'))
@@ -0,0 +1,121 @@
+import json
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django_redis import get_redis_connection
+
+from cook.middleware import QueryStats
+
+ENGINES = [
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+    'django.contrib.sessions.backends.cache',
+    'cook.sessions',
+]
+
+
+def _payload(form_data):
+    """
+    ログイン中のユーザのセッション(form_dataは材料の入力を保存した場合)
+    """
+    session = {
+        '_auth_user_id': '12345',
+        '_auth_user_backend': 'django.contrib.auth.backends.ModelBackend',
+        '_auth_user_hash': 'f' * 64,
+    }
+    if form_data:
+        session['form_data'] = {
+            'ingredients-TOTAL_FORMS': '10',
+            'ingredients-INITIAL_FORMS': '0',
+            'ingredients-MIN_NUM_FORMS': '0',
+            'ingredients-MAX_NUM_FORMS': '10',
+            **{f'ingredients-{i}-name': f'じゃがいも{i}' for i in range(10)},
+            **{f'ingredients-{i}-amount': '大さじ1' for i in range(10)},
+        }
+    return session
+
+
+class Command(BaseCommand):
+    help = (
+        'セッションエンジンごとに、リクエストごとのセッションの読み込み・'
+        '書き込みの時間とクエリ数、保存されるデータの大きさを比較する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=500)
+        parser.add_argument(
+            '--engine', action='append', dest='engines',
+            help=f'比較するエンジン(複数指定可、既定: {", ".join(ENGINES)})'
+        )
+        parser.add_argument(
+            '--form-data', action='store_true',
+            help='材料の入力(10件)を含むセッションで計測する'
+        )
+        parser.add_argument('--json', action='store_true')
+
+    def stored_bytes(self, store):
+        if hasattr(store, 'cache_key'):
+            cache = caches[settings.SESSION_CACHE_ALIAS]
+            return get_redis_connection(settings.SESSION_CACHE_ALIAS).strlen(
+                cache.make_key(store.cache_key)
+            )
+        return len(Session.objects.get(pk=store.session_key).session_data)
+
+    def bench(self, engine, count, payload):
+        SessionStore = import_module(engine).SessionStore
+        session_keys = []
+        for _ in range(count):
+            store = SessionStore()
+            store.update(payload)
+            store.save(must_create=True)
+            session_keys.append(store.session_key)
+        size = self.stored_bytes(SessionStore(session_keys[0]))
+
+        result = {'engine': engine, 'stored_bytes': size}
+        # 読み込み: リクエストごとにSessionStoreを作ってセッションを読む
+        # 書き込み: 値を変えて保存する(材料のフォームの追加・削除など)
+        for name, operation in (
+            ('read', lambda store: store.load()),
+            ('write', lambda store: (
+                store.__setitem__('counter', store.get('counter', 0) + 1),
+                store.save(),
+            )),
+        ):
+            stats = QueryStats()
+            with connection.execute_wrapper(stats):
+                start = time.perf_counter()
+                for session_key in session_keys:
+                    operation(SessionStore(session_key))
+                elapsed = time.perf_counter() - start
+            result[f'{name}_us'] = round(elapsed / count * 1e6, 1)
+            result[f'{name}_queries'] = round(stats.count / count, 2)
+
+        for session_key in session_keys:
+            SessionStore(session_key).delete()
+        return result
+
+    def handle(self, *args, **options):
+        payload = _payload(options['form_data'])
+        results = [
+            self.bench(engine, options['sessions'], payload)
+            for engine in options['engines'] or ENGINES
+        ]
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(
+            f'{"engine":<45} {"bytes":>6} {"read(us)":>9} {"queries":>8} '
+            f'{"write(us)":>10} {"queries":>8}'
+        )
+        for result in results:
+            self.stdout.write(
+                f'{result["engine"]:<45} {result["stored_bytes"]:>6} '
+                f'{result["read_us"]:>9} {result["read_queries"]:>8} '
+                f'{result["write_us"]:>10} {result["write_queries"]:>8}'
+            )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cook.export import WRITERS, ExportFilterForm, export_recipes
+
+
+class Command(BaseCommand):
+    help = (
+        'レシピと材料をCSV / JSONLで書き出す(import_recipesで取り込める形式)。'
+        'レシピをidの順にbatch-size件ずつ読み込むため、件数によらずメモリの使用量は一定'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+        parser.add_argument('--user', help='投稿ユーザー名で絞り込む')
+        parser.add_argument('--since', help='投稿日がこの日時以降のレシピ')
+        parser.add_argument('--until', help='投稿日がこの日時より前のレシピ')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '-o', '--output', default='-', help='出力ファイル(省略時は標準出力)'
+        )
+
+    def handle(self, *args, **options):
+        form = ExportFilterForm({
+            'format': options['format'],
+            'user': options['user'] or '',
+            'since': options['since'] or '',
+            'until': options['until'] or '',
+        })
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+
+        chunks = export_recipes(
+            form.get_queryset(), form.cleaned_data['format'],
+            options['batch_size']
+        )
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                count += 1
+        self.stderr.write(f'{count}行を書き出しました')
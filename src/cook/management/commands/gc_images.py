@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from cook.images import collect_images
+from cook.models import ImageBlob, Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'どのレシピからも参照されなくなった画像ファイル(参照数が0のImageBlob)と'
+        'レンディションを削除する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=None,
+            help='更新からこの秒数が経っていないファイルは残す(既定: IMAGE_GC_GRACE_SECONDS)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--recount', action='store_true',
+            help='削除の前に参照数をレシピから数え直す'
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['recount']:
+            self.stdout.write(f'{self.recount()}件の参照数を数え直しました')
+
+        deleted = freed = 0
+        while True:
+            count, size = collect_images(
+                grace=options['grace'], limit=options['batch_size']
+            )
+            deleted += count
+            freed += size
+            if count < options['batch_size']:
+                break
+            self.stdout.write(f'{deleted}件削除 ({freed / 2 ** 20:.1f}MB)')
+
+        remaining = ImageBlob.objects.filter(refcount__lte=0).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'{deleted}件の画像を削除しました ({freed / 2 ** 20:.1f}MB, '
+            f'未削除{remaining}件, {time.perf_counter() - start:.1f}秒)'
+        ))
+
+    def recount(self):
+        """
+        参照数をレシピ(削除を待っているものも含む)の数に合わせる
+        """
+        recipe_table = Recipe._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE cook_imageblob AS b SET refcount = COALESCE(r.count, 0) '
+                f'FROM cook_imageblob AS b2 LEFT JOIN ('
+                f'SELECT image, COUNT(*) AS count FROM {recipe_table} GROUP BY image'
+                f') AS r ON r.image = b2.name '
+                f'WHERE b.id = b2.id AND b.refcount <> COALESCE(r.count, 0)'
+            )
+            return cursor.rowcount
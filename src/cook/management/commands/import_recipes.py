@@ -0,0 +1,171 @@
+import io
+import json
+import os
+import sys
+import time
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cook.bulk_import import (
+    READERS,
+    after_import,
+    resolve_users,
+    save_batch,
+    validate_record
+)
+from cook.models import ImportCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        'JSONL / CSVからレシピと材料をバッチごとのトランザクションで一括登録する。'
+        '途中で失敗した場合は同じ--jobで再実行すると続きから取り込む'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='入力ファイル(-で標準入力)')
+        parser.add_argument('--format', choices=sorted(READERS))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--job',
+            help='進捗を記録する名前(標準入力の場合は必須、省略時はファイルの絶対パス)'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='記録された進捗を無視して最初から取り込む'
+        )
+        parser.add_argument(
+            '--user', help='userが指定されていないレコードの投稿ユーザー'
+        )
+        parser.add_argument(
+            '--errors', help='エラーになったレコードをJSONLで出力するファイル'
+        )
+        parser.add_argument(
+            '--max-errors', type=int, default=1000,
+            help='エラーがこの件数を超えたら中断する'
+        )
+
+    def get_format(self, options):
+        if options['format']:
+            return options['format']
+        ext = os.path.splitext(options['path'])[1].lower()
+        if ext in ('.jsonl', '.ndjson', '.json'):
+            return 'jsonl'
+        if ext == '.csv':
+            return 'csv'
+        raise CommandError('--formatを指定してください。')
+
+    def open_input(self, path):
+        # CSVのフィールド内の改行を正しく読むためにnewline=''で開く
+        if path == '-':
+            return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+        return open(path, encoding='utf-8-sig', newline='')
+
+    def handle(self, *args, **options):
+        fmt = self.get_format(options)
+        path = options['path']
+        job = options['job']
+        if not job:
+            if path == '-':
+                raise CommandError('標準入力から取り込む場合は--jobを指定してください。')
+            job = os.path.abspath(path)
+
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(name=job)
+        start_position = 0 if options['restart'] else checkpoint.position
+        if start_position:
+            self.stdout.write(f'{start_position}件目まで取り込み済みのため続きから取り込みます')
+
+        self.errors_file = open(options['errors'], 'a', encoding='utf-8') \
+            if options['errors'] else None
+        self.max_errors = options['max_errors']
+        self.failed = 0
+        self.imported = 0
+        self.checkpoint = checkpoint
+        self.started = time.perf_counter()
+        self.start_position = start_position
+
+        try:
+            with self.open_input(path) as stream:
+                self.run(
+                    READERS[fmt](stream), start_position, options
+                )
+        finally:
+            if self.errors_file:
+                self.errors_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.imported}件のレシピを登録しました(エラー{self.failed}件)'
+        ))
+
+    def run(self, records, start_position, options):
+        pending = []
+        position = 0
+        for position, (record, error) in enumerate(records, 1):
+            # 取り込み済みのレコードは読み飛ばす(メモリには保持しない)
+            if position <= start_position:
+                continue
+            if error:
+                self.report_error(position, {'__all__': [error]})
+                continue
+            if not record.get('user') and options['user']:
+                record['user'] = options['user']
+
+            recipe, ingredients, errors = validate_record(record)
+            if errors:
+                self.report_error(position, errors)
+                continue
+            pending.append((position, record['user'], recipe, ingredients))
+            if len(pending) >= options['batch_size']:
+                self.flush(pending, position)
+                pending = []
+
+        if position > start_position:
+            self.flush(pending, position)
+
+    def flush(self, pending, position):
+        """
+        1バッチを1トランザクションで保存し、同じトランザクションで進捗を記録する
+        """
+        users = resolve_users(username for _, username, _, _ in pending)
+        batch = []
+        for record_position, username, recipe, ingredients in pending:
+            if username not in users:
+                self.report_error(
+                    record_position, {'user': ['ユーザーが存在しません。']}
+                )
+                continue
+            recipe.user_id = users[username]
+            batch.append((recipe, ingredients))
+
+        with transaction.atomic():
+            recipe_catalogs = save_batch(batch) if batch else {}
+            ImportCheckpoint.objects.filter(pk=self.checkpoint.pk).update(
+                position=position
+            )
+            if recipe_catalogs:
+                transaction.on_commit(partial(after_import, recipe_catalogs))
+        self.imported += len(batch)
+
+        elapsed = time.perf_counter() - self.started
+        processed = position - self.start_position
+        self.stdout.write(
+            f'{position}件目まで処理 / 登録{self.imported}件 / エラー{self.failed}件 '
+            f'({processed / elapsed:.0f}件/秒)'
+        )
+
+    def report_error(self, position, errors):
+        self.failed += 1
+        line = json.dumps(
+            {'position': position, 'errors': errors}, ensure_ascii=False
+        )
+        if self.errors_file:
+            self.errors_file.write(line + '\n')
+        else:
+            self.stderr.write(line)
+        if self.failed > self.max_errors:
+            raise CommandError(
+                f'エラーが{self.max_errors}件を超えたため中断しました。'
+                '同じ--jobで再実行すると最後に保存したバッチの続きから取り込みます。'
+            )
@@ -0,0 +1,134 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from cook.catalog import ALIASES, CatalogResolver, catalog_key
+from cook.models import Ingredient, IngredientAlias, IngredientCatalog
+
+TABLES = [Ingredient, IngredientCatalog, IngredientAlias]
+
+
+def _default_names():
+    """
+    代表の表記と別名の組(別名での検索は材料名の完全一致では見つからない)
+    """
+    names = []
+    for name, aliases in list(ALIASES.items())[:5]:
+        names.extend([name, aliases[0]])
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        '材料名の辞書のテーブルの大きさと、材料名での検索(nameの完全一致)と'
+        '辞書のidでの検索(catalog_id)の時間と件数を比較する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--name', action='append', dest='names',
+            help='検索する材料名(複数指定可、既定は代表の表記と別名の5組)'
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--json', action='store_true')
+
+    def table_sizes(self):
+        sizes = []
+        with connection.cursor() as cursor:
+            for model in TABLES:
+                table = model._meta.db_table
+                cursor.execute(
+                    'SELECT pg_total_relation_size(%s), pg_relation_size(%s), '
+                    'pg_indexes_size(%s)', [table, table, table]
+                )
+                total, heap, indexes = cursor.fetchone()
+                sizes.append({
+                    'table': table,
+                    'rows': model.objects.count(),
+                    'total_bytes': total,
+                    'heap_bytes': heap,
+                    'index_bytes': indexes,
+                })
+            cursor.execute(
+                f'SELECT COALESCE(SUM(pg_column_size(name)), 0), '
+                f'COALESCE(SUM(pg_column_size(catalog_id)), 0), '
+                f'COUNT(*) - COUNT(catalog_id) '
+                f'FROM {Ingredient._meta.db_table}'
+            )
+            name_bytes, catalog_bytes, missing = cursor.fetchone()
+        return sizes, {
+            'name_bytes': name_bytes,
+            'catalog_id_bytes': catalog_bytes,
+            'rows_without_catalog': missing,
+        }
+
+    def measure(self, operation, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = operation()
+            timings.append(time.perf_counter() - start)
+        return rows, round(statistics.median(timings) * 1000, 2)
+
+    def lookups(self, names, repeat):
+        resolver = CatalogResolver()
+        results = []
+        for name in names:
+            text_rows, text_ms = self.measure(
+                lambda: Ingredient.objects.filter(name=name).count(), repeat
+            )
+
+            def by_catalog():
+                # 表記から辞書のidを引くクエリも含めて計測する
+                catalog_id = resolver.lookup([catalog_key(name)]).get(catalog_key(name))
+                if catalog_id is None:
+                    return 0
+                return Ingredient.objects.filter(catalog_id=catalog_id).count()
+
+            catalog_rows, catalog_ms = self.measure(by_catalog, repeat)
+            results.append({
+                'name': name,
+                'text_rows': text_rows,
+                'text_ms': text_ms,
+                'catalog_rows': catalog_rows,
+                'catalog_ms': catalog_ms,
+            })
+        return results
+
+    def handle(self, *args, **options):
+        sizes, columns = self.table_sizes()
+        lookups = self.lookups(options['names'] or _default_names(), options['repeat'])
+        if options['json']:
+            self.stdout.write(json.dumps(
+                {'tables': sizes, 'columns': columns, 'lookups': lookups}, indent=2
+            ))
+            return
+
+        self.stdout.write(
+            f'{"table":<25} {"rows":>10} {"total(MB)":>10} {"heap(MB)":>9} '
+            f'{"index(MB)":>10}'
+        )
+        for size in sizes:
+            self.stdout.write(
+                f'{size["table"]:<25} {size["rows"]:>10} '
+                f'{size["total_bytes"] / 2 ** 20:>10.1f} '
+                f'{size["heap_bytes"] / 2 ** 20:>9.1f} '
+                f'{size["index_bytes"] / 2 ** 20:>10.1f}'
+            )
+        self.stdout.write(
+            f'材料名(name)の合計: {columns["name_bytes"] / 2 ** 20:.1f}MB / '
+            f'辞書のid(catalog_id)の合計: {columns["catalog_id_bytes"] / 2 ** 20:.1f}MB / '
+            f'辞書のidが未設定の行: {columns["rows_without_catalog"]}'
+        )
+        self.stdout.write('')
+        self.stdout.write(
+            f'{"name":<12} {"name=(ms)":>10} {"rows":>8} {"catalog(ms)":>12} {"rows":>8}'
+        )
+        for result in lookups:
+            self.stdout.write(
+                f'{result["name"]:<12} {result["text_ms"]:>10} {result["text_rows"]:>8} '
+                f'{result["catalog_ms"]:>12} {result["catalog_rows"]:>8}'
+            )
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import math
+import os
+import re
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from cook.loadtest import (
+    ScenarioError,
+    run_scenarios,
+    start_uvicorn,
+    wait_until_ready
+)
+from cook.models import Recipe
+from cook.views import RecipeListView
+
+User = get_user_model()
+
+USERNAME_PREFIX = 'loadtest'
+PASSWORD = 'loadtest-password'
+RECIPE_LINK = re.compile(r'href="/cook/recipes/(\d+)/"')
+MY_PAGE_LINK = re.compile(r'href="/users/(\d+)"')
+TOTAL_FORMS = re.compile(r'name="ingredients-TOTAL_FORMS" value="(\d+)"')
+
+
+async def browse_list(session, context):
+    """
+    レシピ一覧の先頭の数ページ(最大3ページ目まで)を見る
+    """
+    page = context['rng'].randint(1, context['list_pages'])
+    await session.get(
+        'recipe_list', f'{reverse("cook:recipe_list")}?page={page}'
+    )
+
+
+async def open_detail(session, context):
+    recipe_id = context['rng'].choice(context['recipe_ids'])
+    await session.get(
+        'recipe_detail',
+        reverse('cook:recipe_detail', kwargs={'recipe_id': recipe_id})
+    )
+
+
+async def browse_api(session, context):
+    """
+    材料込みでレシピ100件を返すAPIの一覧を取得する
+    (レイテンシの上限はテストではなくこのシナリオのp95で確認する)
+    """
+    await session.get(
+        'api_recipe_list',
+        f'{reverse("cook:api_recipe_list")}?embed=ingredients&limit=100'
+    )
+
+
+async def login(session, context):
+    """
+    セッションを破棄してログインし直す
+    """
+    session.logout()
+    url = reverse('account_login')
+    response = await session.get('account_login', url)
+    await session.post('account_login:post', url, {
+        'csrfmiddlewaretoken': session.csrf_token(response),
+        'login': context['username'],
+        'password': PASSWORD,
+    })
+    context['logged_in'] = True
+
+
+def _ingredient_data(response, session, rng, fill):
+    """
+    材料のフォームセットの送信データ(fill件まで材料を入力する)
+    """
+    match = TOTAL_FORMS.search(response.text)
+    if match is None:
+        raise ScenarioError('材料のフォームセットがありません')
+    total = int(match.group(1))
+    data = {
+        'csrfmiddlewaretoken': session.csrf_token(response),
+        'ingredients-TOTAL_FORMS': total,
+        'ingredients-INITIAL_FORMS': 0,
+        'ingredients-MIN_NUM_FORMS': 0,
+        'ingredients-MAX_NUM_FORMS': 1000,
+    }
+    for i in range(min(total, fill)):
+        data[f'ingredients-{i}-name'] = f'材料{rng.randint(1, 500)}'
+        data[f'ingredients-{i}-amount'] = f'{rng.randint(1, 5)}個'
+    return data
+
+
+async def create_recipe(session, context):
+    """
+    レシピを登録し、マイページから登録したレシピを開いて、
+    材料のフォームを追加・削除してから材料を登録する
+    (INGREDIENT_FORMSET_CLIENT_SIDEの場合、追加・削除はブラウザで行うためリクエストしない)
+    """
+    if not context.get('logged_in'):
+        await login(session, context)
+    rng = context['rng']
+
+    url = reverse('cook:recipe_new')
+    response = await session.get('recipe_new', url)
+    my_page = MY_PAGE_LINK.search(response.text)
+    if my_page is None:
+        context['logged_in'] = False
+        raise ScenarioError('ログインしていません')
+    await session.post('recipe_new:post', url, {
+        'csrfmiddlewaretoken': session.csrf_token(response),
+        'name': f'負荷試験のレシピ{rng.randint(1, 10 ** 6)}',
+        'description': '材料を切る。\n鍋で煮る。\n器に盛る。',
+    })
+
+    response = await session.get(
+        'user_detail', reverse('user:user_detail', kwargs={'pk': my_page.group(1)})
+    )
+    # マイページのレシピは投稿日の新しい順
+    recipe = RECIPE_LINK.search(response.text)
+    if recipe is None:
+        raise ScenarioError('登録したレシピがありません')
+    url = reverse('cook:ingredient_new', kwargs={'recipe_id': recipe.group(1)})
+
+    response = await session.get('ingredient_new', url)
+    if not settings.INGREDIENT_FORMSET_CLIENT_SIDE:
+        for button in ('add_form', 'remove_form'):
+            data = _ingredient_data(response, session, rng, fill=2)
+            data[button] = ''
+            await session.post(f'ingredient_new:{button}', url, data)
+            response = await session.get('ingredient_new', url)
+
+    data = _ingredient_data(response, session, rng, fill=3)
+    data['submit'] = ''
+    await session.post('ingredient_new:submit', url, data)
+
+
+async def publish_recipe(session, context):
+    """
+    レシピと材料を1回の送信で登録する(RecipePublishView)
+    """
+    if not context.get('logged_in'):
+        await login(session, context)
+    rng = context['rng']
+
+    url = reverse('cook:recipe_publish')
+    response = await session.get('recipe_publish', url)
+    if MY_PAGE_LINK.search(response.text) is None:
+        context['logged_in'] = False
+        raise ScenarioError('ログインしていません')
+    data = _ingredient_data(response, session, rng, fill=3)
+    data.update({
+        'name': f'負荷試験のレシピ{rng.randint(1, 10 ** 6)}',
+        'description': '材料を切る。\n鍋で煮る。\n器に盛る。',
+        'submit': '',
+    })
+    await session.post('recipe_publish:post', url, data)
+
+
+SCENARIOS = {
+    'browse_list': browse_list,
+    'open_detail': open_detail,
+    'browse_api': browse_api,
+    'login': login,
+    'create_recipe': create_recipe,
+    'publish_recipe': publish_recipe,
+}
+
+
+def parse_weights(value):
+    weights = []
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in SCENARIOS:
+            raise CommandError(
+                f'シナリオ{name}はありません({", ".join(SCENARIOS)})'
+            )
+        try:
+            weights.append((float(weight), SCENARIOS[name.strip()]))
+        except ValueError:
+            raise CommandError(f'重みが不正です: {item}')
+    return weights
+
+
+class Command(BaseCommand):
+    help = (
+        '重み付きのシナリオ(一覧・詳細・API・ログイン・材料つきのレシピ登録)で負荷をかけ、'
+        'エンドポイントごとのp50/p95/p99とRPSをJSONで出力する。'
+        '--urlで起動済みのサーバ(nginx経由も可)、--start-serverでuvicornを起動して計測する。'
+        'create_recipeはレシピと材料を別々に、publish_recipeは1回の送信で登録する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000',
+            help='負荷をかけるサーバ(--start-serverの場合はポートのみ使う)'
+        )
+        parser.add_argument('--start-server', action='store_true')
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument(
+            '--weights',
+            default='browse_list=50,open_detail=35,login=5,publish_recipe=10'
+        )
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--duration', type=float, default=30.0)
+        parser.add_argument('--warmup', type=float, default=2.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--sample', type=int, default=100,
+            help='詳細ページを開くレシピの数'
+        )
+        parser.add_argument('--host-header', default='localhost')
+        parser.add_argument('-o', '--output', help='結果のJSONを書き出すファイル')
+        parser.add_argument(
+            '--cleanup', action='store_true',
+            help='終了後に負荷試験のユーザが登録したレシピを削除する'
+        )
+
+    def prepare_users(self, count):
+        """
+        ワーカーごとにログインするユーザ(材料のフォームの数はユーザごとに保存されるため)
+        """
+        password = make_password(PASSWORD)
+        usernames = [f'{USERNAME_PREFIX}{i:04d}' for i in range(count)]
+        existing = set(
+            User.objects.filter(username__in=usernames)
+            .values_list('username', flat=True)
+        )
+        User.objects.bulk_create([
+            User(username=username, password=password)
+            for username in usernames if username not in existing
+        ])
+        User.objects.filter(username__in=existing).update(password=password)
+        return usernames
+
+    def handle(self, *args, **options):
+        scenarios = parse_weights(options['weights'])
+        url = urlsplit(options['url'])
+        host, port = url.hostname or '127.0.0.1', url.port or 80
+
+        usernames = self.prepare_users(options['concurrency'])
+        recipe_ids = list(
+            Recipe.objects.order_by('-id')
+            .values_list('id', flat=True)[:options['sample']]
+        )
+        if not recipe_ids:
+            raise CommandError('レシピがありません(seed_perfで作成できます)。')
+
+        list_pages = min(
+            3, math.ceil(Recipe.objects.count() / RecipeListView.paginate_by)
+        )
+
+        def make_context(index, rng):
+            return {
+                'rng': rng,
+                'username': usernames[index],
+                'recipe_ids': recipe_ids,
+                'list_pages': list_pages,
+            }
+
+        server = None
+        if options['start_server']:
+            server = start_uvicorn(
+                host, port, options['workers'], cwd=settings.BASE_DIR,
+                env={'DJANGO_SETTINGS_MODULE': os.environ.get(
+                    'DJANGO_SETTINGS_MODULE', 'config.settings'
+                )}
+            )
+        try:
+            asyncio.run(wait_until_ready(
+                host, port, reverse('cook:recipe_list'),
+                host_header=options['host_header']
+            ))
+            result = asyncio.run(run_scenarios(
+                host, port, scenarios, make_context,
+                concurrency=options['concurrency'],
+                duration=options['duration'],
+                warmup=options['warmup'],
+                seed=options['seed'],
+                host_header=options['host_header'],
+            ))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+        result['config'] = {
+            key: options[key] for key in (
+                'url', 'weights', 'concurrency', 'duration', 'warmup',
+                'seed', 'workers', 'start_server'
+            )
+        }
+        if options['cleanup']:
+            Recipe.objects.filter(user__username__in=usernames).delete()
+
+        output = json.dumps(result, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
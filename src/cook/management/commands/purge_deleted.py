@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cook.deletion import purge
+from cook.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = (
+        '削除したレシピ・ユーザの未完了の削除(DeletionJob)を続きから実行し、進捗を表示する'
+        '(ワーカーの再起動などで中断した場合に実行する)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--job', type=int, action='append', dest='jobs',
+            help='実行するジョブのID(複数指定可、既定は未完了のすべてのジョブ)'
+        )
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        jobs = DeletionJob.objects.filter(finished_at__isnull=True).order_by('id')
+        if options['jobs']:
+            jobs = jobs.filter(id__in=options['jobs'])
+        job_ids = list(jobs.values_list('id', flat=True))
+        if not job_ids:
+            self.stdout.write('未完了の削除はありません')
+            return
+
+        start = time.perf_counter()
+        for job_id in job_ids:
+            job = purge(job_id, options['batch_size'], progress=self.report)
+            if job is None:
+                self.stderr.write(f'ジョブ{job_id}は他のワーカーが実行中です')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(job_ids)}件の削除を実行しました '
+            f'({time.perf_counter() - start:.1f}秒)'
+        ))
+
+    def report(self, job):
+        self.stdout.write(
+            f'{job.get_kind_display()} {job.object_id}: '
+            f'レシピ{job.deleted_recipes}/{job.total_recipes}件 '
+            f'材料{job.deleted_ingredients}件 画像{job.deleted_files}件'
+            + (' 完了' if job.finished_at else '')
+        )
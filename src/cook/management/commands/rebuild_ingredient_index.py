@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cook.ingredient_index import IngredientIndex
+from cook.models import Recipe
+
+
+class Command(BaseCommand):
+    help = '材料の辞書のid -> レシピの転置インデックス(Redis)をデータベースから作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        index = IngredientIndex()
+        index.clear()
+
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        last_id = 0
+        total = 0
+        while True:
+            recipe_ids = list(
+                Recipe.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not recipe_ids:
+                break
+            index.reindex_recipes(recipe_ids)
+            total += len(recipe_ids)
+            last_id = recipe_ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total}件のレシピを登録しました '
+            f'({time.perf_counter() - start:.1f}秒)'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from cook.models import Recipe
+from cook.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'レシピの検索用のカラムを再計算する(bulk_createなどシグナルを通らない登録の後に実行する)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            recipe_ids = list(
+                Recipe.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not recipe_ids:
+                break
+            total += update_search_vectors(Recipe, recipe_ids)
+            last_id = recipe_ids[-1]
+            self.stdout.write(f'{total}件更新しました', ending='\r')
+
+        self.stdout.write(self.style.SUCCESS(f'{total}件のレシピを更新しました'))
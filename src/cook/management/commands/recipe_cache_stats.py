@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from cook import cache as recipe_cache
+
+
+class Command(BaseCommand):
+    help = 'レシピ一覧のキャッシュ(ページ・カード)のヒット数・ミス数を表示する'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='キャッシュしたページ・カードをすべて無効にする'
+        )
+
+    def handle(self, *args, **options):
+        for kind, counts in recipe_cache.get_stats().items():
+            total = counts['hit'] + counts['miss']
+            ratio = counts['hit'] / total if total else 0
+            self.stdout.write(
+                f'{kind}: ヒット {counts["hit"]} / ミス {counts["miss"]} '
+                f'(ヒット率 {ratio:.1%})'
+            )
+
+        if options['clear']:
+            recipe_cache.clear()
+            self.stdout.write(self.style.SUCCESS('キャッシュを無効にしました'))
@@ -0,0 +1,222 @@
+import itertools
+import re
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from cook import cache as recipe_cache
+from cook.catalog import CatalogResolver
+from cook.db_utils import raw_delete
+from cook.images import acquire_images, release_images
+from cook.models import Recipe, Ingredient
+from cook.seed import PerfDataGenerator, placeholder_image
+from cook.storage import image_storage
+
+User = get_user_model()
+
+PLACEHOLDER_COUNT = 8
+
+
+def _perf_users(prefix):
+    return User.objects.filter(username__regex=rf'^{re.escape(prefix)}[0-9]{{6}}$')
+
+
+def _copy_value(value):
+    """
+    COPY ... FROM STDIN(text形式)の1つの値
+    """
+    if value is None:
+        return r'\N'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+def _copy(cursor, table, columns, rows):
+    buffer = StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row) + '\n')
+    buffer.seek(0)
+    cursor.copy_expert(
+        f'COPY {table} ({", ".join(columns)}) FROM STDIN', buffer
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        '性能計測用のユーザ・レシピ・材料をseedから決定的に生成し、COPYでまとめて登録する。'
+        '検索用のカラムと材料名の転置インデックスは--indexを指定した場合のみ作成する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients', type=int, default=8, help='1レシピあたりの材料の数'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='1回のCOPYで登録するレシピの数'
+        )
+        parser.add_argument(
+            '--prefix', default='perf', help='生成するユーザ名の接頭辞'
+        )
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.3,
+            help='プレースホルダーの画像を設定するレシピの割合'
+        )
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='同じ接頭辞のユーザとそのレシピ・材料を削除してから生成する'
+        )
+        parser.add_argument(
+            '--index', action='store_true',
+            help='生成後に検索用のカラムと材料名の転置インデックスを作り直す'
+        )
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['clear']:
+            self.clear(prefix)
+        elif _perf_users(prefix).exists():
+            raise CommandError(
+                f'{prefix}で始まるユーザが既に存在します(--clearで削除できます)。'
+            )
+
+        generator = PerfDataGenerator(options['seed'])
+        start = time.perf_counter()
+        user_ids = self.create_users(generator, prefix, options['users'])
+        images = self.create_placeholder_images()
+        # 投稿数はユーザごとに偏らせる(少数のユーザが多く投稿する)
+        cum_weights = list(itertools.accumulate(
+            1 / (i + 1) ** 0.8 for i in range(len(user_ids))
+        ))
+
+        created = 0
+        total = options['recipes']
+        while created < total:
+            count = min(options['batch_size'], total - created)
+            self.create_recipes(
+                generator, count, options['ingredients'], user_ids,
+                cum_weights, images, options['image_ratio']
+            )
+            created += count
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'レシピ{created}件 / 材料{created * options["ingredients"]}件 '
+                f'({created * options["ingredients"] / elapsed:.0f}行/秒)'
+            )
+
+        if options['index']:
+            call_command('rebuild_search_index', stdout=self.stdout)
+            call_command('rebuild_ingredient_index', stdout=self.stdout)
+        try:
+            recipe_cache.clear()
+        except (RedisError, ConnectionInterrupted):
+            self.stderr.write('一覧のキャッシュを削除できませんでした')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'ユーザ{len(user_ids)}件・レシピ{created}件・'
+            f'材料{created * options["ingredients"]}件を登録しました '
+            f'({time.perf_counter() - start:.1f}秒)'
+        ))
+
+    def clear(self, prefix):
+        """
+        ORMのカスケード削除は1件ずつシグナルを送るため、テーブルごとに1回のDELETEで削除する
+        """
+        user_ids = list(_perf_users(prefix).values_list('id', flat=True))
+        with transaction.atomic():
+            release_images(
+                Recipe.all_objects.filter(user_id__in=user_ids)
+                .exclude(image='').values_list('image', flat=True)
+            )
+            recipe_ids = list(Recipe.all_objects.filter(
+                user_id__in=user_ids
+            ).values_list('id', flat=True))
+            raw_delete(Ingredient, recipe_ids, field='recipe')
+            raw_delete(Recipe, recipe_ids)
+            User.objects.filter(id__in=user_ids).delete()
+
+    def create_users(self, generator, prefix, count):
+        # パスワードのハッシュは遅いため全員で共通にする(パスワードは"password")
+        password = make_password('password')
+        users = []
+        for i in range(count):
+            last_name, first_name = generator.user_name()
+            username = f'{prefix}{i:06d}'
+            users.append(User(
+                username=username,
+                email=f'{username}@example.com',
+                last_name=last_name,
+                first_name=first_name,
+                password=password,
+            ))
+        User.objects.bulk_create(users, batch_size=5000)
+        return list(
+            _perf_users(prefix).order_by('username').values_list('id', flat=True)
+        )
+
+    def create_placeholder_images(self):
+        # 内容のハッシュを名前にして保存するため、再実行しても同じファイルを使う
+        # (images/perf/以下は.gitignoreで除外している)
+        return [
+            image_storage().save(
+                f'images/perf/placeholder_{i}.jpg', ContentFile(placeholder_image(i))
+            )
+            for i in range(PLACEHOLDER_COUNT)
+        ]
+
+    def create_recipes(self, generator, count, ingredient_count, user_ids,
+                       cum_weights, images, image_ratio):
+        """
+        idをシーケンスから先に払い出し、レシピと材料をそれぞれ1回のCOPYで登録する
+        """
+        now = timezone.now()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence('cook_recipe', 'id')) "
+                "FROM generate_series(1, %s)", [count]
+            )
+            recipe_ids = [row[0] for row in cursor.fetchall()]
+
+            recipes = []
+            ingredients = []
+            for recipe_id in recipe_ids:
+                name, description, posted_at, recipe_ingredients = \
+                    generator.recipe(ingredient_count)
+                user_id = generator.rng.choices(user_ids, cum_weights=cum_weights)[0]
+                image = generator.choice(images) \
+                    if generator.chance(image_ratio) else None
+                recipes.append((
+                    recipe_id, name, description, posted_at.isoformat(), now.isoformat(),
+                    image, user_id, 'f'
+                ))
+                ingredients.extend(
+                    (ingredient_name, amount, recipe_id)
+                    for ingredient_name, amount in recipe_ingredients
+                )
+            # 材料名の種類は少ないため、バッチごとに1回まとめて辞書を引く
+            catalog_ids = CatalogResolver().resolve(
+                ingredient[0] for ingredient in ingredients
+            )
+
+            _copy(cursor, 'cook_recipe', [
+                'id', 'name', 'description', 'posted_at', 'updated_at',
+                'image', 'user_id', 'image_renditions_ready',
+            ], recipes)
+            acquire_images(recipe[5] for recipe in recipes)
+            _copy(cursor, 'cook_ingredient', [
+                'name', 'amount', 'recipe_id', 'catalog_id',
+            ], (ingredient + (catalog_ids[ingredient[0]],) for ingredient in ingredients))
@@ -0,0 +1,400 @@
+"""
+Prometheus形式のメトリクス(/metrics)
+
+リクエストごとの値はプロセス内のRegistryに加算するだけにし、METRICS_FLUSH_INTERVAL秒ごとに
+リクエストの処理とは別のスレッドから1回のパイプラインでRedisのハッシュに足し込む
+(HINCRBYFLOAT)。uvicornのワーカーが複数あっても/metricsはRedisの合計を返すため、
+どのワーカーが応答しても同じ値になる
+処理中のリクエスト数はワーカーごとのキー(期限つき)に保存し、/metricsで合計する
+"""
+import bisect
+import functools
+import hmac
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+REDIS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0
+)
+
+# 名前: (種類, 説明, ヒストグラムのバケット)
+FAMILIES = {
+    'cook_http_requests_total': (
+        'counter', 'リクエスト数(URL名・メソッド・ステータスコードごと)', None
+    ),
+    'cook_http_request_duration_seconds': (
+        'histogram', 'リクエストの処理時間(URL名ごと)', LATENCY_BUCKETS
+    ),
+    'cook_http_requests_in_flight': (
+        'gauge', '処理中のリクエスト数(全ワーカーの合計)', None
+    ),
+    'cook_db_queries_total': (
+        'counter', 'ORMのクエリ数(URL名ごと)', None
+    ),
+    'cook_db_query_duration_seconds_total': (
+        'counter', 'ORMのクエリの合計時間(URL名ごと)', None
+    ),
+    'cook_redis_command_duration_seconds': (
+        'histogram', 'Redisへのアクセス時間(RedisHandler・IngredientIndexの操作ごと)',
+        REDIS_BUCKETS
+    ),
+    'cook_cache_hits_total': (
+        'counter', 'レシピのキャッシュのヒット数(cook.cache)', None
+    ),
+    'cook_cache_misses_total': (
+        'counter', 'レシピのキャッシュのミス数(cook.cache)', None
+    ),
+    'cook_cache_hit_ratio': (
+        'gauge', 'レシピのキャッシュのヒット率(cook.cache)', None
+    ),
+}
+
+
+def _key_prefix():
+    return getattr(settings, 'METRICS_KEY_PREFIX', 'cook_metrics')
+
+
+def _escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    )
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _redis():
+    from .redis_utils import RedisHandler
+
+    return RedisHandler().redis_client
+
+
+class Registry:
+    """
+    プロセス内の集計(flushでRedisに足し込み、0に戻す)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(float)
+        # (名前, ラベル): [バケットごとの件数..., +Infの件数]
+        self._histograms = {}
+        self._histogram_sums = defaultdict(float)
+        self.in_flight = 0
+        self.last_flush = time.monotonic()
+        self.flushing = False
+        self.process_key = f'{socket.gethostname()}:{os.getpid()}'
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._samples[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        buckets = FAMILIES[name][2]
+        with self._lock:
+            counts = self._histograms.get((name, labels))
+            if counts is None:
+                counts = self._histograms[(name, labels)] = [0] * (len(buckets) + 1)
+            counts[bisect.bisect_left(buckets, value)] += 1
+            self._histogram_sums[(name, labels)] += value
+
+    def add_in_flight(self, value):
+        with self._lock:
+            self.in_flight += value
+
+    def _collect(self):
+        """
+        Redisに足し込む{フィールド: 値}(フィールドは出力する1行のサンプル名とラベル)
+        """
+        with self._lock:
+            samples, self._samples = self._samples, defaultdict(float)
+            histograms, self._histograms = self._histograms, {}
+            sums, self._histogram_sums = self._histogram_sums, defaultdict(float)
+
+        fields = {}
+        for (name, labels), value in samples.items():
+            fields[name + _format_labels(labels)] = value
+        for (name, labels), counts in histograms.items():
+            cumulative = 0
+            bounds = [_format_value(b) for b in FAMILIES[name][2]] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                fields[
+                    f'{name}_bucket' + _format_labels(labels + (('le', bound),))
+                ] = cumulative
+            fields[f'{name}_count' + _format_labels(labels)] = cumulative
+            fields[f'{name}_sum' + _format_labels(labels)] = sums[(name, labels)]
+        return fields
+
+    def flush(self, client=None):
+        self.last_flush = time.monotonic()
+        fields = self._collect()
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        prefix = _key_prefix()
+        try:
+            with (client or _redis()).pipeline(transaction=False) as pipe:
+                for field, value in fields.items():
+                    pipe.hincrbyfloat(f'{prefix}:samples', field, value)
+                # ワーカーが止まった場合はキーの期限切れで合計から外れる
+                pipe.set(
+                    f'{prefix}:in_flight:{self.process_key}', self.in_flight,
+                    ex=max(int(interval * 3), 30)
+                )
+                pipe.execute()
+        except (RedisError, ConnectionInterrupted):
+            # 送れなかった分は捨てる(次の集計でリクエストを遅らせないため)
+            logger.warning('メトリクスをRedisに保存できませんでした', exc_info=True)
+
+    def flush_if_due(self):
+        """
+        前回からMETRICS_FLUSH_INTERVAL秒経っていれば、リクエストの処理とは別のスレッドで送る
+        (送っている間に次の間隔が来ても重ねて送らない)
+        """
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        with self._lock:
+            if self.flushing or time.monotonic() - self.last_flush < interval:
+                return
+            self.flushing = True
+            self.last_flush = time.monotonic()
+        _get_executor().submit(self._flush_in_background)
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            # Futureの結果は誰も読まないため、ここで記録しないと例外が失われる
+            logger.exception('メトリクスをRedisに保存できませんでした')
+        finally:
+            self.flushing = False
+
+
+registry = Registry()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='metrics-flush'
+        )
+    return _executor
+
+
+def observe_redis(operation):
+    """
+    RedisHandler・IngredientIndexのメソッドの処理時間を記録するデコレータ(asyncのメソッドにも使える)
+    """
+    def decorator(func):
+        labels = (('operation', operation),)
+
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    registry.observe(
+                        'cook_redis_command_duration_seconds', labels,
+                        time.perf_counter() - start
+                    )
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(
+                    'cook_redis_command_duration_seconds', labels,
+                    time.perf_counter() - start
+                )
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    処理時間・ステータスコード・処理中のリクエスト数と、
+    QueryCountMiddlewareが数えたクエリ数(request.query_stats)を記録する
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        registry.add_in_flight(1)
+        try:
+            response = self.get_response(request)
+        finally:
+            registry.add_in_flight(-1)
+        self.record(request, response, time.perf_counter() - start)
+        registry.flush_if_due()
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        registry.add_in_flight(1)
+        try:
+            response = await self.get_response(request)
+        finally:
+            registry.add_in_flight(-1)
+        self.record(request, response, time.perf_counter() - start)
+        registry.flush_if_due()
+        return response
+
+    def record(self, request, response, duration):
+        match = request.resolver_match
+        # 存在しないURLはURLごとに系列が増えないようにまとめる
+        view = match.view_name if match else 'unresolved'
+        registry.inc('cook_http_requests_total', (
+            ('view', view), ('method', request.method),
+            ('status', response.status_code),
+        ))
+        registry.observe(
+            'cook_http_request_duration_seconds', (('view', view),), duration
+        )
+        stats = getattr(request, 'query_stats', None)
+        if stats is not None:
+            registry.inc('cook_db_queries_total', (('view', view),), stats.count)
+            registry.inc(
+                'cook_db_query_duration_seconds_total', (('view', view),),
+                stats.duration
+            )
+
+
+def _cache_samples():
+    from . import cache as recipe_cache
+
+    try:
+        stats = recipe_cache.get_stats()
+    except (RedisError, ConnectionInterrupted):
+        logger.warning('キャッシュのヒット数を取得できませんでした', exc_info=True)
+        return {}
+    samples = {}
+    for kind, counts in stats.items():
+        labels = _format_labels((('kind', kind),))
+        total = counts['hit'] + counts['miss']
+        samples[f'cook_cache_hits_total{labels}'] = counts['hit']
+        samples[f'cook_cache_misses_total{labels}'] = counts['miss']
+        samples[f'cook_cache_hit_ratio{labels}'] = (
+            counts['hit'] / total if total else 0
+        )
+    return samples
+
+
+def collect(client=None):
+    """
+    全ワーカーの合計をRedisから読み、Prometheusのテキスト形式で返す
+    """
+    # このワーカーの未送信の分も含める
+    registry.flush(client)
+    client = client or _redis()
+    prefix = _key_prefix()
+    samples = {
+        field.decode(): float(value)
+        for field, value in client.hgetall(f'{prefix}:samples').items()
+    }
+    in_flight_keys = list(client.scan_iter(f'{prefix}:in_flight:*', count=1000))
+    samples['cook_http_requests_in_flight'] = sum(
+        int(value) for value in client.mget(in_flight_keys) if value is not None
+    ) if in_flight_keys else 0
+    samples.update(_cache_samples())
+
+    families = defaultdict(list)
+    for field, value in samples.items():
+        name = field.split('{', 1)[0]
+        for suffix in ('_bucket', '_count', '_sum'):
+            base = name.removesuffix(suffix)
+            if base != name and FAMILIES.get(base, ('',))[0] == 'histogram':
+                name = base
+                break
+        families[name].append((field, value))
+
+    lines = []
+    for name, (kind, description, _) in FAMILIES.items():
+        if name not in families:
+            continue
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(
+            f'{field} {_format_value(value)}'
+            for field, value in sorted(families[name], key=_sort_key)
+        )
+    return '\n'.join(lines) + '\n'
+
+
+def _sort_key(sample):
+    """
+    ラベルごとにまとめ、ヒストグラムはleの小さい順のバケット・_count・_sumの順に並べる
+    """
+    name, _, labels = sample[0].partition('{')
+    le = '+Inf'
+    if name.endswith('_bucket'):
+        labels, _, le = labels.rpartition('le="')
+        le = le.split('"', 1)[0]
+    return (
+        labels.rstrip(',}'), not name.endswith('_bucket'), name,
+        float('inf') if le == '+Inf' else float(le)
+    )
+
+
+def has_access(request):
+    """
+    スタッフのユーザ、またはAuthorization: Bearer <METRICS_TOKEN>のリクエストのみ許可する
+    """
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(
+        authorization.encode(), f'Bearer {token}'.encode()
+    )
+
+
+def metrics_view(request):
+    if not has_access(request):
+        raise PermissionDenied
+    try:
+        body = collect()
+    except RedisError:
+        logger.warning('メトリクスを取得できませんでした', exc_info=True)
+        return HttpResponse('redis unavailable\n', status=503, content_type=CONTENT_TYPE)
+    return HttpResponse(body, content_type=CONTENT_TYPE)
@@ -0,0 +1,159 @@
+"""
+リクエストごとのクエリ数・DB時間・重複したクエリの計測
+
+connection.execute_wrapperで全てのクエリを数え、ログ(cook.queries)に出力する
+Server-Timingヘッダーはsettings.SERVER_TIMINGで出力する相手を選ぶ('off' / 'staff' / 'all')
+重複したクエリの集計はSQLとパラメータを記録するため、QUERY_STATS_DUPLICATESがTrueの場合のみ行う
+settings.QUERY_BUDGETSにURL名ごとの上限を設定すると
+超えた場合に警告し、QUERY_BUDGET_STRICTがTrueの場合(テスト)は例外にする
+StreamingHttpResponseの本文を返す間のクエリは数えない
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('cook.queries')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    """
+    execute_wrapperに渡す関数。クエリの数・合計時間を記録する
+    track_duplicatesがTrueの場合は同じSQLとパラメータの回数も記録する
+    """
+
+    def __init__(self, track_duplicates=True):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter() if track_duplicates else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            if self.statements is not None:
+                # executemanyのパラメータは大きいためSQLだけで数える
+                self.statements[sql if many else (sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        """
+        同じSQLとパラメータで2回目以降に実行されたクエリの数(N+1の目安)
+        記録していない場合はNone
+        """
+        if self.statements is None:
+            return None
+        return sum(count - 1 for count in self.statements.values())
+
+    @property
+    def duration_ms(self):
+        return round(self.duration * 1000, 2)
+
+
+def _new_stats():
+    return QueryStats(
+        track_duplicates=getattr(settings, 'QUERY_STATS_DUPLICATES', False)
+    )
+
+
+def _server_timing_enabled(request):
+    mode = getattr(settings, 'SERVER_TIMING', 'off')
+    if mode == 'staff':
+        # ビューがユーザを読み込んでいない場合はここでセッションを読む(クエリは数えない)
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_authenticated and user.is_staff)
+    return mode == 'all'
+
+
+class QueryCountMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = _new_stats()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.get_response(request)
+        return self.process_stats(
+            request, response, stats, _server_timing_enabled(request)
+        )
+
+    async def __acall__(self, request):
+        # 非同期のビューでもORMはリクエストごとの同じスレッドで実行されるため、
+        # そのスレッドの接続にexecute_wrapperを登録する
+        stats = _new_stats()
+        await sync_to_async(self._install)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(self._uninstall)(stats)
+        # request.userの読み込みはデータベースにアクセスするため別スレッドで行う
+        server_timing = await sync_to_async(_server_timing_enabled)(request)
+        return self.process_stats(request, response, stats, server_timing)
+
+    def _install(self, stats):
+        for alias in connections:
+            connections[alias].execute_wrappers.append(stats)
+
+    def _uninstall(self, stats):
+        for alias in connections:
+            connections[alias].execute_wrappers.remove(stats)
+
+    def process_stats(self, request, response, stats, server_timing=False):
+        # cook.metrics.MetricsMiddlewareがURL名ごとのクエリ数として集計する
+        request.query_stats = stats
+        match = request.resolver_match
+        url_name = match.view_name if match else None
+
+        if server_timing:
+            desc = f'{stats.count} queries'
+            if stats.duplicates is not None:
+                desc += f', {stats.duplicates} duplicates'
+            timing = f'db;dur={stats.duration_ms};desc="{desc}"'
+            if response.has_header('Server-Timing'):
+                timing = f'{response["Server-Timing"]}, {timing}'
+            response['Server-Timing'] = timing
+
+        logger.info(
+            '%s %s queries=%d db=%.2fms duplicates=%s',
+            request.method, url_name or request.path,
+            stats.count, stats.duration_ms, stats.duplicates,
+            extra={
+                'url_name': url_name,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': stats.count,
+                'db_time_ms': stats.duration_ms,
+                'duplicate_queries': stats.duplicates,
+            }
+        )
+
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+        if budget is not None and stats.count > budget:
+            message = f'{url_name}のクエリ数が上限を超えました: {stats.count} > {budget}'
+            if stats.duplicates is not None:
+                message += f'(重複{stats.duplicates}件)'
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:39
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+from cook.search import update_search_vectors
+
+
+def populate_search_vector(apps, schema_editor):
+    Recipe = apps.get_model('cook', 'Recipe')
+    recipe_ids = Recipe.objects.order_by('id').values_list('id', flat=True)
+    batch = []
+    for recipe_id in recipe_ids.iterator(chunk_size=1000):
+        batch.append(recipe_id)
+        if len(batch) == 1000:
+            update_search_vectors(Recipe, batch)
+            batch = []
+    if batch:
+        update_search_vectors(Recipe, batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cook', '0004_alter_ingredient_options_alter_recipe_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+        ),
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cook', '0005_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_renditions_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
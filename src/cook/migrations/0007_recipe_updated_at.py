@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cook', '0006_recipe_image_renditions_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now,
+                verbose_name='更新日'
+            ),
+            preserve_default=False,
+        ),
+    ]
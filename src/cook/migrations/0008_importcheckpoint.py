@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cook', '0007_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='ジョブ名')),
+                ('position', models.BigIntegerField(default=0, verbose_name='処理済みのレコード数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日')),
+            ],
+            options={
+                'verbose_name': '取り込みの進捗',
+                'verbose_name_plural': '取り込みの進捗一覧',
+            },
+        ),
+    ]
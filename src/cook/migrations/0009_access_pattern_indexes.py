@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:17
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLYはトランザクション内で実行できない
+    # (テーブルをロックしないため、運用中の大きなテーブルにもそのまま適用できる)
+    atomic = False
+
+    dependencies = [
+        ('cook', '0008_importcheckpoint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='ingredient',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('name', models.TextField())), 'text_pattern_ops'), name='ingredient_name_upper_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='recipe',
+            index=models.Index(fields=['posted_at', 'id'], name='recipe_posted_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'posted_at', 'id'], name='recipe_user_posted_at_idx'),
+        ),
+        # 外部キーの単独のインデックスはrecipe_user_posted_at_idxと重複するため削除する
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipes', to=settings.AUTH_USER_MODEL, verbose_name='投稿ユーザー'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'DROP INDEX CONCURRENTLY IF EXISTS "cook_recipe_user_id_c0eafa94";',
+                    reverse_sql='CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                                '"cook_recipe_user_id_c0eafa94" ON "cook_recipe" ("user_id");',
+                ),
+            ],
+        ),
+    ]
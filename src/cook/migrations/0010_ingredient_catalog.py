@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # 既存の材料の行のcatalog_idは0013_populate_ingredient_catalogで設定する
+
+    dependencies = [
+        ('cook', '0009_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientCatalog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='代表の材料名')),
+            ],
+            options={
+                'verbose_name': '材料名の辞書',
+                'verbose_name_plural': '材料名の辞書',
+            },
+        ),
+        migrations.CreateModel(
+            name='IngredientAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True, verbose_name='正規化した表記')),
+                ('catalog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='cook.ingredientcatalog', verbose_name='材料名')),
+            ],
+            options={
+                'verbose_name': '材料名の別名',
+                'verbose_name_plural': '材料名の別名',
+            },
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='catalog',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ingredients', to='cook.ingredientcatalog', verbose_name='材料名の辞書'),
+        ),
+    ]
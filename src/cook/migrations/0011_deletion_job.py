@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cook', '0010_ingredient_catalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='deleted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='DeletionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recipe', 'レシピ'), ('user', 'ユーザー')], max_length=10, verbose_name='種類')),
+                ('object_id', models.BigIntegerField(verbose_name='削除するID')),
+                ('total_recipes', models.IntegerField(default=0, verbose_name='削除するレシピの数')),
+                ('deleted_recipes', models.IntegerField(default=0, verbose_name='削除したレシピの数')),
+                ('deleted_ingredients', models.BigIntegerField(default=0, verbose_name='削除した材料の数')),
+                ('deleted_files', models.IntegerField(default=0, verbose_name='削除した画像の数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完了日')),
+                ('error', models.TextField(blank=True, verbose_name='エラー')),
+            ],
+            options={
+                'verbose_name': '削除の進捗',
+                'verbose_name_plural': '削除の進捗一覧',
+                'indexes': [models.Index(condition=models.Q(('finished_at__isnull', True)), fields=['id'], name='deletion_job_pending_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='deletion_job_object_unique')],
+            },
+        ),
+    ]
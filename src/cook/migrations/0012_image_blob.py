@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:36
+
+import cook.storage
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_image_blobs(apps, schema_editor):
+    """
+    既存の画像(元のファイル名のまま)にも参照数を作り、参照されなくなったら削除できるようにする
+    """
+    Recipe = apps.get_model('cook', 'Recipe')
+    ImageBlob = apps.get_model('cook', 'ImageBlob')
+    storage = cook.storage.image_storage()
+    rows = Recipe.objects.exclude(image='').exclude(image__isnull=True).values(
+        'image'
+    ).annotate(count=Count('id')).order_by()
+    batch = []
+    for row in rows.iterator(chunk_size=1000):
+        try:
+            size = storage.size(row['image'])
+        except OSError:
+            size = 0
+        batch.append(ImageBlob(name=row['image'], size=size, refcount=row['count']))
+        if len(batch) == 1000:
+            ImageBlob.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ImageBlob.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cook', '0011_deletion_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=cook.storage.image_storage, upload_to='images', verbose_name='レシピ画像'),
+        ),
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='ファイル名')),
+                ('size', models.BigIntegerField(default=0, verbose_name='サイズ')),
+                ('refcount', models.IntegerField(default=0, verbose_name='参照数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日')),
+            ],
+            options={
+                'verbose_name': '画像ファイル',
+                'verbose_name_plural': '画像ファイル一覧',
+                'indexes': [models.Index(condition=models.Q(('refcount__lte', 0)), fields=['updated_at'], name='image_blob_unreferenced_idx')],
+            },
+        ),
+        migrations.RunPython(populate_image_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+from cook.catalog import CatalogResolver, backfill
+
+
+def populate_catalog(apps, schema_editor):
+    connection = schema_editor.connection
+    resolver = CatalogResolver(
+        apps.get_model('cook', 'IngredientCatalog'),
+        apps.get_model('cook', 'IngredientAlias'),
+        using=connection.alias,
+    )
+    resolver.seed_aliases()
+    backfill(apps.get_model('cook', 'Ingredient'), resolver, connection=connection)
+
+
+class Migration(migrations.Migration):
+    # 材料の行の更新はバッチごとにコミットする。テーブルとカラムは0010で作成済みのため、
+    # 中断した場合は再実行するとcatalog_idが未設定の行から続きを処理する
+    atomic = False
+
+    dependencies = [
+        ('cook', '0012_image_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.contrib.postgres.operations import RemoveIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # 管理画面の材料名の検索は部分一致に戻し、材料名の辞書(catalog_id)で絞り込むため、
+    # 前方一致用のインデックスは使われない
+    atomic = False
+
+    dependencies = [
+        ('cook', '0013_populate_ingredient_catalog'),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name='ingredient',
+            name='ingredient_name_upper_idx',
+        ),
+    ]
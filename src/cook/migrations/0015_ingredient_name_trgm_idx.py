@@ -0,0 +1,52 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+def trigram_available(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )
+        return cursor.fetchone() is not None
+
+
+class AddTrigramIndexConcurrently(AddIndexConcurrently):
+    """
+    pg_trgmを有効にしてからインデックスを作成する
+    pg_trgmがインストールされていないデータベースでは作成しない(材料名の検索は全件走査になる)
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not trigram_available(schema_editor.connection):
+            return
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+    # 管理画面の材料名の部分一致検索(ModelAdminのname__icontains)用のインデックス
+    atomic = False
+
+    dependencies = [
+        ('cook', '0014_remove_ingredient_name_upper_idx'),
+    ]
+
+    operations = [
+        AddTrigramIndexConcurrently(
+            model_name='ingredient',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(
+                        django.db.models.functions.comparison.Cast(
+                            'name', models.TextField()
+                        )
+                    ),
+                    name='gin_trgm_ops'
+                ),
+                name='ingredient_name_trgm_idx'
+            ),
+        ),
+    ]
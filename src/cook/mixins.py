@@ -29,3 +29,8 @@ class AuthorRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
                 return redirect(redirect_url)
             else:
                 return redirect(settings.LOGIN_URL)
+
+
+class StaffRequiredMixin(AuthorRequiredMixin):
+    def test_func(self):
+        return self.request.user.is_staff
@@ -1,40 +1,171 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth import get_user_model
+from django.db.models.functions import Cast, Upper
 from django.utils import timezone
 
+from .images import (
+    acquire_images, release_images, rendition_name,
+    RENDITION_FORMATS, RENDITION_WIDTHS
+)
+from .storage import image_storage
+
 User = get_user_model()
 
 
 # Create your models here.
+class RecipeManager(models.Manager):
+    """
+    削除済み(cook.deletionで削除を待っている)レシピを除く
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Recipe(models.Model):
     name = models.CharField(max_length=50, verbose_name="レシピ名")
     description = models.TextField(verbose_name="レシピの詳細")
     posted_at = models.DateTimeField(default=timezone.now, verbose_name="投稿日")
+    # 条件付きGET(ETag / Last-Modified)に使う。材料の変更時もcook.signalsで更新する
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日")
+    # 内容のハッシュを名前にして保存する(cook.storage)。参照数はImageBlobで数える
     image = models.ImageField(
-        upload_to="images", blank=True, null=True, verbose_name="レシピ画像"
+        upload_to="images", storage=image_storage, blank=True, null=True,
+        verbose_name="レシピ画像"
     )
+    # user_idで始まるrecipe_user_posted_at_idxで足りるため、単独のインデックスは作らない
     user = models.ForeignKey(
         User,
         related_name='recipes',
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name="投稿ユーザー"
     )
+    # 画像のレンディション(サムネイル)が作成済みかどうか(cook.imagesで更新する)
+    image_renditions_ready = models.BooleanField(default=False, editable=False)
+    # 全文検索用のカラム(cook.signalsでレシピ・材料の保存時に更新する)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # 削除した日時。削除したレシピはobjectsから見えなくなり、
+    # 材料・画像とともにcook.deletionのバックグラウンドの処理で消す
+    deleted_at = models.DateTimeField(null=True, editable=False)
+
+    objects = RecipeManager()
+    # 削除済みのレシピも含む(cook.deletionで使う)
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = "レシピ"
         verbose_name_plural = "レシピ一覧"
+        indexes = [
+            GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+            # 管理画面の投稿日での絞り込み・並び替え
+            models.Index(fields=['posted_at', 'id'], name='recipe_posted_at_idx'),
+            # ユーザ詳細ページ・管理画面の投稿ユーザーでの絞り込み(投稿日の新しい順)
+            models.Index(
+                fields=['user', 'posted_at', 'id'], name='recipe_user_posted_at_idx'
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.name
 
-    def get_image_url(self):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 画像が変更されたかを判定するために読み込み時の画像を保持する
+        if 'image' in field_names:
+            instance._loaded_image_name = instance.__dict__['image']
+        return instance
+
+    def save(self, *args, **kwargs):
+        # 画像が変更された場合はレンディションを作り直す
+        loaded_image_name = getattr(self, '_loaded_image_name', None)
+        image_changed = 'image' not in self.get_deferred_fields() and \
+            self.image.name != loaded_image_name
+        if image_changed:
+            self.image_renditions_ready = False
+        super().save(*args, **kwargs)
+        if image_changed:
+            # 保存後のnameはストレージが内容から決めた名前
+            if self.image.name:
+                acquire_images([self.image.name])
+            if loaded_image_name:
+                release_images([loaded_image_name])
+        self._loaded_image_name = self.image.name
+
+    def get_image_url(self, width=None, fmt='jpeg'):
+        """
+        widthを指定した場合は作成済みのレンディションのURLを返す
+        """
         if self.image:
+            if width and self.image_renditions_ready:
+                name = rendition_name(self.image.name, width, fmt)
+                return '/media/' + self.image.storage.url(name)
             return '/media/' + self.image.url
         else:
             return '/media/images/default.jpg'
 
+    @property
+    def image_srcsets(self):
+        """
+        形式ごとのsrcset属性の値 {'webp': 'url 100w, ...', 'jpeg': ...}
+        """
+        if not (self.image and self.image_renditions_ready):
+            return {}
+        return {
+            fmt: ', '.join(
+                f'{self.get_image_url(width, fmt)} {width}w'
+                for width in RENDITION_WIDTHS
+            )
+            for fmt in RENDITION_FORMATS
+        }
+
+
+class IngredientCatalog(models.Model):
+    """
+    材料名の辞書(同じ材料を指す表記ごとに1行)。表記から引く処理はcook.catalogを使う
+    """
+    name = models.CharField(max_length=200, unique=True, verbose_name="代表の材料名")
+
+    class Meta:
+        verbose_name = "材料名の辞書"
+        verbose_name_plural = "材料名の辞書"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class IngredientAlias(models.Model):
+    """
+    正規化した表記(cook.catalog.catalog_key) -> 辞書の行。代表の表記自身も含む
+    """
+    key = models.CharField(max_length=200, unique=True, verbose_name="正規化した表記")
+    catalog = models.ForeignKey(
+        IngredientCatalog,
+        related_name='aliases',
+        on_delete=models.CASCADE,
+        verbose_name="材料名"
+    )
+
+    class Meta:
+        verbose_name = "材料名の別名"
+        verbose_name_plural = "材料名の別名"
+
+    def __str__(self) -> str:
+        return self.key
+
+    def save(self, *args, **kwargs):
+        # 管理画面では入力どおりの表記で登録できるようにする
+        from .catalog import catalog_key
+
+        self.key = catalog_key(self.key)
+        super().save(*args, **kwargs)
+
 
 class Ingredient(models.Model):
+    # 入力どおりの表記(表示用)。同じ材料の検索はcatalogで行う
     name = models.CharField(max_length=200, verbose_name="材料名")
     amount = models.CharField(max_length=100, verbose_name="量")
     recipe = models.ForeignKey(
@@ -43,10 +174,130 @@ class Ingredient(models.Model):
         on_delete=models.CASCADE,
         verbose_name="レシピ"
     )
+    # nameから引いた辞書の行(cook.signalsで保存時に設定する。
+    # bulk_createなどシグナルを通らない登録ではCatalogResolver.assignで設定する)
+    catalog = models.ForeignKey(
+        IngredientCatalog,
+        related_name='ingredients',
+        on_delete=models.PROTECT,
+        null=True,
+        editable=False,
+        verbose_name="材料名の辞書"
+    )
 
     class Meta:
         verbose_name = "具材"
         verbose_name_plural = "具材一覧"
+        indexes = [
+            # 管理画面の材料名の部分一致検索(UPPER(name::text) LIKE '%XX%')
+            # pg_trgmが使えないデータベースでは作成しない(0015)
+            GinIndex(
+                OpClass(Upper(Cast('name', models.TextField())), 'gin_trgm_ops'),
+                name='ingredient_name_trgm_idx'
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 材料名が変更されたか(辞書を引き直すか)を判定するために読み込み時の材料名を保持する
+        if 'name' in field_names:
+            instance._loaded_name = instance.__dict__['name']
+        return instance
+
+    def save(self, *args, **kwargs):
+        # catalogはnameから決まるため、nameだけを保存する場合もcatalogを一緒に保存する
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'catalog'}
+        super().save(*args, **kwargs)
+        self._loaded_name = self.name
+
+
+class ImportCheckpoint(models.Model):
+    """
+    import_recipesの進捗(取り込み済みのレコード数)
+    各バッチの保存と同じトランザクションで更新するため、再実行時に重複も欠落もしない
+    """
+    name = models.CharField(max_length=255, unique=True, verbose_name="ジョブ名")
+    position = models.BigIntegerField(default=0, verbose_name="処理済みのレコード数")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日")
+
+    class Meta:
+        verbose_name = "取り込みの進捗"
+        verbose_name_plural = "取り込みの進捗一覧"
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.position})'
+
+
+class ImageBlob(models.Model):
+    """
+    レシピ画像のファイル(cook.storage)ごとの参照数
+    0になったファイルはcook.images.collect_imagesで削除する
+    """
+    name = models.CharField(max_length=255, unique=True, verbose_name="ファイル名")
+    size = models.BigIntegerField(default=0, verbose_name="サイズ")
+    refcount = models.IntegerField(default=0, verbose_name="参照数")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日")
+
+    class Meta:
+        verbose_name = "画像ファイル"
+        verbose_name_plural = "画像ファイル一覧"
+        indexes = [
+            # 参照されなくなったファイルの削除(collect_images)
+            models.Index(
+                fields=['updated_at'], condition=models.Q(refcount__lte=0),
+                name='image_blob_unreferenced_idx'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.refcount})'
+
+
+class DeletionJob(models.Model):
+    """
+    レシピ・ユーザの削除の進捗(cook.deletion)
+    レシピは削除時にdeleted_at、ユーザはis_activeで見えなくし、関連する行の削除は
+    このジョブとしてバックグラウンドで行う。バッチごとに同じトランザクションで
+    進捗を更新するため、中断しても残りの行から再開できる
+    """
+    KIND_RECIPE = 'recipe'
+    KIND_USER = 'user'
+    KIND_CHOICES = [(KIND_RECIPE, "レシピ"), (KIND_USER, "ユーザー")]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name="種類")
+    object_id = models.BigIntegerField(verbose_name="削除するID")
+    total_recipes = models.IntegerField(default=0, verbose_name="削除するレシピの数")
+    deleted_recipes = models.IntegerField(default=0, verbose_name="削除したレシピの数")
+    deleted_ingredients = models.BigIntegerField(
+        default=0, verbose_name="削除した材料の数"
+    )
+    deleted_files = models.IntegerField(default=0, verbose_name="削除した画像の数")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="完了日")
+    error = models.TextField(blank=True, verbose_name="エラー")
+
+    class Meta:
+        verbose_name = "削除の進捗"
+        verbose_name_plural = "削除の進捗一覧"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'object_id'], name='deletion_job_object_unique'
+            ),
+        ]
+        indexes = [
+            # 未完了のジョブの再開(purge_deleted)
+            models.Index(
+                fields=['id'], condition=models.Q(finished_at__isnull=True),
+                name='deletion_job_pending_idx'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.kind} {self.object_id} ({self.deleted_recipes}/{self.total_recipes})'
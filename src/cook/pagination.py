@@ -0,0 +1,166 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections.abc import Sequence
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class CursorPaginator:
+    """
+    並び順のキーでシークするページネーション(keyset pagination)
+    OFFSETとCOUNT(*)を使わないため、深いページでも取得コストが変わらない
+    orderingの最後のフィールドは一意である必要がある
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('id',)):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = [
+            field.lstrip('-') for field in ordering
+        ]
+        self.descending = [field.startswith('-') for field in ordering]
+
+    def _get_field(self, name):
+        opts = self.object_list.model._meta
+        if name == 'pk':
+            return opts.pk
+        return opts.get_field(name)
+
+    def encode_cursor(self, obj):
+        """
+        オブジェクトの並び順のキーを不透明なカーソル文字列に変換する
+        """
+        values = [
+            self._get_field(name).value_to_string(obj)
+            for name in self.ordering
+        ]
+        raw = json.dumps(values, separators=(',', ':')).encode()
+        return urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        カーソル文字列を並び順のキーの値に戻す
+        """
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            values = json.loads(urlsafe_b64decode(cursor + padding))
+            if not isinstance(values, list) or \
+                    len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                self._get_field(name).to_python(value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor('カーソルが不正です。')
+
+    def _seek_filter(self, values, forward):
+        """
+        (a, b, c) > (x, y, z) のような辞書式順序の比較をQオブジェクトで組み立てる
+        """
+        conditions = []
+        for i, name in enumerate(self.ordering):
+            greater = self.descending[i] != forward
+            lookup = f'{name}__{"gt" if greater else "lt"}'
+            equals = {
+                self.ordering[j]: values[j] for j in range(i)
+            }
+            conditions.append(Q(**equals, **{lookup: values[i]}))
+        return reduce(or_, conditions)
+
+    def _order_by(self, forward):
+        return [
+            f'{"-" if descending == forward else ""}{name}'
+            for name, descending in zip(self.ordering, self.descending)
+        ]
+
+    def _page_queryset(self, after, before):
+        forward = before is None
+        cursor = after if forward else before
+        queryset = self.object_list.order_by(*self._order_by(forward))
+        if cursor:
+            queryset = queryset.filter(
+                self._seek_filter(self.decode_cursor(cursor), forward)
+            )
+        return queryset[:self.per_page + 1]
+
+    def get_page(self, after=None, before=None):
+        """
+        afterが指定された場合はその次から、beforeが指定された場合はその前までの
+        1ページ分を返す。per_page + 1件を取得して前後のページの有無を判定する
+        """
+        rows = list(self._page_queryset(after, before))
+        return self._make_page(rows, after, before)
+
+    async def aget_page(self, after=None, before=None):
+        rows = [row async for row in self._page_queryset(after, before)]
+        return self._make_page(rows, after, before)
+
+    def _make_page(self, rows, after, before):
+        forward = before is None
+        cursor = after if forward else before
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if forward:
+            return CursorPage(
+                rows, self,
+                has_next=has_more,
+                has_previous=bool(cursor)
+            )
+
+        rows.reverse()
+        return CursorPage(
+            rows, self,
+            has_next=True,
+            has_previous=has_more
+        )
+
+
+class CursorPage(Sequence):
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage ({len(self.object_list)} objects)>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        return self.paginator.encode_cursor(self.object_list[0])
@@ -1,15 +1,79 @@
+import asyncio
+import weakref
+
 import redis
+import redis.asyncio
 from django.conf import settings
 
+from .metrics import observe_redis
+
+
+# プロセス内で共有するコネクションプール(最初に使われたときに作成する)
+_connection_pool = None
+# asyncio版のプールはイベントループごとに作成する
+_async_connection_pools = weakref.WeakKeyDictionary()
+
+
+def _get_pool_options():
+    return {
+        'host': settings.REDIS_HOST,
+        'port': settings.REDIS_PORT,
+        'db': settings.REDIS_DB,
+        'max_connections': getattr(settings, 'REDIS_MAX_CONNECTIONS', 50),
+        'socket_timeout': getattr(settings, 'REDIS_SOCKET_TIMEOUT', 1.0),
+        'socket_connect_timeout': getattr(
+            settings, 'REDIS_SOCKET_CONNECT_TIMEOUT', 1.0
+        ),
+        'health_check_interval': 30,
+    }
+
+
+def get_connection_pool():
+    """
+    共有のコネクションプールを返す
+    作成しただけでは接続しないため、import時にネットワークへアクセスしない
+    """
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = redis.ConnectionPool(**_get_pool_options())
+    return _connection_pool
+
+
+def get_async_connection_pool():
+    """
+    実行中のイベントループ用のasyncioコネクションプールを返す
+    """
+    loop = asyncio.get_running_loop()
+    pool = _async_connection_pools.get(loop)
+    if pool is None:
+        pool = redis.asyncio.ConnectionPool(**_get_pool_options())
+        _async_connection_pools[loop] = pool
+    return pool
+
 
 class RedisHandler:
-    def __init__(self):
-        self.redis_client = redis.StrictRedis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            db=settings.REDIS_DB
-        )
+    def __init__(self, connection_pool=None):
+        self._connection_pool = connection_pool
+        self._redis_client = None
 
+    @property
+    def redis_client(self):
+        """
+        初回アクセス時にクライアントを作成する(lazy connect)
+        """
+        if self._redis_client is None:
+            self._redis_client = redis.StrictRedis(
+                connection_pool=self._connection_pool or get_connection_pool()
+            )
+        return self._redis_client
+
+    def pipeline(self, transaction=False):
+        """
+        複数のコマンドを1回の往復で送るためのパイプラインを返す
+        """
+        return self.redis_client.pipeline(transaction=transaction)
+
+    @observe_redis('get')
     def get_value_from_key(self, key):
         """
         Redisからフォームの数を取得
@@ -23,8 +87,86 @@ class RedisHandler:
 
         return result
 
-    def set_key_and_value(self, key, value):
+    @observe_redis('set')
+    def set_key_and_value(self, key, value, ex=None):
         """
         Redisにフォームの数を保存
         """
-        self.redis_client.set(key, value)
+        self.redis_client.set(key, value, ex=ex)
+
+    @observe_redis('mget')
+    def get_values_from_keys(self, keys):
+        """
+        複数のキーの値を1回の往復で取得する
+        存在しないキーは結果に含めない
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.redis_client.mget(keys)
+        return {
+            key: value for key, value in zip(keys, values) if value is not None
+        }
+
+    @observe_redis('mset')
+    def set_keys_and_values(self, mapping, ex=None):
+        """
+        複数のキーと値をパイプラインで1回の往復で保存する
+        """
+        with self.pipeline() as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=ex)
+            pipe.execute()
+
+
+class AsyncRedisHandler:
+    """
+    asyncビュー用のRedisHandler
+    イベントループをブロックしないようにredis.asyncioを使用する
+    """
+
+    def __init__(self, connection_pool=None):
+        self._connection_pool = connection_pool
+
+    @property
+    def redis_client(self):
+        return redis.asyncio.StrictRedis(
+            connection_pool=(
+                self._connection_pool or get_async_connection_pool()
+            )
+        )
+
+    def pipeline(self, transaction=False):
+        return self.redis_client.pipeline(transaction=transaction)
+
+    @observe_redis('get')
+    async def get_value_from_key(self, key):
+        result = await self.redis_client.get(key)
+
+        if result is None:
+            raise KeyError(
+                "Could'nt find key {} from redis server".format(key)
+            )
+
+        return result
+
+    @observe_redis('set')
+    async def set_key_and_value(self, key, value, ex=None):
+        await self.redis_client.set(key, value, ex=ex)
+
+    @observe_redis('mget')
+    async def get_values_from_keys(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = await self.redis_client.mget(keys)
+        return {
+            key: value for key, value in zip(keys, values) if value is not None
+        }
+
+    @observe_redis('mset')
+    async def set_keys_and_values(self, mapping, ex=None):
+        async with self.pipeline() as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=ex)
+            await pipe.execute()
@@ -0,0 +1,166 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVectorCombinable,
+    SearchVectorField,
+)
+from django.db.models import F, Func, Value
+
+# 単語の区切りとみなさない文字(英数字・ひらがな・カタカナ・漢字など)
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def normalize(text):
+    """
+    全角・半角の揺れをNFKCで正規化し、小文字にそろえる
+    """
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def tokenize(text):
+    """
+    文字列をbigram(2文字ずつ)のトークンに分割する
+    日本語は単語の間に空白がないため、形態素解析の代わりにbigramで検索する
+    1文字での前方一致検索のために単語の最後の1文字もトークンに加える
+    """
+    tokens = set()
+    for word in WORD_PATTERN.findall(normalize(text)):
+        tokens.update(word[i:i + 2] for i in range(len(word) - 1))
+        tokens.add(word[-1])
+    return sorted(tokens)
+
+
+class BigramVector(SearchVectorCombinable, Func):
+    """
+    bigramのトークンからtsvectorを作成する
+    PostgreSQLのパーサは日本語を分割できないため、array_to_tsvectorで直接作成する
+    """
+    template = (
+        "setweight(array_to_tsvector(%(expressions)s::text[]), '%(weight)s')"
+    )
+    output_field = SearchVectorField()
+    config = None
+
+    def __init__(self, text, weight='D'):
+        super().__init__(Value(tokenize(text)), weight=weight)
+
+
+class BigramSearchQuery(SearchQuery):
+    """
+    bigramのトークンをすべて含むtsqueryを作成する
+    1文字の検索語は前方一致で検索する
+    synonyms({検索語の単語: 材料の代表の表記})を渡すと、その単語は代表の表記との
+    どちらかを含めば一致する(材料の代表の表記は検索用のカラムに含まれる)
+    """
+    template = '%(expressions)s::tsquery'
+
+    def __init__(self, text, synonyms=None, **kwargs):
+        super().__init__(
+            self.build_query(text, synonyms), search_type='raw', **kwargs
+        )
+
+    @staticmethod
+    def quote(token):
+        return "'{}'".format(token.replace('\\', '\\\\').replace("'", "''"))
+
+    @classmethod
+    def word_terms(cls, word):
+        if len(word) == 1:
+            return [f'{cls.quote(word)}:*']
+        return [cls.quote(word[i:i + 2]) for i in range(len(word) - 1)]
+
+    @classmethod
+    def build_query(cls, text, synonyms=None):
+        words = WORD_PATTERN.findall(normalize(text))
+        terms = []
+        for word in words:
+            synonym = (synonyms or {}).get(word)
+            if synonym is None:
+                terms.extend(cls.word_terms(word))
+                continue
+            alternatives = [
+                ' & '.join(cls.word_terms(word)),
+                ' & '.join(
+                    term for part in WORD_PATTERN.findall(normalize(synonym))
+                    for term in cls.word_terms(part)
+                ),
+            ]
+            terms.append('( {} )'.format(' | '.join(
+                f'( {alternative} )' for alternative in dict.fromkeys(alternatives)
+            )))
+        return ' & '.join(dict.fromkeys(terms))
+
+
+def ingredient_synonyms(text):
+    """
+    {検索語の単語: 材料の代表の表記}(材料の辞書から1回のクエリで引く)
+    人参で検索すると、にんじん・ニンジンと入力されたレシピも一致するようにする
+    """
+    from .catalog import CatalogResolver, catalog_key
+
+    keys = {word: catalog_key(word) for word in WORD_PATTERN.findall(normalize(text))}
+    names = CatalogResolver().lookup_names(keys.values())
+    return {
+        word: names[key] for word, key in keys.items()
+        if key in names and normalize(names[key]) != word
+    }
+
+
+def build_search_vector(name, description, ingredient_names):
+    """
+    レシピ名(A) > 作り方(B) > 材料名(C)の順に重みをつけたtsvectorを作成する
+    """
+    return (
+        BigramVector(name, weight='A')
+        + BigramVector(description, weight='B')
+        + BigramVector(' '.join(ingredient_names), weight='C')
+    )
+
+
+def update_search_vectors(recipe_model, recipe_ids, updated_at=None):
+    """
+    指定したレシピの検索用のカラムを再計算する
+    材料は入力どおりの表記と材料の辞書の代表の表記(catalog)の両方を含める
+    updated_atを指定した場合は更新日時も同じUPDATEで更新する
+    """
+    ingredient_model = recipe_model._meta.get_field('ingredients').related_model
+    fields = ['recipe_id', 'name']
+    # 材料名の辞書(0010)より前のマイグレーションから呼ばれた場合は材料名だけを使う
+    if any(field.name == 'catalog' for field in ingredient_model._meta.get_fields()):
+        fields.append('catalog__name')
+    recipes = list(
+        recipe_model.objects.filter(id__in=recipe_ids)
+        .only('id', 'name', 'description')
+    )
+    ingredient_names = defaultdict(list)
+    for recipe_id, *names in ingredient_model.objects.filter(
+        recipe_id__in=[recipe.id for recipe in recipes]
+    ).order_by('id').values_list(*fields):
+        ingredient_names[recipe_id].extend(name for name in names if name)
+    update_fields = ['search_vector']
+    if updated_at is not None:
+        update_fields.append('updated_at')
+    for recipe in recipes:
+        recipe.search_vector = build_search_vector(
+            recipe.name, recipe.description, ingredient_names[recipe.id]
+        )
+        if updated_at is not None:
+            recipe.updated_at = updated_at
+    recipe_model.objects.bulk_update(recipes, update_fields)
+    return len(recipes)
+
+
+def search_recipes(queryset, text):
+    """
+    検索語に一致するレシピを関連度順に並べて返す
+    """
+    if not BigramSearchQuery.build_query(text):
+        return queryset.none()
+    query = BigramSearchQuery(text, synonyms=ingredient_synonyms(text))
+    return queryset.filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query)
+    ).order_by('-rank', 'id')
@@ -0,0 +1,127 @@
+"""
+性能計測用のデータ(seed_perfコマンド)の生成
+
+同じseedからは常に同じユーザ・レシピ・材料を生成する。値はすべてrandom.Randomから
+順番に取り出すため、件数やバッチサイズを変えなければ実行環境によらず同じになる
+"""
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO
+
+from PIL import Image
+
+LAST_NAMES = [
+    '佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '山本', '中村', '小林', '加藤',
+    '吉田', '山田', '佐々木', '山口', '松本', '井上', '木村', '林', '斎藤', '清水',
+]
+FIRST_NAMES = [
+    '陽翔', '蓮', '湊', '大和', '悠真', '翔', '健太', '誠', '直樹', '浩二',
+    '陽葵', '凛', '結菜', '葵', '美咲', 'さくら', '由美', '恵子', '花子', '真由美',
+]
+DISHES = [
+    '肉じゃが', '親子丼', '唐揚げ', '豚の生姜焼き', 'ハンバーグ', 'カレーライス',
+    '筑前煮', 'きんぴらごぼう', '麻婆豆腐', '餃子', 'オムライス', '茶碗蒸し',
+    'だし巻き卵', '鯖の味噌煮', 'ぶり大根', '豚汁', '味噌汁', '炊き込みご飯',
+    'お好み焼き', '焼きそば', '天ぷら', 'とんかつ', 'ひじきの煮物', '冷やし中華',
+    'ポテトサラダ', 'ほうれん草のおひたし', '牛丼', 'チャーハン', '回鍋肉', '南蛮漬け',
+]
+MODIFIERS = [
+    '', '', '', '簡単', '基本の', '本格', 'ふわふわ', 'やみつき', '時短',
+    'ヘルシー', 'お弁当に', '母の味', '作り置き', 'ご飯が進む', '10分で',
+]
+INGREDIENTS = [
+    'じゃがいも', '玉ねぎ', 'にんじん', '豚バラ肉', '鶏もも肉', '牛こま切れ肉', '合いびき肉',
+    '卵', '豆腐', '長ねぎ', 'キャベツ', '白菜', '大根', 'ごぼう', 'れんこん', 'しいたけ',
+    'しめじ', 'ほうれん草', 'もやし', 'ピーマン', 'なす', 'トマト', 'きゅうり', 'ブロッコリー',
+    '鮭', '鯖', 'ぶり', 'えび', 'ご飯', '中華麺', '小麦粉', '片栗粉', 'パン粉', '牛乳',
+    'バター', 'しょうゆ', 'みりん', '酒', '砂糖', '塩', 'こしょう', '味噌', '酢',
+    'ごま油', 'サラダ油', 'だし', '鶏がらスープの素', 'しょうが', 'にんにく', '白ごま',
+]
+AMOUNTS = [
+    '1個', '2個', '1/2個', '1本', '2本', '1/2本', '1枚', '2枚', '1パック', '1/2丁', '1丁',
+    '100g', '150g', '200g', '300g', '大さじ1', '大さじ2', '小さじ1', '小さじ1/2',
+    '100ml', '200ml', '400ml', '1カップ', '少々', '適量', 'ひとつまみ',
+]
+CUTS = ['薄切り', '乱切り', 'みじん切り', 'くし切り', '一口大', '千切り', 'ざく切り']
+STEPS = [
+    '{a}は{cut}にする。',
+    '{a}と{b}を合わせておく。',
+    'フライパンに油を熱し、{a}を炒める。',
+    '鍋に{a}と{b}を入れて中火で煮る。',
+    '{a}に火が通ったら{b}を加える。',
+    '蓋をして弱火で{n}分ほど煮込む。',
+    '{a}がしんなりするまで炒める。',
+    '味を見て{a}で調える。',
+    '器に盛り、お好みで{a}を添える。',
+]
+COMMENTS = [
+    '家族に好評でした。', '冷めてもおいしいのでお弁当にもおすすめです。',
+    '味付けはお好みで調整してください。', '前の日に作っておくと味がしみます。', '',
+]
+
+# 投稿日はこの日時までのspan_days日間に分布させる(実行日によらず同じにするため固定)
+POSTED_UNTIL = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+PLACEHOLDER_COLORS = [
+    (230, 126, 34), (231, 76, 60), (241, 196, 15), (46, 204, 113),
+    (52, 152, 219), (155, 89, 182), (149, 165, 166), (211, 84, 0),
+]
+
+
+class PerfDataGenerator:
+
+    def __init__(self, seed=0, span_days=3 * 365):
+        self.rng = random.Random(seed)
+        self.span_seconds = span_days * 24 * 60 * 60
+
+    def user_name(self):
+        """
+        (姓, 名)
+        """
+        return self.rng.choice(LAST_NAMES), self.rng.choice(FIRST_NAMES)
+
+    def ingredients(self, count):
+        """
+        [(材料名, 量), ...](1つのレシピの中で材料名は重複しない)
+        """
+        names = self.rng.sample(INGREDIENTS, min(count, len(INGREDIENTS)))
+        while len(names) < count:
+            names.append(self.rng.choice(INGREDIENTS))
+        return [(name, self.rng.choice(AMOUNTS)) for name in names]
+
+    def recipe(self, ingredient_count):
+        """
+        (レシピ名, 作り方, 投稿日, [(材料名, 量), ...])
+        作り方は材料名を使った3〜8手順の文章(100〜400文字程度)
+        """
+        rng = self.rng
+        name = rng.choice(MODIFIERS) + rng.choice(DISHES)
+        ingredients = self.ingredients(ingredient_count)
+        names = [ingredient[0] for ingredient in ingredients] or ['材料']
+        steps = [
+            f'{i}. ' + rng.choice(STEPS).format(
+                a=rng.choice(names), b=rng.choice(names),
+                cut=rng.choice(CUTS), n=rng.randint(3, 30)
+            )
+            for i in range(1, rng.randint(3, 8) + 1)
+        ]
+        description = '\n'.join(steps + [rng.choice(COMMENTS)]).strip()
+        posted_at = POSTED_UNTIL - timedelta(
+            seconds=rng.randrange(self.span_seconds)
+        )
+        return name, description, posted_at, ingredients
+
+    def choice(self, values):
+        return self.rng.choice(values)
+
+    def chance(self, ratio):
+        return self.rng.random() < ratio
+
+
+def placeholder_image(index, size=(640, 480)):
+    """
+    単色のJPEG(レシピ画像の代わり)
+    """
+    buffer = BytesIO()
+    color = PLACEHOLDER_COLORS[index % len(PLACEHOLDER_COLORS)]
+    Image.new('RGB', size, color).save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
@@ -0,0 +1,57 @@
+"""
+セッションエンジン(SESSION_ENGINE = 'cook.sessions')
+
+cached_dbと同じくRedis(CACHES['sessions'])から読み、変更があった場合のみDBとRedisに書く
+Redisにはorjsonで、一定の大きさを超える場合はzlibで圧縮して保存する
+(CACHES['sessions']のSERIALIZER・COMPRESSOR)。期限はセッションの有効期限と同じ
+SESSION_MAX_BYTESを超えるセッションは保存せずにSessionTooLargeを送出する
+"""
+import orjson
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core.exceptions import SuspiciousOperation
+from django_redis.compressors.zlib import ZlibCompressor
+from django_redis.serializers.base import BaseSerializer
+
+
+class SessionTooLarge(SuspiciousOperation):
+    """
+    SuspiciousOperationのため、ビューで送出された場合は400を返す
+    """
+
+
+class SessionSerializer(BaseSerializer):
+    """
+    セッションはJSONに変換できる値のみ(Djangoのセッションのシリアライザと同じ)
+    """
+
+    def dumps(self, value):
+        return orjson.dumps(value)
+
+    def loads(self, value):
+        return orjson.loads(value)
+
+
+class SessionCompressor(ZlibCompressor):
+    # ログイン情報だけの小さいセッションは圧縮しても小さくならない
+    min_length = 256
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = 'cook.sessions'
+
+    def check_size(self, session):
+        size = len(orjson.dumps(session))
+        max_bytes = getattr(settings, 'SESSION_MAX_BYTES', None)
+        if max_bytes and size > max_bytes:
+            raise SessionTooLarge(
+                f'セッションが大きすぎます: {size} > {max_bytes}バイト'
+            )
+
+    def save(self, must_create=False):
+        self.check_size(self._get_session(no_load=must_create))
+        super().save(must_create)
+
+    async def asave(self, must_create=False):
+        self.check_size(await self._aget_session(no_load=must_create))
+        await super().asave(must_create)
@@ -0,0 +1,177 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from . import cache as recipe_cache
+from .catalog import CatalogResolver
+from .images import release_images, schedule_recipe_renditions
+from .ingredient_index import IngredientIndex
+from .models import Recipe, Ingredient
+from .search import update_search_vectors
+
+logger = logging.getLogger(__name__)
+
+# batch_ingredient_changesのブロック内で材料が変更されたレシピのID
+_changed_recipes = ContextVar('changed_recipes', default=None)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, **kwargs):
+    """
+    レシピの保存時に検索用のカラムを更新する
+    batch_ingredient_changesのブロック内では、材料と一緒にブロックの最後に1回だけ更新する
+    """
+    changed = _changed_recipes.get()
+    if changed is not None:
+        changed.add(instance.id)
+    else:
+        update_search_vectors(Recipe, [instance.id])
+
+
+@receiver(pre_save, sender=Ingredient)
+def assign_ingredient_catalog(sender, instance, update_fields=None, **kwargs):
+    """
+    材料の保存時に材料名から辞書の行を引いて設定する(辞書にない材料名は登録する)
+    材料名が読み込み時から変わっていない場合は引き直さない
+    """
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    if instance.catalog_id is not None and \
+            instance.name == getattr(instance, '_loaded_name', None):
+        return
+    CatalogResolver().assign([instance])
+
+
+def reindex_ingredients(recipe_id):
+    try:
+        IngredientIndex().reindex_recipes([recipe_id])
+    except RedisError:
+        # Redisに接続できなくても材料の保存は失敗させない
+        # (rebuild_ingredient_indexで作り直せる)
+        logger.warning(
+            'Failed to update ingredient index for recipe %s', recipe_id,
+            exc_info=True
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def generate_recipe_renditions(sender, instance, **kwargs):
+    """
+    画像が登録・変更されたレシピのレンディションをコミット後にバックグラウンドで作成する
+    """
+    if instance.image and not instance.image_renditions_ready:
+        transaction.on_commit(
+            partial(schedule_recipe_renditions, instance.id)
+        )
+
+
+def invalidate_recipe_cache(recipe_id, list_changed):
+    try:
+        recipe_cache.invalidate_recipes([recipe_id], list_changed=list_changed)
+    except (RedisError, ConnectionInterrupted):
+        logger.warning(
+            'Failed to invalidate cache for recipe %s', recipe_id,
+            exc_info=True
+        )
+
+
+def _invalidate_now_and_on_commit(recipe_id, list_changed):
+    # コミット前に別のリクエストが古い内容をキャッシュし直した場合に備えて
+    # コミット後にももう一度無効にする
+    invalidate_recipe_cache(recipe_id, list_changed)
+    transaction.on_commit(
+        partial(invalidate_recipe_cache, recipe_id, list_changed)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe_on_save(sender, instance, created, **kwargs):
+    """
+    レシピのカードのキャッシュを無効にする。追加時は一覧のページも無効にする
+    """
+    _invalidate_now_and_on_commit(instance.id, list_changed=created)
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_on_delete(sender, instance, **kwargs):
+    _invalidate_now_and_on_commit(instance.id, list_changed=True)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_index(sender, instance, **kwargs):
+    """
+    レシピの削除時に材料名の転置インデックスから消す(材料が残っていないため空で登録し直す)
+    """
+    transaction.on_commit(partial(reindex_ingredients, instance.id))
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    """
+    管理画面などでレシピを削除した場合に画像の参照数を減らす(ファイルはgc_imagesで削除する)
+    """
+    release_images([instance.image.name])
+
+
+def _is_cascade(origin):
+    """
+    レシピ・ユーザの削除に伴う材料の削除か(レシピ自体が削除されるため材料ごとの処理は不要)
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is not Ingredient
+    return origin is not None and not isinstance(origin, Ingredient)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, instance, origin=None, **kwargs):
+    """
+    材料の追加・更新・削除はレシピの更新として扱い、ingredients_bulk_changedの処理を行う
+    batch_ingredient_changesのブロック内ではブロックの最後にレシピごとに1回だけ行う
+    """
+    if _is_cascade(origin):
+        return
+    changed = _changed_recipes.get()
+    if changed is not None:
+        changed.add(instance.recipe_id)
+    else:
+        ingredients_bulk_changed(instance.recipe_id)
+
+
+@contextmanager
+def batch_ingredient_changes():
+    """
+    フォームセットなどで複数の材料を保存する間、材料のシグナルの処理をまとめる
+    (行ごとに検索用のカラムの再計算や更新日時の更新をしない)
+    ブロック内で保存したレシピの検索用のカラムも、最後に材料と一緒に計算する
+    """
+    if _changed_recipes.get() is not None:
+        yield
+        return
+    changed = set()
+    token = _changed_recipes.set(changed)
+    try:
+        yield
+    finally:
+        _changed_recipes.reset(token)
+    for recipe_id in sorted(changed):
+        ingredients_bulk_changed(recipe_id)
+
+
+def ingredients_bulk_changed(recipe_id):
+    """
+    bulk_update・bulk_create・raw_deleteで材料を変更した後に、材料のシグナルと同じ処理を
+    レシピごとに1回だけ行う(更新日時・検索用のカラム・転置インデックス・キャッシュ)
+    """
+    update_search_vectors(Recipe, [recipe_id], updated_at=timezone.now())
+    transaction.on_commit(partial(reindex_ingredients, recipe_id))
+    _invalidate_now_and_on_commit(recipe_id, list_changed=False)
@@ -1,4 +1,47 @@
 $(document).ready(function() {
+  const $container = $("#formset-container");
+  const $totalForms = $("#id_ingredients-TOTAL_FORMS");
+  const minForms = parseInt($container.data("min-forms"));
+  const maxForms = parseInt($container.data("max-forms"));
+  const template = document.getElementById("ingredient-empty-form");
+  // テンプレートの行がある場合はサーバに送信せずにブラウザでフォームの数を変える
+  const clientSide = template !== null;
+  const initialForms = $container.children(".ingredient-form").length;
+
+  function showMessage(message) {
+    $("#formset-message").text(message);
+  }
+
+  function addForm() {
+    const totalForms = parseInt($totalForms.val());
+    if (totalForms >= maxForms) {
+      showMessage("これ以上フォームを増やせません。");
+      return;
+    }
+    const row = template.innerHTML.replace(/__prefix__/g, totalForms);
+    $container.append(row);
+    $totalForms.val(totalForms + 1);
+    showMessage("");
+  }
+
+  function removeForm() {
+    const totalForms = parseInt($totalForms.val());
+    if (totalForms <= minForms) {
+      showMessage("これ以上フォームを減らせません。");
+      return;
+    }
+    $container.children(".ingredient-form").last().remove();
+    $totalForms.val(totalForms - 1);
+    showMessage("");
+  }
+
+  $("button[name=add_form]").click(function(event) {
+    if (clientSide) {
+      event.preventDefault();
+      addForm();
+    }
+  });
+
   $("button[name=remove_form]").click(function(event) {
     console.log('started remove_form');
     // id_ingredients-TOTAL_FORMSというidのinputのデータを取得する
@@ -15,15 +58,28 @@ $(document).ready(function() {
       );
       if (!result) {
         event.preventDefault(); // フォームの送信を中止
+        return;
       }
     }
+    if (clientSide) {
+      event.preventDefault();
+      removeForm();
+    }
   })
 
   $("button[name=reset_form]").click(function(event) {
     // 現在入力されている値はすべて消去されるがよいかを確認。
     if (!confirm("現在入力されている値はすべて消去されますが、よろしいですか？")) {
       event.preventDefault(); // フォームの送信を中止
+      return;
+    }
+    if (clientSide) {
+      event.preventDefault();
+      // 初期表示の数に戻して入力を消去する
+      $container.children(".ingredient-form").slice(initialForms).remove();
+      $container.find("input").val("");
+      $totalForms.val(initialForms);
+      showMessage("");
     }
-
   });
 });
@@ -0,0 +1,82 @@
+"""
+レシピ画像のストレージ(内容のハッシュを名前にする)
+
+アップロードされたファイルはディスクに書きながらSHA-256を計算し、
+images/ab/cd/<ハッシュ>.jpg(ハッシュの先頭2文字ずつのディレクトリ)に保存する
+同じ内容の画像は1つのファイルを共有し、名前(URL)は内容が変わらない限り変わらないため、
+nginxではCache-Control: immutableで配信する
+どのレシピからも参照されなくなったファイルはImageBlobの参照数をもとに
+cook.images.collect_imagesで削除する
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, storages
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME_PATTERN = re.compile(
+    r'^(?:.+/)?[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(?:\.[a-z0-9]+)?$'
+)
+
+
+def is_content_addressed(name):
+    return bool(name and HASHED_NAME_PATTERN.match(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    hash_algorithm = 'sha256'
+
+    def get_available_name(self, name, max_length=None):
+        # 保存する名前は_saveで内容から決めるため、元のファイル名での重複は気にしない
+        return name
+
+    def hashed_name(self, name, digest):
+        """
+        images/dish.JPG -> images/ab/cd/abcd....jpg
+        """
+        directory, filename = posixpath.split(name)
+        _, ext = posixpath.splitext(filename)
+        return posixpath.join(
+            directory, digest[:2], digest[2:4], digest + ext.lower()
+        )
+
+    def _save(self, name, content):
+        directory = self.path(posixpath.dirname(name) or '.')
+        os.makedirs(directory, exist_ok=True)
+        # 同じディレクトリの一時ファイルに書き、最後にrenameする(同じファイルシステムのため
+        # renameは1回の操作で行われ、書きかけのファイルが見えることはない)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            digest = hashlib.new(self.hash_algorithm)
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            final_name = self.hashed_name(name, digest.hexdigest())
+            final_path = self.path(final_name)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            if os.path.exists(final_path):
+                # 同じ内容のファイルがある場合は書かずに共有する
+                # (更新日時を進め、collect_imagesの猶予期間の間は削除されないようにする)
+                os.utime(final_path)
+                os.unlink(temp_path)
+            else:
+                # mkstempのファイルは所有者しか読めないため、nginxから読めるようにする
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                os.replace(temp_path, final_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return final_name
+
+
+def image_storage():
+    """
+    Recipe.imageのストレージ(settings.STORAGES['images'])
+    """
+    return storages['images']
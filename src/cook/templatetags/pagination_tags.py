@@ -0,0 +1,18 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def elided_page_range(page_obj, on_each_side=2):
+    """
+    現在のページの前後と先頭・末尾のページ番号(省略した箇所はNone)
+    全ページのリンクを並べるとページ数に比例して描画が遅くなるため
+    """
+    paginator = page_obj.paginator
+    return [
+        None if page_num == paginator.ELLIPSIS else page_num
+        for page_num in paginator.get_elided_page_range(
+            page_obj.number, on_each_side=on_each_side, on_ends=1
+        )
+    ]
@@ -1,11 +1,69 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.conf import settings
 from django.urls import reverse
-from django.test import TestCase
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+    LiveServerTestCase,
+    AsyncRequestFactory,
+    override_settings
+)
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from PIL import Image
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.utils.http import urlencode
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.http import Http404
 from bs4 import BeautifulSoup
-
-from .models import Recipe, Ingredient
+import orjson
+from django.core.cache import caches
+from django_redis import get_redis_connection
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from .models import (
+    ImageBlob, Recipe, Ingredient, IngredientAlias, IngredientCatalog
+)
+from .catalog import CatalogResolver, backfill
+from .db_utils import raw_delete
+from .deletion import delete_recipe, delete_user, purge, purge_batch, schedule_purge
+from .forms import IngredientForm
+from .redis_utils import RedisHandler, AsyncRedisHandler
+from .search import (
+    BigramSearchQuery, search_recipes, tokenize, update_search_vectors
+)
+from .signals import batch_ingredient_changes
+from .ingredient_index import (
+    IngredientIndex, normalize_ingredient_name, resolve_catalog_ids, search_database
+)
+from .images import (
+    _run_in_background, acquire_images, collect_images, generate_renditions,
+    rendition_names, schedule_recipe_renditions
+)
+from .storage import ContentAddressedStorage, is_content_addressed
+from . import cache as recipe_cache
+from .async_views import AsyncRecipeListView, AsyncRecipeDetailView
+from .views import RecipeExportView
+from .bulk_import import CSV_COLUMNS
+from .export import fetch_batch
+from .middleware import QueryBudgetExceeded, QueryStats
+from .sessions import SessionStore, SessionTooLarge
+from . import metrics
 
 
 User = get_user_model()
@@ -158,12 +216,169 @@ class IngredientModelTestCase(TestCase):
         with self.assertRaises(ValidationError):
             ingredient.full_clean()
 
+    def test_batch_updates_recipe_once(self):
+        """
+        batch_ingredient_changesのブロック内では、レシピの検索用のカラムをブロックの最後に1回だけ更新する
+        """
+        with patch('cook.signals.update_search_vectors',
+                   wraps=update_search_vectors) as update:
+            with batch_ingredient_changes():
+                for name in ('Salt', 'Pepper', 'Butter'):
+                    Ingredient.objects.create(
+                        name=name, amount='1g', recipe=self.recipe
+                    )
+                self.assertEqual(update.call_count, 0)
+        self.assertEqual(update.call_count, 1)
+        self.assertEqual(update.call_args.args, (Recipe, [self.recipe.id]))
+        self.assertEqual(
+            list(Recipe.objects.filter(
+                search_vector=BigramSearchQuery('Butter')
+            ).values_list('id', flat=True)),
+            [self.recipe.id]
+        )
+
+    def test_recipe_deletion_skips_ingredient_updates(self):
+        """
+        レシピの削除に伴う材料の削除では、材料ごとにレシピを更新しない
+        """
+        for name in ('Salt', 'Pepper'):
+            Ingredient.objects.create(name=name, amount='1g', recipe=self.recipe)
+        with patch('cook.signals.ingredients_bulk_changed') as changed:
+            self.recipe.delete()
+        changed.assert_not_called()
+        self.assertEqual(Ingredient.objects.count(), 0)
+
+
+class IngredientCatalogTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Test Recipe',
+            description='This is a test recipe description',
+            user=self.user
+        )
+
+    def create(self, name):
+        return Ingredient.objects.create(name=name, amount='1個', recipe=self.recipe)
+
+    def test_spelling_variants_share_catalog(self):
+        """
+        全角・半角、カタカナ・ひらがな、空白の違いと登録済みの別名は同じ辞書の行になる
+        """
+        ingredients = [
+            self.create(name)
+            for name in ['玉ねぎ', 'たまねぎ', 'タマネギ', 'ﾀﾏﾈｷﾞ', ' 玉葱 ']
+        ]
+        self.assertEqual({ingredient.catalog_id for ingredient in ingredients}, {
+            IngredientCatalog.objects.get(name='玉ねぎ').id
+        })
+        # 入力どおりの表記は残す
+        self.assertEqual(ingredients[3].name, 'ﾀﾏﾈｷﾞ')
+
+    def test_unknown_name_is_registered(self):
+        ingredient = self.create('ズッキーニ')
+        self.assertEqual(ingredient.catalog.name, 'ズッキーニ')
+        self.assertEqual(
+            list(ingredient.catalog.aliases.values_list('key', flat=True)),
+            ['ずっきーに']
+        )
+        self.assertEqual(self.create('ずっきーに').catalog_id, ingredient.catalog_id)
+
+    def test_update_name_changes_catalog(self):
+        ingredient = self.create('人参')
+        ingredient.name = '大根'
+        ingredient.save()
+        ingredient.refresh_from_db()
+        self.assertEqual(ingredient.catalog.name, '大根')
+
+    def test_update_fields_name_saves_catalog(self):
+        """
+        update_fieldsにnameだけを指定して保存してもcatalogを一緒に保存する
+        """
+        ingredient = Ingredient.objects.get(id=self.create('人参').id)
+        ingredient.name = '大根'
+        ingredient.save(update_fields=['name'])
+        ingredient.refresh_from_db()
+        self.assertEqual(ingredient.catalog.name, '大根')
+
+    def test_unchanged_name_skips_lookup(self):
+        """
+        材料名を変更しない保存では辞書を引き直さない
+        """
+        ingredient = Ingredient.objects.get(id=self.create('人参').id)
+        ingredient.amount = '2本'
+        with CaptureQueriesContext(connection) as queries:
+            ingredient.save()
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'cook_ingredientalias' in query['sql']
+        ])
+
+    def test_resolve_known_names_in_one_query(self):
+        resolver = CatalogResolver()
+        resolver.resolve(['ズッキーニ'])
+        with self.assertNumQueries(1):
+            catalog_ids = resolver.resolve(['ズッキーニ', 'しょうゆ', '醤油'])
+        self.assertEqual(catalog_ids['しょうゆ'], catalog_ids['醤油'])
+
+    def test_alias_key_is_normalized(self):
+        catalog = IngredientCatalog.objects.get(name='玉ねぎ')
+        IngredientAlias.objects.create(catalog=catalog, key='オニオン')
+        self.assertEqual(self.create('おにおん').catalog_id, catalog.id)
+
+    def test_backfill_in_batches(self):
+        """
+        catalog_idが未設定の行をバッチごとに設定し、再実行では何もしない
+        """
+        Ingredient.objects.bulk_create([
+            Ingredient(name=name, amount='1個', recipe=self.recipe)
+            for name in ['人参', 'にんじん', 'ニンジン', '卵', 'たまご']
+        ])
+        progress = []
+        updated = backfill(
+            Ingredient, CatalogResolver(), batch_size=2,
+            progress=lambda *args: progress.append(args)
+        )
+        self.assertEqual(updated, 5)
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(
+            dict(Ingredient.objects.values_list('name', 'catalog__name')), {
+                '人参': 'にんじん', 'にんじん': 'にんじん', 'ニンジン': 'にんじん',
+                '卵': '卵', 'たまご': '卵',
+            }
+        )
+        self.assertEqual(backfill(Ingredient, CatalogResolver()), 0)
+
+    def test_report_command(self):
+        self.create('玉ねぎ')
+        self.create('たまねぎ')
+        stdout = StringIO()
+        call_command(
+            'ingredient_catalog_report', names=['玉ねぎ', '玉葱'], repeat=1,
+            json=True, stdout=stdout
+        )
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(
+            [table['table'] for table in report['tables']],
+            ['cook_ingredient', 'cook_ingredientcatalog', 'cook_ingredientalias']
+        )
+        self.assertEqual(report['columns']['rows_without_catalog'], 0)
+        self.assertEqual(
+            [(r['text_rows'], r['catalog_rows']) for r in report['lookups']],
+            [(1, 2), (0, 2)]
+        )
+
 
 class RecipeListViewTestCase(TestCase):
     list_link = reverse('cook:recipe_list')
     template_name = 'recipe/list.html'
 
     def setUp(self):
+        # 他のテストでキャッシュされたページを使わないようにする
+        recipe_cache.clear()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpassword'
@@ -222,33 +437,1934 @@ class RecipeListViewTestCase(TestCase):
         exist_link = soup.find('a', href=recipe_link)
         self.assertIsNotNone(exist_link)
 
-    def test_recipe_list_pagination(self):
-        """
-        ページネーションが存在し、1ページに最大5つのレシピが表示される
-        それ以上の場合は次のページに表示される
-        """
-        for i in range(8):
+    def test_recipe_list_pagination(self):
+        """
+        ページネーションが存在し、1ページに最大5つのレシピが表示される
+        それ以上の場合は次のページに表示される
+        """
+        for i in range(8):
+            Recipe.objects.create(
+                name=f'Recipe {i+1}',
+                description=f'Description {i+1}',
+                user=self.user
+            )
+
+        # 1ページ目の確認
+        response = self.client.get(self.list_link)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['recipes'].count(), 5)
+        # 次のページが存在しているか
+        self.assertContains(response, 'href="?page=2"')
+
+        # 2ページ目の確認
+        response = self.client.get(self.list_link + '?page=2')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['recipes'].count(), 3)
+        # 次のページへのリンクがないことを確認
+        self.assertNotContains(response, 'href="?page=3"')
+
+    def test_recipe_list_pagination_elides_page_links(self):
+        """
+        ページ数が多い場合は現在のページの前後と先頭・末尾のリンクだけを表示する
+        """
+        Recipe.objects.bulk_create([
+            Recipe(name=f'Recipe {i}', description='d', user=self.user)
+            for i in range(100)
+        ])
+
+        response = self.client.get(self.list_link + '?page=10')
+
+        self.assertContains(response, 'href="?page=1"')
+        self.assertContains(response, 'href="?page=12"')
+        self.assertContains(response, 'href="?page=20"')
+        self.assertNotContains(response, 'href="?page=5"')
+        self.assertNotContains(response, 'href="?page=15"')
+        self.assertContains(response, '・・・', count=2)
+
+    @override_settings(RECIPE_LIST_PAGINATION='cursor')
+    def test_recipe_list_cursor_pagination(self):
+        """
+        カーソル方式のページネーションで前後のページへ移動できる
+        COUNT(*)を発行せず、1ページにつき1クエリで取得する
+        """
+        recipes = [
+            Recipe.objects.create(
+                name=f'Recipe {i+1}',
+                description=f'Description {i+1}',
+                user=self.user
+            )
+            for i in range(8)
+        ]
+
+        # 1ページ目の確認
+        with self.assertNumQueries(1):
+            response = self.client.get(self.list_link)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['recipes']), recipes[:5])
+        self.assertNotContains(response, 'href="?page=')
+        self.assertNotContains(response, 'href="?before=')
+        next_cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, f'href="?after={next_cursor}"')
+
+        # 2ページ目の確認
+        with self.assertNumQueries(1):
+            response = self.client.get(f'{self.list_link}?after={next_cursor}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['recipes']), recipes[5:])
+        self.assertNotContains(response, 'href="?after=')
+        previous_cursor = response.context['page_obj'].previous_cursor
+        self.assertContains(response, f'href="?before={previous_cursor}"')
+
+        # 前のページに戻る
+        response = self.client.get(
+            f'{self.list_link}?before={previous_cursor}'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['recipes']), recipes[:5])
+        self.assertNotContains(response, 'href="?before=')
+        self.assertContains(response, 'href="?after=')
+
+    @override_settings(RECIPE_LIST_PAGINATION='cursor')
+    def test_recipe_list_cursor_pagination_invalid_cursor(self):
+        """
+        不正なカーソルが指定された場合は404を返す
+        """
+        response = self.client.get(f'{self.list_link}?after=invalid')
+        self.assertEqual(response.status_code, 404)
+
+
+# 接続できないRedis(キャッシュが使えない場合の確認用)
+UNREACHABLE_CACHES = {
+    **settings.CACHES,
+    'default': {
+        **settings.CACHES['default'],
+        'LOCATION': 'redis://127.0.0.1:1/0',
+    },
+}
+
+
+class RecipeListCacheTestCase(TestCase):
+    list_link = reverse('cook:recipe_list')
+
+    def setUp(self):
+        recipe_cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                name=f'Recipe {i+1}',
+                description=f'Description {i+1}',
+                user=self.user
+            )
+            for i in range(3)
+        ]
+
+    def _stats_delta(self, before):
+        after = recipe_cache.get_stats()
+        return {
+            kind: {
+                result: after[kind][result] - before[kind][result]
+                for result in ('hit', 'miss')
+            }
+            for kind in after
+        }
+
+    def test_second_request_is_served_from_cache(self):
+        """
+        2回目以降はデータベースにアクセスせず、同じHTMLを返す
+        """
+        first = self.client.get(self.list_link)
+
+        stats = recipe_cache.get_stats()
+        with self.assertNumQueries(0):
+            second = self.client.get(self.list_link)
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(
+            self._stats_delta(stats),
+            {'card': {'hit': 3, 'miss': 0}, 'page': {'hit': 1, 'miss': 0}}
+        )
+
+    def test_list_is_rendered_without_redis(self):
+        """
+        Redisに接続できない場合もキャッシュを使わずに一覧を表示する
+        """
+        expected = self.client.get(self.list_link).content
+        with self.settings(CACHES=UNREACHABLE_CACHES), \
+                self.assertLogs('cook.cache', 'WARNING'):
+            response = self.client.get(self.list_link)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected)
+
+    def test_update_invalidates_only_its_card(self):
+        """
+        レシピを更新するとそのレシピのカードだけを描画し直す
+        """
+        self.client.get(self.list_link)
+        recipe = self.recipes[1]
+        recipe.name = 'Updated'
+        recipe.save()
+
+        stats = recipe_cache.get_stats()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.list_link)
+
+        self.assertContains(response, 'Updated')
+        self.assertNotContains(response, 'Recipe 2')
+        self.assertEqual(
+            self._stats_delta(stats),
+            {'card': {'hit': 2, 'miss': 1}, 'page': {'hit': 1, 'miss': 0}}
+        )
+
+    def test_ingredient_change_invalidates_its_recipe_card(self):
+        """
+        材料の追加・削除ではそのレシピのカードだけが無効になる
+        """
+        self.client.get(self.list_link)
+        ingredient = Ingredient.objects.create(
+            name='卵', amount='1個', recipe=self.recipes[0]
+        )
+
+        stats = recipe_cache.get_stats()
+        self.client.get(self.list_link)
+        self.assertEqual(
+            self._stats_delta(stats)['card'], {'hit': 2, 'miss': 1}
+        )
+
+        ingredient.delete()
+        stats = recipe_cache.get_stats()
+        self.client.get(self.list_link)
+        self.assertEqual(
+            self._stats_delta(stats)['card'], {'hit': 2, 'miss': 1}
+        )
+
+    def test_create_and_delete_invalidate_pages(self):
+        """
+        レシピの追加・削除で一覧のページを作り直す
+        """
+        self.client.get(self.list_link)
+
+        recipe = Recipe.objects.create(
+            name='New Recipe', description='new', user=self.user
+        )
+        response = self.client.get(self.list_link)
+        self.assertContains(response, 'New Recipe')
+
+        recipe.delete()
+        response = self.client.get(self.list_link)
+        self.assertNotContains(response, 'New Recipe')
+
+        self.recipes[0].delete()
+        response = self.client.get(self.list_link)
+        self.assertNotContains(response, 'Recipe 1<')
+        self.assertContains(response, 'Recipe 3')
+
+    def test_pagination_is_cached(self):
+        """
+        キャッシュしたページでもページネーションのリンクが表示される
+        """
+        for i in range(3, 8):
+            Recipe.objects.create(
+                name=f'Recipe {i+1}',
+                description=f'Description {i+1}',
+                user=self.user
+            )
+        self.client.get(self.list_link + '?page=2')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_link + '?page=2')
+
+        self.assertContains(response, 'href="?page=1"')
+        self.assertContains(response, 'Recipe 8')
+        self.assertNotContains(response, 'Recipe 5<')
+
+
+class RecipeSearchViewTestCase(TestCase):
+    search_link = reverse('cook:recipe_search')
+    template_name = 'recipe/search.html'
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.nikujaga = Recipe.objects.create(
+            name='肉じゃが',
+            description='じゃがいもと牛肉を甘辛く煮込みます。',
+            user=self.user
+        )
+        self.curry = Recipe.objects.create(
+            name='カレーライス',
+            description='肉じゃがの残りをカレーにします。',
+            user=self.user
+        )
+        Ingredient.objects.create(
+            name='玉ねぎ', amount='1個', recipe=self.curry
+        )
+
+    def _search(self, q):
+        return self.client.get(self.search_link, {'q': q})
+
+    def test_tokenize(self):
+        """
+        全角・半角を正規化してbigramに分割する
+        """
+        self.assertEqual(tokenize('玉ねぎ'), ['ぎ', 'ねぎ', '玉ね'])
+        self.assertEqual(tokenize('ＡＢ c'), ['ab', 'b', 'c'])
+
+    def test_search_by_name_description_and_ingredient(self):
+        """
+        レシピ名・作り方・材料名で検索でき、レシピ名の一致が上位に表示される
+        """
+        response = self._search('肉じゃが')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, self.template_name)
+        self.assertEqual(
+            list(response.context['recipes']), [self.nikujaga, self.curry]
+        )
+
+        response = self._search('玉ねぎ')
+        self.assertEqual(list(response.context['recipes']), [self.curry])
+
+    def test_search_by_ingredient_alias(self):
+        """
+        材料名の別名・表記の揺れでも材料の辞書の代表の表記で一致する
+        """
+        for q in ['玉葱', 'タマネギ', 'たまねぎ カレー']:
+            with self.subTest(q=q):
+                response = self._search(q)
+                self.assertEqual(list(response.context['recipes']), [self.curry])
+
+    def test_search_with_single_character(self):
+        """
+        1文字の検索語は前方一致で検索する
+        """
+        response = self._search('玉')
+        self.assertEqual(list(response.context['recipes']), [self.curry])
+
+    def test_search_not_found(self):
+        """
+        一致するレシピがない場合はメッセージが表示される
+        """
+        response = self._search('ハンバーグ')
+
+        self.assertEqual(len(response.context['recipes']), 0)
+        self.assertContains(response, '一致するレシピは見つかりませんでした。')
+
+    def test_search_vector_is_updated_by_ingredient(self):
+        """
+        材料の追加・削除で検索結果が更新される
+        """
+        ingredient = Ingredient.objects.create(
+            name='しらたき', amount='1袋', recipe=self.nikujaga
+        )
+        response = self._search('しらたき')
+        self.assertEqual(list(response.context['recipes']), [self.nikujaga])
+
+        ingredient.delete()
+        response = self._search('しらたき')
+        self.assertEqual(len(response.context['recipes']), 0)
+
+    def test_search_pagination_keeps_query(self):
+        """
+        ページネーションのリンクに検索語が引き継がれる
+        """
+        for i in range(5):
+            Recipe.objects.create(
+                name=f'肉じゃが{i}', description='煮込みます。', user=self.user
+            )
+
+        response = self._search('肉じゃが')
+        self.assertEqual(len(response.context['recipes']), 5)
+        self.assertContains(response, 'href="?q=%E8%82%89')
+
+    def test_search_uses_gin_index(self):
+        """
+        検索がGINインデックスを使用する
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = search_recipes(Recipe.objects.all(), '肉じゃが').explain()
+        self.assertIn('recipe_search_vector_idx', plan)
+
+
+@override_settings(INGREDIENT_INDEX_PREFIX='test:ingredient_index:')
+class RecipeSuggestViewTestCase(TestCase):
+    suggest_link = reverse('cook:recipe_suggest')
+
+    def setUp(self):
+        self.index = IngredientIndex()
+        self.index.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.omelet = self._create_recipe('オムレツ', ['卵', '牛乳'])
+        self.oyakodon = self._create_recipe(
+            '親子丼', ['鶏肉', '卵', '玉ねぎ', 'ご飯']
+        )
+        self.curry = self._create_recipe(
+            'カレー', ['豚肉', '玉ねぎ', '人参', 'じゃがいも']
+        )
+
+    def tearDown(self):
+        self.index.clear()
+
+    def _create_recipe(self, name, ingredient_names):
+        recipe = Recipe.objects.create(
+            name=name, description='作り方', user=self.user
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            for ingredient_name in ingredient_names:
+                Ingredient.objects.create(
+                    name=ingredient_name, amount='適量', recipe=recipe
+                )
+        return recipe
+
+    def _suggest(self, ingredients):
+        return self.client.get(self.suggest_link, {'ingredients': ingredients})
+
+    def test_normalize_ingredient_name(self):
+        """
+        全角・半角、カタカナ・ひらがな、空白の違いを無視する
+        """
+        self.assertEqual(normalize_ingredient_name(' 玉ネギ '), '玉ねぎ')
+        self.assertEqual(normalize_ingredient_name('ﾀﾏﾈｷﾞ'), 'たまねぎ')
+
+    def test_suggest_ranked_by_coverage(self):
+        """
+        材料のカバー率が高い順に、揃っている材料数と足りない材料数を返す
+        """
+        self.assertEqual(
+            self.index.search(['卵', '牛乳', '玉ネギ', '鶏肉']),
+            [
+                (self.omelet.id, 2, 0),
+                (self.oyakodon.id, 3, 1),
+                (self.curry.id, 1, 3),
+            ]
+        )
+        self.assertEqual(self.index.search(['卵'], limit=1), [
+            (self.omelet.id, 1, 1)
+        ])
+
+    def test_suggest_matches_aliases(self):
+        """
+        インデックスは材料の辞書のidで引くため、別名(玉葱・にんじん)でも同じレシピが見つかる
+        """
+        self.assertEqual(
+            self.index.search(['玉葱', 'にんじん']),
+            [(self.curry.id, 2, 2), (self.oyakodon.id, 1, 3)]
+        )
+        self.assertEqual(self.index.search(['キャベツ']), [])
+
+    def test_index_is_updated_on_ingredient_change(self):
+        """
+        材料の更新・削除でインデックスが更新される
+        """
+        ingredient = self.omelet.ingredients.get(name='牛乳')
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.name = 'バター'
+            ingredient.save()
+        self.assertEqual(self.index.search(['牛乳']), [])
+        self.assertEqual(
+            self.index.search(['バター']), [(self.omelet.id, 1, 1)]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.omelet.delete()
+        self.assertEqual(self.index.search(['卵']), [
+            (self.oyakodon.id, 1, 3)
+        ])
+
+    def test_suggest_view(self):
+        """
+        材料を入力するとレシピと揃っている・足りない材料数が表示される
+        """
+        # 材料名から辞書のidを引くクエリ + レシピの取得
+        with self.assertNumQueries(2):
+            response = self._suggest('卵、牛乳')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'recipe/suggest.html')
+        self.assertEqual(
+            [result['recipe'] for result in response.context['results']],
+            [self.omelet, self.oyakodon]
+        )
+        self.assertContains(response, '揃っている材料: 2 / 足りない材料: 0')
+
+        response = self._suggest('キャベツ')
+        self.assertContains(response, '作れるレシピが見つかりませんでした。')
+
+    def test_suggest_falls_back_to_database(self):
+        """
+        Redisに接続できない場合はデータベースで同じ順位を求める
+        """
+        names = ['卵', '牛乳', '玉ネギ', '鶏肉']
+        expected = self.index.search(names)
+        self.assertEqual(
+            search_database(resolve_catalog_ids(names), limit=10), expected
+        )
+
+        with patch.object(
+            IngredientIndex, 'search_catalogs', side_effect=RedisError('down')
+        ), self.assertLogs('cook.views', 'WARNING'):
+            response = self._suggest('卵、牛乳、玉ネギ、鶏肉')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                (result['recipe'].id, result['match'], result['missing'])
+                for result in response.context['results']
+            ],
+            expected
+        )
+
+    def test_deleted_recipe_is_not_suggested(self):
+        """
+        削除を待っているレシピは、インデックスからもデータベースでの検索からもすぐに除く
+        """
+        with self.captureOnCommitCallbacks() as callbacks:
+            delete_recipe(self.omelet)
+        for callback in callbacks:
+            if getattr(callback, 'func', None) is not schedule_purge:
+                callback()
+
+        self.assertEqual(self.index.search(['卵'], limit=1), [
+            (self.oyakodon.id, 1, 3)
+        ])
+        self.assertEqual(search_database(resolve_catalog_ids(['卵']), limit=1), [
+            (self.oyakodon.id, 1, 3)
+        ])
+
+
+def create_test_image(name='test.png', size=(640, 480)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (255, 128, 0)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), 'image/png')
+
+
+class RecipeImageRenditionTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(
+            MEDIA_ROOT=self.media_root, IMAGE_RENDITION_BACKGROUND=False
+        )
+        self.override.enable()
+        recipe_cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root)
+
+    def _create_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                name='test recipe',
+                description='This is a test recipe',
+                image=create_test_image(),
+                user=self.user
+            )
+
+    def test_renditions_are_generated_on_save(self):
+        """
+        画像を登録するとすべてのサイズ・形式のレンディションが作成される
+        """
+        recipe = self._create_recipe()
+        recipe.refresh_from_db()
+
+        self.assertTrue(recipe.image_renditions_ready)
+        for name in rendition_names(recipe.image.name):
+            self.assertTrue(
+                os.path.exists(os.path.join(self.media_root, name))
+            )
+        self.assertEqual(
+            Image.open(os.path.join(
+                self.media_root, rendition_names(recipe.image.name)[0]
+            )).size,
+            (100, 100)
+        )
+
+    def test_renditions_are_reset_when_image_changes(self):
+        """
+        画像を変更したときだけレンディションを作り直す
+        """
+        recipe = self._create_recipe()
+        recipe.refresh_from_db()
+
+        recipe.name = 'updated'
+        recipe.save()
+        self.assertTrue(recipe.image_renditions_ready)
+
+        recipe.image = create_test_image('other.png')
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe.save()
+        self.assertFalse(recipe.image_renditions_ready)
+        self.assertEqual(len([
+            callback for callback in callbacks
+            if getattr(callback, 'func', None) is schedule_recipe_renditions
+        ]), 1)
+
+    def test_existing_renditions_are_not_replaced(self):
+        """
+        作成済みのレンディション(同じ画像を使う他のレシピと共有)は削除・上書きせず、足りないものだけ作成する
+        """
+        recipe = self._create_recipe()
+        recipe.refresh_from_db()
+        kept, removed = [
+            os.path.join(self.media_root, name)
+            for name in rendition_names(recipe.image.name)[:2]
+        ]
+        with open(kept, 'wb') as f:
+            f.write(b'shared')
+        os.remove(removed)
+
+        generate_renditions(recipe.image.name)
+
+        with open(kept, 'rb') as f:
+            self.assertEqual(f.read(), b'shared')
+        self.assertTrue(os.path.exists(removed))
+
+    def test_cache_failure_keeps_renditions_ready(self):
+        """
+        キャッシュの無効化に失敗しても警告だけを記録し、作成済みのフラグは立てる
+        """
+        with patch('cook.images.invalidate_recipes', side_effect=RedisError), \
+                self.assertLogs('cook.images', 'WARNING'):
+            recipe = self._create_recipe()
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.image_renditions_ready)
+
+    def test_background_failure_is_logged(self):
+        """
+        別のスレッドで実行したときの例外はFutureに残さず、ログに記録する
+        """
+        # テストの接続を閉じないようにする
+        with patch('django.db.close_old_connections'), \
+                patch('cook.images.generate_recipe_renditions',
+                      side_effect=ValueError('broken')), \
+                self.assertLogs('cook.images', 'ERROR') as logs:
+            _run_in_background(1)
+        self.assertIn('broken', logs.output[0])
+
+    def test_recipe_list_uses_srcset(self):
+        """
+        一覧ページでsrcsetとloading="lazy"が出力される
+        """
+        recipe = self._create_recipe()
+        recipe.refresh_from_db()
+
+        response = self.client.get(reverse('cook:recipe_list'))
+
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, recipe.get_image_url(200, 'webp'))
+        self.assertContains(response, recipe.get_image_url(800, 'jpeg'))
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(
+            MEDIA_ROOT=self.media_root, IMAGE_RENDITION_BACKGROUND=False,
+            IMAGE_GC_GRACE_SECONDS=0
+        )
+        self.override.enable()
+        recipe_cache.clear()
+        self.storage = ContentAddressedStorage(location=self.media_root)
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root)
+
+    def _create_recipe(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                name='test recipe',
+                description='This is a test recipe',
+                image=image,
+                user=self.user
+            )
+
+    def _refcounts(self):
+        return dict(ImageBlob.objects.values_list('name', 'refcount'))
+
+    def test_same_content_is_stored_once(self):
+        """
+        同じ内容のファイルは元のファイル名に関わらず同じ名前(ハッシュ)で1つだけ保存される
+        """
+        first = self.storage.save('images/a.PNG', create_test_image())
+        second = self.storage.save('images/b.png', create_test_image())
+        other = self.storage.save('images/c.png', create_test_image(size=(320, 240)))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertTrue(is_content_addressed(first))
+        self.assertTrue(first.startswith('images/') and first.endswith('.png'))
+        self.assertEqual(
+            sorted(
+                name for _, _, files in os.walk(self.media_root) for name in files
+            ),
+            sorted([os.path.basename(first), os.path.basename(other)])
+        )
+
+    def test_refcount_follows_recipe_images(self):
+        """
+        レシピの作成・画像の変更・削除で参照数が増減する
+        """
+        first = self._create_recipe(create_test_image())
+        second = self._create_recipe(create_test_image('copy.png'))
+        old_name = first.image.name
+        self.assertEqual(second.image.name, old_name)
+        self.assertEqual(self._refcounts(), {old_name: 2})
+
+        first.image = create_test_image(size=(320, 240))
+        first.save()
+        self.assertEqual(self._refcounts(), {old_name: 1, first.image.name: 1})
+
+        second.delete()
+        self.assertEqual(self._refcounts()[old_name], 0)
+
+    def test_gc_images_deletes_unreferenced_files(self):
+        """
+        gc_imagesは参照数が0のファイルとレンディションだけを削除する
+        """
+        kept = self._create_recipe(create_test_image())
+        removed = self._create_recipe(create_test_image(size=(320, 240)))
+        removed_name = removed.image.name
+        removed.delete()
+
+        call_command('gc_images', stdout=StringIO())
+
+        self.assertTrue(self.storage.exists(kept.image.name))
+        self.assertFalse(self.storage.exists(removed_name))
+        for name in rendition_names(removed_name):
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertEqual(self._refcounts(), {kept.image.name: 1})
+
+    def test_gc_images_recount(self):
+        """
+        --recountで参照数をレシピの数に合わせ、参照されているファイルは削除しない
+        """
+        recipe = self._create_recipe(create_test_image())
+        ImageBlob.objects.update(refcount=0)
+
+        self.assertEqual(collect_images(), (0, 0))
+        self.assertEqual(self._refcounts(), {recipe.image.name: 1})
+
+        ImageBlob.objects.update(refcount=5)
+        call_command('gc_images', '--recount', stdout=StringIO())
+        self.assertEqual(self._refcounts(), {recipe.image.name: 1})
+        self.assertTrue(self.storage.exists(recipe.image.name))
+
+
+class BackfillRenditionsCommandTestCase(TransactionTestCase):
+    def test_backfill_renditions(self):
+        """
+        既存の画像のレンディションを複数プロセスで作成する
+        """
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        with override_settings(MEDIA_ROOT=media_root):
+            # シグナルを通さずに画像だけを保存する(名前は内容からストレージが決める)
+            Recipe.objects.bulk_create([
+                Recipe(
+                    name=f'recipe {i}',
+                    description='description',
+                    image=Recipe.image.field.storage.save(
+                        Recipe.image.field.generate_filename(None, f'test{i}.png'),
+                        create_test_image(size=(640 + i, 480))
+                    ),
+                    user=user
+                )
+                for i in range(3)
+            ])
+
+            call_command(
+                'backfill_renditions', processes=2, stdout=StringIO()
+            )
+
+            for recipe in Recipe.objects.all():
+                self.assertTrue(recipe.image_renditions_ready)
+                for name in rendition_names(recipe.image.name):
+                    self.assertTrue(
+                        os.path.exists(os.path.join(media_root, name))
+                    )
+
+
+class ImportRecipesCommandTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def _jsonl(self, records):
+        return '\n'.join(
+            json.dumps(record, ensure_ascii=False) for record in records
+        ) + '\n'
+
+    def _import(self, path, **options):
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            'import_recipes', path, stdout=stdout, stderr=stderr, **options
+        )
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_jsonl(self):
+        """
+        JSONLからレシピと材料を登録し、不正なレコードはフォームと同じ規則でエラーにする
+        """
+        path = self._write('recipes.jsonl', self._jsonl([
+            {
+                'user': 'testuser', 'name': '茶碗蒸し', 'description': '蒸す',
+                'posted_at': '2024-01-02T03:04:05+09:00',
+                'ingredients': [
+                    {'name': '卵', 'amount': '2個'},
+                    {'name': 'だし', 'amount': '300ml'},
+                ],
+            },
+            {'user': 'testuser', 'name': 'x' * 51, 'description': 'long'},
+            {'user': 'nobody', 'name': '肉じゃが', 'description': '煮る'},
+            {'name': '親子丼', 'description': '煮る', 'ingredients': [
+                {'name': '', 'amount': '1個'},
+            ]},
+        ]))
+
+        _, stderr = self._import(path, batch_size=2, user='testuser')
+
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.name, '茶碗蒸し')
+        self.assertEqual(recipe.user, self.user)
+        self.assertEqual(recipe.posted_at.year, 2024)
+        self.assertEqual(
+            list(recipe.ingredients.order_by('id').values_list('name', flat=True)),
+            ['卵', 'だし']
+        )
+        # bulk_createで登録した材料にも辞書のidが設定される
+        self.assertFalse(recipe.ingredients.filter(catalog__isnull=True).exists())
+        # 検索用のカラムも登録時に設定される
+        self.assertEqual(
+            list(search_recipes(Recipe.objects.all(), 'だし')), [recipe]
+        )
+        errors = [json.loads(line) for line in stderr.splitlines()]
+        self.assertEqual(
+            sorted(error['position'] for error in errors), [2, 3, 4]
+        )
+
+    def test_import_reports_invalid_values(self):
+        """
+        存在しない日時・リストでない材料は例外にせず、そのレコードのエラーにする
+        """
+        path = self._write('recipes.jsonl', self._jsonl([
+            {'user': 'testuser', 'name': '茶碗蒸し', 'description': '蒸す',
+             'posted_at': '2024-13-45T00:00:00'},
+            {'user': 'testuser', 'name': '肉じゃが', 'description': '煮る',
+             'ingredients': 'じゃがいも'},
+            {'user': 'testuser', 'name': '親子丼', 'description': '煮る',
+             'ingredients': 3},
+            {'user': 'testuser', 'name': '味噌汁', 'description': '作る'},
+        ]))
+
+        _, stderr = self._import(path)
+
+        self.assertEqual(Recipe.objects.get().name, '味噌汁')
+        errors = [json.loads(line) for line in stderr.splitlines()]
+        self.assertEqual(
+            [(error['position'], sorted(error['errors'])) for error in errors],
+            [(1, ['posted_at']), (2, ['ingredients']), (3, ['ingredients'])]
+        )
+
+    def test_import_csv_groups_ingredient_rows(self):
+        """
+        CSVでは同じrecipe_idの連続する行を1つのレシピの材料として登録する
+        """
+        path = self._write('recipes.csv', (
+            'recipe_id,user,name,description,posted_at,ingredient_name,ingredient_amount\n'
+            '1,testuser,肉じゃが,"煮る\n味をしみこませる",,じゃがいも,3個\n'
+            '1,testuser,肉じゃが,"煮る\n味をしみこませる",,牛肉,200g\n'
+            '2,testuser,味噌汁,作る,,,\n'
+        ))
+
+        self._import(path)
+
+        nikujaga = Recipe.objects.get(name='肉じゃが')
+        self.assertEqual(nikujaga.description, '煮る\n味をしみこませる')
+        self.assertEqual(nikujaga.ingredients.count(), 2)
+        self.assertEqual(Recipe.objects.get(name='味噌汁').ingredients.count(), 0)
+
+    def test_import_resumes_after_failure(self):
+        """
+        中断した場合は同じジョブで再実行すると、保存済みのバッチの続きから取り込む
+        """
+        records = [
+            {'user': 'testuser', 'name': f'recipe {i}', 'description': 'd'}
+            for i in range(5)
+        ]
+        records[3]['name'] = ''
+        path = self._write('recipes.jsonl', self._jsonl(records))
+
+        with self.assertRaises(CommandError):
+            self._import(path, batch_size=2, max_errors=0)
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list('name', flat=True)),
+            ['recipe 0', 'recipe 1']
+        )
+
+        stdout, _ = self._import(path, batch_size=2)
+
+        self.assertIn('2件目まで取り込み済み', stdout)
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list('name', flat=True)),
+            ['recipe 0', 'recipe 1', 'recipe 2', 'recipe 4']
+        )
+        # 完了したジョブを再実行しても重複して登録しない
+        self._import(path, batch_size=2)
+        self.assertEqual(Recipe.objects.count(), 4)
+
+
+class RecipeExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.other = User.objects.create_user(
+            username='otheruser',
+            password='testpassword'
+        )
+        self.staff = User.objects.create_user(
+            username='staffuser',
+            password='testpassword',
+            is_staff=True
+        )
+        self.recipes = []
+        for i in range(5):
+            recipe = Recipe.objects.create(
+                name=f'recipe {i}',
+                description=f'説明, "{i}"\n2行目',
+                posted_at=timezone.make_aware(timezone.datetime(2024, 1, i + 1)),
+                user=self.user
+            )
+            for j in range(i % 3):
+                Ingredient.objects.create(
+                    name=f'材料{j}', amount=f'{j}個', recipe=recipe
+                )
+            self.recipes.append(recipe)
+        Recipe.objects.create(name='other', description='d', user=self.other)
+        self.url = reverse('cook:recipe_export')
+
+    def _content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_requires_staff(self):
+        """
+        スタッフ以外は書き出せない
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_export_jsonl_with_filters(self):
+        """
+        投稿ユーザーと投稿日の範囲で絞り込み、1行1レシピで材料も含めて返す
+        """
+        self.client.login(username='staffuser', password='testpassword')
+        response = self.client.get(self.url, {
+            'format': 'jsonl', 'user': 'testuser',
+            'since': '2024-01-02', 'until': '2024-01-05',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Type'], 'application/x-ndjson; charset=utf-8'
+        )
+        records = [json.loads(line) for line in self._content(response).splitlines()]
+        self.assertEqual(
+            [record['name'] for record in records],
+            ['recipe 1', 'recipe 2', 'recipe 3']
+        )
+        self.assertEqual(
+            records[1]['ingredients'],
+            [{'name': '材料0', 'amount': '0個'}, {'name': '材料1', 'amount': '1個'}]
+        )
+
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_queries_per_batch(self):
+        """
+        レシピ・材料をバッチごとに1回ずつ取得する(レシピの件数に比例しない)
+        """
+        self.client.login(username='staffuser', password='testpassword')
+        with patch.object(RecipeExportView, 'batch_size', 2):
+            response = self.client.get(self.url, {'user': 'testuser'})
+            # 3バッチ×(レシピ+材料) + 空のバッチの確認
+            with self.assertNumQueries(7):
+                content = self._content(response)
+        # ヘッダー + 材料の数(材料のないレシピは1行)
+        self.assertEqual(len(list(csv.reader(StringIO(content)))), 1 + 6)
+
+    async def test_export_streams_under_asgi(self):
+        """
+        ASGIでは非同期のイテレータを返し、バッチを取得するたびに送信する
+        (すべての行を作ってから送信しない)
+        """
+        await self.async_client.alogin(username='staffuser', password='testpassword')
+        with patch.object(RecipeExportView, 'batch_size', 2), \
+                patch('cook.export.fetch_batch', wraps=fetch_batch) as fetch:
+            response = await self.async_client.get(self.url, {'user': 'testuser'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+
+            chunks = aiter(response.streaming_content)
+            header = await anext(chunks)
+            self.assertEqual(header.decode().strip(), ','.join(CSV_COLUMNS))
+            self.assertEqual(fetch.call_count, 1)
+            content = header + b''.join([chunk async for chunk in chunks])
+        # 3バッチ + 空のバッチの確認
+        self.assertEqual(fetch.call_count, 4)
+        self.assertEqual(len(list(csv.reader(StringIO(content.decode())))), 1 + 6)
+
+    def test_export_command_round_trip(self):
+        """
+        書き出したCSVはimport_recipesでそのまま取り込める
+        """
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'recipes.csv')
+        call_command(
+            'export_recipes', user='testuser', output=path, batch_size=2,
+            stderr=StringIO()
+        )
+        expected = [
+            (recipe.name, recipe.description, recipe.posted_at,
+             list(recipe.ingredients.order_by('id').values_list('name', 'amount')))
+            for recipe in self.recipes
+        ]
+        Recipe.objects.all().delete()
+
+        call_command('import_recipes', path, stdout=StringIO())
+
+        self.assertEqual([
+            (recipe.name, recipe.description, recipe.posted_at,
+             list(recipe.ingredients.order_by('id').values_list('name', 'amount')))
+            for recipe in Recipe.objects.order_by('id')
+        ], expected)
+
+
+class RecipeApiTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.recipes = []
+        for i in range(5):
+            recipe = Recipe.objects.create(
+                name=f'recipe {i}', description=f'description {i}', user=self.user
+            )
+            Ingredient.objects.bulk_create([
+                Ingredient(name=f'材料{j}', amount=f'{j}個', recipe=recipe)
+                for j in range(3)
+            ])
+            self.recipes.append(recipe)
+        self.list_url = reverse('cook:api_recipe_list')
+
+    def test_list_cursor_pagination(self):
+        """
+        next / previousのURLをたどると全件を一度ずつ取得できる
+        """
+        ids = []
+        url = f'{self.list_url}?limit=2&fields=id'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            data = response.json()
+            ids += [recipe['id'] for recipe in data['results']]
+            previous, url = data['previous'], data['next']
+        self.assertEqual(ids, [recipe.id for recipe in self.recipes])
+
+        data = self.client.get(previous).json()
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']],
+            [recipe.id for recipe in self.recipes[2:4]]
+        )
+
+    def test_sparse_fieldsets(self):
+        """
+        指定したフィールドだけを返し、それ以外のカラムは読み込まない
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url, {'fields': 'id,name'})
+        self.assertEqual(
+            response.json()['results'][0],
+            {'id': self.recipes[0].id, 'name': 'recipe 0'}
+        )
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0]['sql'])
+
+        data = self.client.get(self.list_url).json()['results'][0]
+        self.assertEqual(data['user'], {'id': self.user.id, 'username': 'testuser'})
+        self.assertEqual(data['image_url'], '/media/images/default.jpg')
+        self.assertNotIn('ingredients', data)
+
+    def test_embed_ingredients_query_count(self):
+        """
+        材料を含めてもクエリはレシピ(投稿者をJOIN)と材料の2回で、件数に比例しない
+        """
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                self.list_url, {'embed': 'ingredients', 'limit': 100}
+            )
+        results = response.json()['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(
+            [ingredient['name'] for ingredient in results[0]['ingredients']],
+            ['材料0', '材料1', '材料2']
+        )
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('cook:api_recipe_detail', kwargs={
+                    'recipe_id': self.recipes[1].id
+                }),
+                {'embed': 'ingredients'}
+            )
+        self.assertEqual(response.json()['name'], 'recipe 1')
+        self.assertEqual(len(response.json()['ingredients']), 3)
+
+    def test_batch_fetch_by_ids(self):
+        """
+        ?idsで指定した順に返し、存在しないIDは含めない
+        """
+        ids = [self.recipes[3].id, 999999, self.recipes[0].id]
+        with self.assertNumQueries(2):
+            response = self.client.get(self.list_url, {
+                'ids': ','.join(map(str, ids)), 'embed': 'ingredients',
+            })
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            [self.recipes[3].id, self.recipes[0].id]
+        )
+
+    def test_invalid_parameters(self):
+        """
+        不正なパラメータにはJSONのエラーを返す
+        """
+        for params in (
+            {'fields': 'id,password'},
+            {'embed': 'user'},
+            {'after': 'invalid'},
+            {'limit': '1000'},
+            {'ids': '1,a'},
+        ):
+            response = self.client.get(self.list_url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+        response = self.client.get(
+            reverse('cook:api_recipe_detail', kwargs={'recipe_id': 999999})
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.json())
+
+    def test_full_page_query_count_and_shape(self):
+        """
+        100件を材料込みで返しても、クエリはレシピと材料の2回で、各レシピの形が揃っている
+        (レイテンシはloadtestのbrowse_apiシナリオで計測する)
+        """
+        Recipe.objects.bulk_create([
+            Recipe(name=f'bulk {i}', description='d', user=self.user)
+            for i in range(100)
+        ])
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                self.list_url, {'embed': 'ingredients', 'limit': 100}
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['results']), 100)
+        self.assertIsNotNone(data['next'])
+        keys = set(data['results'][0])
+        self.assertIn('ingredients', keys)
+        for recipe in data['results']:
+            self.assertEqual(set(recipe), keys)
+        self.assertEqual(
+            [len(recipe['ingredients']) for recipe in data['results'][:6]],
+            [3, 3, 3, 3, 3, 0]
+        )
+
+
+class SeedPerfCommandTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _seed(self, **options):
+        call_command(
+            'seed_perf', users=3, recipes=25, ingredients=4, batch_size=10,
+            stdout=StringIO(), **options
+        )
+        return [
+            (
+                recipe.user.username, recipe.name, recipe.description,
+                recipe.posted_at, recipe.image.name or None,
+                list(recipe.ingredients.order_by('id').values_list('name', 'amount'))
+            )
+            for recipe in Recipe.objects.select_related('user').order_by('id')
+        ]
+
+    def test_seed_is_deterministic(self):
+        """
+        同じseedからは同じデータを生成し、--clearで前回のデータを置き換える
+        """
+        first = self._seed(seed=1)
+
+        self.assertEqual(len(first), 25)
+        self.assertEqual(
+            User.objects.filter(username__startswith='perf').count(), 3
+        )
+        self.assertEqual(Ingredient.objects.count(), 25 * 4)
+        self.assertFalse(Ingredient.objects.filter(catalog__isnull=True).exists())
+        name, description = first[0][1], first[0][2]
+        self.assertTrue(name)
+        self.assertIn('\n', description)
+        # 改行などを含む値もCOPYで崩れずに登録される
+        self.assertTrue(description.startswith('1. '))
+
+        with self.assertRaises(CommandError):
+            self._seed(seed=1)
+        self.assertEqual(self._seed(seed=1, clear=True), first)
+        self.assertEqual(Recipe.objects.count(), 25)
+        self.assertNotEqual(self._seed(seed=2, clear=True), first)
+
+
+class LoadTestCommandTestCase(LiveServerTestCase):
+    def setUp(self):
+        user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        for i in range(3):
+            Recipe.objects.create(name=f'recipe {i}', description='d', user=user)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _run(self, weights):
+        output = os.path.join(self.tmpdir, 'result.json')
+        call_command(
+            'loadtest', url=self.live_server_url, concurrency=2, duration=2,
+            warmup=0, weights=weights, output=output, stdout=StringIO()
+        )
+        with open(output, encoding='utf-8') as f:
+            result = json.load(f)
+        self.assertEqual(result['failures'], {})
+        self.assertEqual(result['total']['errors'], 0)
+        self.assertEqual(result['config']['weights'], weights)
+        for endpoint in result['endpoints'].values():
+            for key in ('requests', 'rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                self.assertIn(key, endpoint)
+        return result
+
+    def test_browse_scenarios(self):
+        """
+        エンドポイントごとのパーセンタイルとRPSをJSONに書き出す
+        """
+        result = self._run('browse_list=1,open_detail=1,browse_api=1')
+        self.assertEqual(
+            set(result['endpoints']),
+            {'recipe_list', 'recipe_detail', 'api_recipe_list'}
+        )
+        self.assertGreater(result['endpoints']['recipe_list']['requests'], 0)
+
+    def test_create_recipe_scenario(self):
+        """
+        ログインしてレシピを登録し、材料のフォームの追加・削除を経て材料を登録する
+        """
+        result = self._run('create_recipe=1')
+        self.assertIn('account_login:post', result['endpoints'])
+        self.assertGreater(
+            result['endpoints']['ingredient_new:submit']['requests'], 0
+        )
+        created = Recipe.objects.filter(user__username__startswith='loadtest')
+        self.assertEqual(
+            set(created.annotate(count=Count('ingredients')).values_list('count', flat=True)),
+            {3}
+        )
+
+    def test_publish_recipe_scenario(self):
+        """
+        レシピと材料を1回の送信で登録する
+        """
+        result = self._run('publish_recipe=1')
+        self.assertEqual(
+            set(result['endpoints']) - {'account_login', 'account_login:post'},
+            {'recipe_publish', 'recipe_publish:post'}
+        )
+        created = Recipe.objects.filter(user__username__startswith='loadtest')
+        self.assertTrue(created.exists())
+        self.assertEqual(
+            set(created.annotate(count=Count('ingredients')).values_list('count', flat=True)),
+            {3}
+        )
+
+
+@override_settings(
+    QUERY_BUDGET_STRICT=True, SERVER_TIMING='all', QUERY_STATS_DUPLICATES=True
+)
+class QueryBudgetTestCase(TestCase):
+    """
+    cook/urls.py・user/urls.pyの全てのビューがsettings.QUERY_BUDGETSのクエリ数に収まる
+    (QueryCountMiddlewareが上限を超えた場合にQueryBudgetExceededを送出する)
+    """
+
+    def setUp(self):
+        recipe_cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.staff = User.objects.create_user(
+            username='staffuser',
+            password='testpassword',
+            is_staff=True
+        )
+        self.leaver = User.objects.create_user(
+            username='leaver',
+            password='testpassword'
+        )
+        # 一覧・詳細は件数によってクエリ数が変わらないことも確認するため複数作る
+        self.recipes = []
+        for i in range(6):
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe = Recipe.objects.create(
+                    name=f'肉じゃが{i}', description='煮る', user=self.user
+                )
+                for name in ('じゃがいも', '牛肉', '玉ねぎ'):
+                    Ingredient.objects.create(
+                        name=name, amount='1個', recipe=recipe
+                    )
+            self.recipes.append(recipe)
+        self.recipe = self.recipes[0]
+        self.ingredient = self.recipe.ingredients.first()
+
+    def get_requests(self):
+        """
+        (URL名, ログインするユーザ, メソッド, URL, POSTのデータ)
+        """
+        recipe_id = self.recipe.id
+        ingredient_id = self.ingredient.id
+        user_id = self.user.id
+        ingredients = {
+            'ingredients-TOTAL_FORMS': 3,
+            'ingredients-INITIAL_FORMS': 0,
+            'ingredients-MIN_NUM_FORMS': 0,
+            'ingredients-MAX_NUM_FORMS': 10,
+            **{f'ingredients-{i}-name': f'材料{i}' for i in range(3)},
+            **{f'ingredients-{i}-amount': '1個' for i in range(3)},
+        }
+        bulk_edit = bulk_edit_data(
+            self.recipe.ingredients.order_by('id'),
+            update=1, create=1, delete=1
+        )
+
+        def url(name, *args, query=''):
+            return reverse(name, args=args) + query
+
+        return [
+            ('cook:recipe_list', None, 'get', url('cook:recipe_list'), None),
+            ('cook:recipe_list', None, 'get',
+             url('cook:recipe_list', query='?page=2'), None),
+            ('cook:recipe_search', None, 'get',
+             url('cook:recipe_search', query='?q=肉じゃが'), None),
+            ('cook:recipe_suggest', None, 'get',
+             url('cook:recipe_suggest', query='?ingredients=じゃがいも,牛肉'),
+             None),
+            ('cook:recipe_detail', None, 'get',
+             url('cook:recipe_detail', recipe_id), None),
+            ('cook:recipe_detail', self.user, 'get',
+             url('cook:recipe_detail', recipe_id), None),
+            ('cook:recipe_new', self.user, 'get',
+             url('cook:recipe_new'), None),
+            ('cook:recipe_new', self.user, 'post', url('cook:recipe_new'),
+             {'name': '親子丼', 'description': '煮る'}),
+            ('cook:recipe_publish', self.user, 'get',
+             url('cook:recipe_publish'), None),
+            ('cook:recipe_publish', self.user, 'post',
+             url('cook:recipe_publish'),
+             {'name': '親子丼', 'description': '煮る', **ingredients}),
+            ('cook:recipe_edit', self.user, 'get',
+             url('cook:recipe_edit', recipe_id), None),
+            ('cook:recipe_edit', self.user, 'post',
+             url('cook:recipe_edit', recipe_id),
+             {'name': '肉じゃが', 'description': 'よく煮る'}),
+            ('cook:recipe_export', self.staff, 'get',
+             url('cook:recipe_export'), None),
+            ('cook:ingredient_new', self.user, 'get',
+             url('cook:ingredient_new', recipe_id), None),
+            ('cook:ingredient_new', self.user, 'post',
+             url('cook:ingredient_new', recipe_id), ingredients),
+            ('cook:ingredient_bulk_edit', self.user, 'get',
+             url('cook:ingredient_bulk_edit', recipe_id), None),
+            ('cook:ingredient_bulk_edit', self.user, 'post',
+             url('cook:ingredient_bulk_edit', recipe_id), bulk_edit),
+            ('cook:ingredient_edit', self.user, 'get',
+             url('cook:ingredient_edit', ingredient_id), None),
+            ('cook:ingredient_edit', self.user, 'post',
+             url('cook:ingredient_edit', ingredient_id),
+             {'name': 'じゃがいも', 'amount': '3個'}),
+            ('cook:ingredient_destroy', self.user, 'post',
+             url('cook:ingredient_destroy', ingredient_id), {}),
+            ('cook:api_recipe_list', None, 'get',
+             url('cook:api_recipe_list', query='?embed=ingredients'), None),
+            ('cook:api_recipe_list', None, 'get',
+             url('cook:api_recipe_list', query=f'?ids={recipe_id}'), None),
+            ('cook:api_recipe_detail', None, 'get',
+             url('cook:api_recipe_detail', recipe_id), None),
+            ('cook:recipe_destroy', self.user, 'post',
+             url('cook:recipe_destroy', recipe_id), {}),
+            ('user:user_list', None, 'get', url('user:user_list'), None),
+            ('user:user_detail', None, 'get',
+             url('user:user_detail', user_id), None),
+            ('user:user_update', self.user, 'get',
+             url('user:user_update', user_id), None),
+            ('user:user_update', self.user, 'post',
+             url('user:user_update', user_id),
+             {'username': 'testuser', 'email': 'test@example.com'}),
+            ('user:user_delete', self.leaver, 'post',
+             url('user:user_delete', self.leaver.id), {}),
+        ]
+
+    def test_every_view_has_budget(self):
+        from cook.urls import urlpatterns as cook_urlpatterns
+        from user.urls import urlpatterns as user_urlpatterns
+
+        names = {f'cook:{pattern.name}' for pattern in cook_urlpatterns}
+        names |= {f'user:{pattern.name}' for pattern in user_urlpatterns}
+        self.assertEqual(names - set(settings.QUERY_BUDGETS), set())
+        self.assertEqual(
+            names - {row[0] for row in self.get_requests()}, set()
+        )
+
+    def test_views_within_query_budgets(self):
+        for name, user, method, url, data in self.get_requests():
+            # ログインが不要なページはログインした状態でも確認する
+            # (セッションとユーザのクエリが増える)
+            for login_user in ([None, self.user] if user is None else [user]):
+                with self.subTest(
+                    name=name, method=method, url=url, user=login_user
+                ):
+                    if login_user is None:
+                        self.client.logout()
+                    else:
+                        self.client.force_login(login_user)
+                    with self.captureOnCommitCallbacks(execute=True):
+                        response = getattr(self.client, method)(url, data)
+                    self.assertLess(response.status_code, 400)
+                    self.assertIn('db;dur=', response['Server-Timing'])
+
+    def test_budget_exceeded_fails_loudly(self):
+        with override_settings(QUERY_BUDGETS={'cook:recipe_detail': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(
+                    reverse('cook:recipe_detail', args=[self.recipe.id])
+                )
+
+        with override_settings(
+            QUERY_BUDGETS={'cook:recipe_detail': 1}, QUERY_BUDGET_STRICT=False
+        ):
+            with self.assertLogs('cook.queries', 'INFO') as logs:
+                response = self.client.get(
+                    reverse('cook:recipe_detail', args=[self.recipe.id])
+                )
+        self.assertEqual(response.status_code, 200)
+        info, warning = logs.records
+        self.assertEqual(info.url_name, 'cook:recipe_detail')
+        self.assertEqual(info.status, 200)
+        self.assertGreater(info.queries, 1)
+        self.assertEqual(info.duplicate_queries, 0)
+        self.assertEqual(warning.levelname, 'WARNING')
+
+    def test_server_timing_audience(self):
+        """
+        SERVER_TIMING='off'ではヘッダーを返さず、'staff'ではスタッフにだけ返す
+        QUERY_STATS_DUPLICATESがFalseの場合は重複を数えない
+        """
+        url = reverse('cook:recipe_detail', args=[self.recipe.id])
+        with override_settings(SERVER_TIMING='off'):
+            self.assertFalse(self.client.get(url).has_header('Server-Timing'))
+
+        with override_settings(
+            SERVER_TIMING='staff', QUERY_STATS_DUPLICATES=False
+        ):
+            self.assertFalse(self.client.get(url).has_header('Server-Timing'))
+            self.client.force_login(self.user)
+            self.assertFalse(self.client.get(url).has_header('Server-Timing'))
+            self.client.force_login(self.staff)
+            with self.assertLogs('cook.queries', 'INFO') as logs:
+                response = self.client.get(url)
+        self.assertRegex(
+            response['Server-Timing'], r'^db;dur=[0-9.]+;desc="\d+ queries"$'
+        )
+        self.assertIsNone(logs.records[0].duplicate_queries)
+
+    def test_duplicate_queries_are_reported(self):
+        """
+        同じクエリを繰り返すビュー(N+1)は重複の数として記録される
+        """
+        stats = QueryStats()
+        with connection.execute_wrapper(stats):
+            for recipe in Recipe.objects.all():
+                recipe.user.username
+        self.assertEqual(stats.count, 1 + 6)
+        self.assertEqual(stats.duplicates, 5)
+
+
+@override_settings(METRICS_KEY_PREFIX='test_cook_metrics', METRICS_TOKEN='secret')
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        recipe_cache.clear()
+        self.client_redis = RedisHandler().redis_client
+        self.clear_metrics()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.staff = User.objects.create_user(
+            username='staffuser',
+            password='testpassword',
+            is_staff=True
+        )
+        self.recipe = Recipe.objects.create(
+            name='Test Recipe',
+            description='This is a test recipe description.',
+            user=self.user
+        )
+
+    def tearDown(self):
+        self.clear_metrics()
+
+    def clear_metrics(self):
+        # 前のリクエストが始めた送信を待つ(ワーカーは1つのため、空の処理が終われば終わっている)
+        metrics._get_executor().submit(lambda: None).result()
+        metrics.registry.flush(self.client_redis)
+        keys = list(self.client_redis.scan_iter('test_cook_metrics:*'))
+        if keys:
+            self.client_redis.delete(*keys)
+
+    def get_metrics(self):
+        response = self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_metrics_requires_staff_or_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(
+            self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong'
+            ).status_code,
+            403
+        )
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_request_metrics(self):
+        """
+        URL名ごとのリクエスト数・処理時間のヒストグラム・クエリ数と、キャッシュのヒット率を出力する
+        """
+        page_stats = recipe_cache.get_stats()['page']
+        for _ in range(3):
+            self.client.get(reverse('cook:recipe_list'))
+        self.client.get('/cook/not-found/')
+        body = self.get_metrics()
+
+        self.assertIn('# TYPE cook_http_request_duration_seconds histogram', body)
+        self.assertIn(
+            'cook_http_requests_total{view="cook:recipe_list",method="GET",status="200"} 3',
+            body
+        )
+        self.assertIn(
+            'cook_http_request_duration_seconds_bucket'
+            '{view="cook:recipe_list",le="+Inf"} 3', body
+        )
+        self.assertIn(
+            'cook_http_request_duration_seconds_count{view="cook:recipe_list"} 3',
+            body
+        )
+        self.assertIn(
+            'cook_http_requests_total{view="unresolved",method="GET",status="404"} 1',
+            body
+        )
+        self.assertIn('cook_db_queries_total{view="cook:recipe_list"}', body)
+        # 1回目はミス、2・3回目は一覧のキャッシュにヒットする(ヒット数は全てのテストの累計)
+        hits, misses = page_stats['hit'] + 2, page_stats['miss'] + 1
+        self.assertIn(f'cook_cache_hits_total{{kind="page"}} {hits}', body)
+        self.assertIn(f'cook_cache_misses_total{{kind="page"}} {misses}', body)
+        self.assertIn(
+            f'cook_cache_hit_ratio{{kind="page"}} {hits / (hits + misses)!r}', body
+        )
+        # 取得しているこのリクエストが処理中
+        self.assertIn('cook_http_requests_in_flight 1', body)
+
+        # バケットはleの小さい順で累積になっている
+        buckets = [
+            line for line in body.splitlines()
+            if line.startswith(
+                'cook_http_request_duration_seconds_bucket{view="cook:recipe_list"'
+            )
+        ]
+        self.assertEqual(len(buckets), len(metrics.LATENCY_BUCKETS) + 1)
+        counts = [float(line.rsplit(' ', 1)[1]) for line in buckets]
+        self.assertEqual(counts, sorted(counts))
+
+    def test_metrics_are_aggregated_across_workers(self):
+        """
+        ワーカー(Registry)ごとの集計がRedisで合計される
+        """
+        workers = [metrics.Registry() for _ in range(2)]
+        for i, worker in enumerate(workers):
+            worker.process_key = f'worker{i}'
+            worker.inc('cook_http_requests_total', (
+                ('view', 'cook:recipe_detail'), ('method', 'GET'), ('status', 200),
+            ), 2)
+            worker.observe(
+                'cook_http_request_duration_seconds',
+                (('view', 'cook:recipe_detail'),), 0.02
+            )
+            worker.add_in_flight(3)
+            worker.flush(self.client_redis)
+        body = self.get_metrics()
+
+        self.assertIn(
+            'cook_http_requests_total{view="cook:recipe_detail",method="GET",status="200"} 4',
+            body
+        )
+        self.assertIn(
+            'cook_http_request_duration_seconds_bucket'
+            '{view="cook:recipe_detail",le="0.01"} 0', body
+        )
+        self.assertIn(
+            'cook_http_request_duration_seconds_bucket'
+            '{view="cook:recipe_detail",le="0.025"} 2', body
+        )
+        self.assertIn(
+            'cook_http_request_duration_seconds_sum{view="cook:recipe_detail"} 0.04',
+            body
+        )
+        # 2つのワーカーの3件ずつと、取得しているこのリクエスト
+        self.assertIn('cook_http_requests_in_flight 7', body)
+
+    def test_redis_handler_latency(self):
+        handler = RedisHandler()
+        handler.set_key_and_value('test_metrics_key', 1, ex=60)
+        handler.get_value_from_key('test_metrics_key')
+        body = self.get_metrics()
+
+        self.assertIn(
+            'cook_redis_command_duration_seconds_count{operation="get"}', body
+        )
+        self.assertIn(
+            'cook_redis_command_duration_seconds_count{operation="set"}', body
+        )
+
+    def test_ingredient_index_latency(self):
+        index = IngredientIndex()
+        index.index_recipes({self.recipe.id: [1]})
+        index.search_catalogs([1])
+        body = self.get_metrics()
+
+        self.assertIn(
+            'cook_redis_command_duration_seconds_count'
+            '{operation="ingredient_index"} 1', body
+        )
+        self.assertIn(
+            'cook_redis_command_duration_seconds_count'
+            '{operation="ingredient_search"} 1', body
+        )
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0)
+    def test_flush_runs_outside_request(self):
+        """
+        Redisへの送信はリクエストの処理とは別のスレッドで行い、送信中は重ねて送らない
+        """
+        with patch.object(metrics, '_get_executor') as get_executor:
+            self.client.get(reverse('cook:recipe_list'))
+            self.client.get(reverse('cook:recipe_list'))
+        get_executor.return_value.submit.assert_called_once_with(
+            metrics.registry._flush_in_background
+        )
+        self.assertTrue(metrics.registry.flushing)
+
+        metrics.registry._flush_in_background()
+        self.assertFalse(metrics.registry.flushing)
+        self.assertIn(
+            'cook_http_requests_total'
+            '{view="cook:recipe_list",method="GET",status="200"} 2',
+            self.get_metrics()
+        )
+
+    def test_flush_failure_is_logged(self):
+        registry = metrics.Registry()
+        registry.inc('cook_http_requests_total')
+        with patch.object(
+            self.client_redis, 'pipeline',
+            side_effect=ConnectionInterrupted(connection=None)
+        ), self.assertLogs('cook.metrics', 'WARNING'):
+            registry.flush(self.client_redis)
+
+        registry.flushing = True
+        with patch.object(
+            registry, 'flush', side_effect=ValueError('broken')
+        ), self.assertLogs('cook.metrics', 'ERROR'):
+            registry._flush_in_background()
+        self.assertFalse(registry.flushing)
+
+    def test_metrics_unavailable_without_redis(self):
+        with patch.object(
+            metrics, 'collect', side_effect=metrics.RedisError('down')
+        ), self.assertLogs('cook.metrics', 'WARNING'):
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret'
+            )
+        self.assertEqual(response.status_code, 503)
+
+
+class IndexUsageTestCase(TestCase):
+    """
+    ビュー・管理画面が発行するクエリのEXPLAINで、0009のインデックスが使われることを確認する
+    (テストのデータは少なく全件走査の方が安くなるため、enable_seqscanを無効にして比較する)
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.admin = User.objects.create_superuser(
+            username='admin',
+            password='testpassword'
+        )
+        for i in range(10):
+            recipe = Recipe.objects.create(
+                name=f'recipe {i}', description='d', user=self.user
+            )
+            Ingredient.objects.create(name=f'じゃがいも{i}', amount='1個', recipe=recipe)
+
+    def assert_index_used(self, url, table, index_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        plans = []
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for query in queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or f'FROM "{table}"' not in sql \
+                        or 'COUNT(' in sql:
+                    continue
+                cursor.execute('EXPLAIN ' + sql)
+                plans.append('\n'.join(row[0] for row in cursor.fetchall()))
+        self.assertTrue(plans, f'{table}へのクエリがありません')
+        self.assertTrue(
+            any(index_name in plan for plan in plans), '\n\n'.join(plans)
+        )
+
+    def test_admin_recipe_posted_at_filter(self):
+        self.client.login(username='admin', password='testpassword')
+        self.assert_index_used(
+            reverse('admin:cook_recipe_changelist') + '?' + urlencode({
+                'posted_at__gte': '2024-01-01 00:00:00+09:00',
+                'posted_at__lt': '2099-01-01 00:00:00+09:00',
+            }),
+            'cook_recipe', 'recipe_posted_at_idx'
+        )
+
+    def test_admin_recipe_user_filter(self):
+        self.client.login(username='admin', password='testpassword')
+        self.assert_index_used(
+            reverse('admin:cook_recipe_changelist') + f'?user__id__exact={self.user.id}',
+            'cook_recipe', 'recipe_user_posted_at_idx'
+        )
+
+    def test_user_detail_recipes(self):
+        self.assert_index_used(
+            reverse('user:user_detail', kwargs={'pk': self.user.id}),
+            'cook_recipe', 'recipe_user_posted_at_idx'
+        )
+
+    def test_admin_ingredient_search(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest('pg_trgmがないため、ingredient_name_trgm_idxは作成されない')
+        self.client.login(username='admin', password='testpassword')
+        self.assert_index_used(
+            reverse('admin:cook_ingredient_changelist') + '?q=じゃが',
+            'cook_ingredient', 'ingredient_name_trgm_idx'
+        )
+
+    def test_admin_ingredient_search_matches_substrings(self):
+        """
+        管理画面の材料の検索は部分一致(ねぎで玉ねぎ・長ねぎが見つかる)
+        """
+        recipe = Recipe.objects.first()
+        for name in ['玉ねぎ', '長ねぎ', 'ﾈｷﾞ塩', 'にんじん']:
+            Ingredient.objects.create(name=name, amount='1本', recipe=recipe)
+        self.client.login(username='admin', password='testpassword')
+        url = reverse('admin:cook_ingredient_changelist')
+
+        response = self.client.get(url, {'q': 'ねぎ'})
+        self.assertEqual(
+            sorted(str(obj) for obj in response.context['cl'].result_list),
+            ['玉ねぎ', '長ねぎ']
+        )
+        response = self.client.get(url, {'q': 'がいも 3'})
+        self.assertEqual(
+            [str(obj) for obj in response.context['cl'].result_list], ['じゃがいも3']
+        )
+
+
+def create_async_request(path, user=None, headers=None):
+    """
+    AuthenticationMiddlewareの代わりにrequest.user / request.auserを設定する
+    """
+    request = AsyncRequestFactory().get(path, headers=headers)
+    request.user = user or AnonymousUser()
+
+    async def auser():
+        return request.user
+    request.auser = auser
+    return request
+
+
+class AsyncRecipeViewTestCase(TestCase):
+    def setUp(self):
+        recipe_cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.recipes = [
             Recipe.objects.create(
                 name=f'Recipe {i+1}',
                 description=f'Description {i+1}',
                 user=self.user
             )
+            for i in range(8)
+        ]
+        Ingredient.objects.create(
+            name='卵', amount='1個', recipe=self.recipes[0]
+        )
 
-        # 1ページ目の確認
-        response = self.client.get(self.list_link)
+    async def test_recipe_list(self):
+        """
+        非同期版の一覧ページも同期版と同じページネーションで表示する
+        """
+        view = AsyncRecipeListView.as_view()
+        for _ in range(2):  # 2回目はキャッシュから表示する
+            response = await view(create_async_request('/?page=2'))
+            response.render()
+
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'Recipe 6')
+            self.assertNotContains(response, 'Recipe 5<')
+            self.assertContains(response, 'href="?page=1"')
+
+    async def test_recipe_list_without_redis(self):
+        """
+        Redisに接続できない場合もキャッシュを使わずに一覧を表示する
+        """
+        with self.settings(CACHES=UNREACHABLE_CACHES), \
+                self.assertLogs('cook.cache', 'WARNING'):
+            response = await AsyncRecipeListView.as_view()(
+                create_async_request('/?page=2')
+            )
+            response.render()
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.context['recipes'].count(), 5)
-        # 次のページが存在しているか
-        self.assertContains(response, 'href="?page=2"')
+        self.assertContains(response, 'Recipe 6')
 
-        # 2ページ目の確認
-        response = self.client.get(self.list_link + '?page=2')
+    @override_settings(RECIPE_LIST_PAGINATION='cursor')
+    async def test_recipe_list_cursor(self):
+        view = AsyncRecipeListView.as_view()
+        response = await view(create_async_request('/'))
+        next_cursor = response.context_data['page_obj'].next_cursor
+
+        response = await view(create_async_request(f'/?after={next_cursor}'))
+        response.render()
+
+        self.assertContains(response, 'Recipe 8')
+        self.assertNotContains(response, 'href="?after=')
+
+    async def test_recipe_detail(self):
+        """
+        非同期版の詳細ページも条件付きGETに対応する
+        """
+        view = AsyncRecipeDetailView.as_view()
+        recipe = self.recipes[0]
 
+        request = create_async_request('/', user=self.user)
+        # CsrfViewMiddlewareがCookieから設定する値
+        request.META['CSRF_COOKIE'] = 'a' * 32
+        response = await view(request, recipe_id=recipe.id)
+        response.render()
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.context['recipes'].count(), 3)
-        # 次のページへのリンクがないことを確認
-        self.assertNotContains(response, 'href="?page=3"')
+        self.assertContains(response, '材料名: 卵')
+        self.assertTrue(response.context_data['is_author'])
+
+        request = create_async_request(
+            '/', user=self.user, headers={'If-None-Match': response['ETag']}
+        )
+        request.META['CSRF_COOKIE'] = 'a' * 32
+        response = await view(request, recipe_id=recipe.id)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('private', response['Cache-Control'])
+
+    async def test_recipe_detail_not_found(self):
+        view = AsyncRecipeDetailView.as_view()
+        with self.assertRaises(Http404):
+            await view(create_async_request('/'), recipe_id=0)
 
 
 class ResipeDetailViewTestCase(TestCase):
@@ -440,6 +2556,75 @@ class ResipeDetailViewTestCase(TestCase):
         response = self.client.get(self._get_description_url(self.recipe.id))
         self._assert_ingredient(response, False)
 
+    def test_recipe_detail_query_count_is_constant(self):
+        """
+        材料の数によらずクエリ数が一定である
+        (ログインユーザ + ETag用の更新日時 + レシピと投稿者 + 材料。セッションはRedisから読む)
+        """
+        self._login_user(self.user, self.user_password)
+        for ingredient_num in [1, 200]:
+            with self.subTest(ingredient_num=ingredient_num):
+                self.recipe.ingredients.all().delete()
+                Ingredient.objects.bulk_create([
+                    Ingredient(
+                        name=f'ingredient{i}',
+                        amount=f'{i}g',
+                        recipe=self.recipe
+                    )
+                    for i in range(ingredient_num)
+                ])
+                with self.assertNumQueries(4):
+                    response = self.client.get(
+                        self._get_description_url(self.recipe.id)
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(
+                    response, 'class="btn btn-primary">編集</a>',
+                    ingredient_num
+                )
+
+    def test_recipe_detail_conditional_get(self):
+        """
+        ETag / Last-Modifiedが一致した場合はテンプレートを描画せずに304を返す
+        """
+        url = self._get_description_url(self.recipe.id)
+        response = self.client.get(url)
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        # ブラウザには毎回再検証させ、nginxには短時間だけ保存させる
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertIn('s-maxage=', response['Cache-Control'])
+
+        # 検証用の更新日時の取得のみ
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertTemplateNotUsed(response, self.template_name)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_recipe_detail_etag_changes(self):
+        """
+        材料の変更・ログインユーザの変更でETagが変わる
+        """
+        url = self._get_description_url(self.recipe.id)
+        etag = self.client.get(url)['ETag']
+
+        Ingredient.objects.create(
+            name='ingredient', amount='1g', recipe=self.recipe
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'ingredient')
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self._login_user(self.user, self.user_password)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_author'])
+
 
 class RecipeCreateViewTestCase(TestCase):
     template_name = 'recipe/new.html'
@@ -534,6 +2719,109 @@ class RecipeCreateViewTestCase(TestCase):
         self.assertContains(response, 'このフィールドは必須です。')
 
 
+class RecipePublishViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.url = reverse('cook:recipe_publish')
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def get_data(self, total=3, fill=3, **extra):
+        data = {
+            'name': '肉じゃが',
+            'description': '材料を煮る。',
+            'ingredients-TOTAL_FORMS': total,
+            'ingredients-INITIAL_FORMS': 0,
+            'ingredients-MIN_NUM_FORMS': 0,
+            'ingredients-MAX_NUM_FORMS': 10,
+            'submit': '',
+            **extra,
+        }
+        for i in range(fill):
+            data[f'ingredients-{i}-name'] = f'材料{i}'
+            data[f'ingredients-{i}-amount'] = f'{i + 1}個'
+        return data
+
+    def test_login_required(self):
+        response = self.client.get(self.url)
+        self.assertRedirects(
+            response, f'{settings.LOGIN_URL}?next={self.url}',
+            fetch_redirect_response=False
+        )
+
+    def test_publish_recipe_with_image_and_ingredients(self):
+        """
+        レシピ・画像・材料を1回の送信で登録し、材料は1回のINSERTで登録する
+        """
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(buffer, 'JPEG')
+        image = SimpleUploadedFile(
+            'dish.jpg', buffer.getvalue(), content_type='image/jpeg'
+        )
+        self.client.force_login(self.user)
+
+        with self.settings(MEDIA_ROOT=self.media_root), \
+                CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks():
+            response = self.client.post(
+                self.url, self.get_data(total=5, fill=5, image=image)
+            )
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertRedirects(
+            response, reverse('cook:recipe_detail', args=[recipe.id]),
+            fetch_redirect_response=False
+        )
+        self.assertTrue(recipe.image.name.endswith('.jpg'))
+        self.assertEqual(
+            list(recipe.ingredients.order_by('id').values_list('name', 'amount')),
+            [(f'材料{i}', f'{i + 1}個') for i in range(5)]
+        )
+        self.assertEqual(
+            len([q for q in queries if q['sql'].startswith('INSERT INTO "cook_ingredient"')]),
+            1
+        )
+        self.assertFalse(recipe.ingredients.filter(catalog__isnull=True).exists())
+        self.assertIn(recipe, search_recipes(Recipe.objects.all(), '材料4'))
+
+    def test_invalid_ingredients_save_nothing(self):
+        """
+        材料のフォームの数が範囲外の場合はレシピも登録しない
+        """
+        self.client.force_login(self.user)
+        response = self.client.post(
+            self.url, self.get_data(total=IngredientForm.max_form_num + 1)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['formset'].non_form_errors())
+        self.assertFalse(Recipe.objects.exists())
+
+        response = self.client.post(self.url, self.get_data(name=''))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_failed_ingredient_insert_rolls_back_recipe(self):
+        self.client.force_login(self.user)
+        with patch.object(
+            Ingredient.objects, 'bulk_create', side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            self.client.post(self.url, self.get_data())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_resize_without_javascript(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            self.url, self.get_data(fill=1, add_form='')
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['formset'].total_form_count(), 4)
+        self.assertContains(response, 'value="肉じゃが"')
+        self.assertFalse(Recipe.objects.exists())
+
+
 class RecipeUpdateViewTestCase(TestCase):
     template_name = 'recipe/edit.html'
     update_data = {
@@ -730,11 +3018,15 @@ class RecipeDeleteViewTestCase(TestCase):
         HTTPメソッドがPOST
         """
         self._login_user()
-        response = self.client.post(self._get_destroy_link(self.recipe.id))
+        # 材料はコミット後の削除の処理(cook.deletion)で削除される
+        with self.settings(DELETION_BACKGROUND=False), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self._get_destroy_link(self.recipe.id))
 
         self.assertRedirects(response, reverse('cook:recipe_list'))
 
         self.assertFalse(Recipe.objects.filter(id=self.recipe.id).exists())
+        self.assertFalse(Recipe.all_objects.filter(id=self.recipe.id).exists())
         # models.CASCADEのチェック
         self.assertFalse(
             Ingredient.objects.filter(recipe=self.recipe).exists()
@@ -777,6 +3069,167 @@ class RecipeDeleteViewTestCase(TestCase):
         self.assertTrue(Recipe.objects.filter(id=self.recipe.id).exists())
 
 
+class RecipeDeletionTestCase(TestCase):
+    """
+    削除したレシピ・ユーザはすぐに見えなくし、関連する行・画像はバッチごとに削除する
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.other = User.objects.create_user(
+            username='otheruser',
+            password='testpassword'
+        )
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def create_recipes(self, user, count, image=None):
+        recipes = Recipe.objects.bulk_create([
+            Recipe(name=f'Recipe {i}', description='desc', user=user, image=image)
+            for i in range(count)
+        ])
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'材料{j}', amount='1個', recipe=recipe)
+            for recipe in recipes for j in range(3)
+        ])
+        return recipes
+
+    def save_image(self, name):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'image')
+        return path
+
+    def test_recipe_is_hidden_before_purge(self):
+        recipe = self.create_recipes(self.user, 1)[0]
+        with self.captureOnCommitCallbacks() as callbacks:
+            job = delete_recipe(recipe)
+
+        self.assertFalse(Recipe.objects.filter(id=recipe.id).exists())
+        self.assertTrue(Recipe.all_objects.filter(id=recipe.id).exists())
+        self.assertEqual(Ingredient.objects.filter(recipe_id=recipe.id).count(), 3)
+        self.assertEqual(job.total_recipes, 1)
+        self.assertEqual(len(callbacks), 3)
+        self.assertEqual(
+            self.client.get(reverse('cook:recipe_detail', args=[recipe.id])).status_code,
+            404
+        )
+
+        with self.settings(DELETION_BACKGROUND=False):
+            for callback in callbacks:
+                callback()
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual((job.deleted_recipes, job.deleted_ingredients), (1, 3))
+        self.assertFalse(Ingredient.objects.filter(recipe_id=recipe.id).exists())
+
+    def test_delete_user_hides_user_and_recipes(self):
+        recipes = self.create_recipes(self.user, 5)
+        kept = self.create_recipes(self.other, 1)
+        job = delete_user(self.user)
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(job.total_recipes, 5)
+        self.assertEqual(list(Recipe.objects.all()), kept)
+        self.assertEqual(Recipe.all_objects.filter(user=self.user).count(), 5)
+
+        progress = []
+        job = purge(job.id, batch_size=2, progress=progress.append)
+        self.assertEqual(
+            [(p.deleted_recipes, p.finished_at is not None) for p in progress],
+            [(2, False), (4, False), (5, False), (5, True)]
+        )
+        self.assertEqual(job.deleted_ingredients, 15)
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertFalse(
+            Ingredient.objects.filter(recipe_id__in=[r.id for r in recipes]).exists()
+        )
+        self.assertEqual(Ingredient.objects.filter(recipe=kept[0]).count(), 3)
+
+    def test_purge_resumes_after_interruption(self):
+        self.create_recipes(self.user, 5)
+        job = delete_user(self.user)
+        purge_batch(job.id, 2)
+
+        with patch('cook.deletion.release_images', side_effect=OSError('disk')):
+            with self.assertRaises(OSError):
+                purge(job.id, batch_size=2)
+        job.refresh_from_db()
+        self.assertEqual(job.deleted_recipes, 2)
+        self.assertIn('disk', job.error)
+
+        stdout = StringIO()
+        call_command('purge_deleted', batch_size=2, stdout=stdout)
+        job.refresh_from_db()
+        self.assertEqual(job.deleted_recipes, 5)
+        self.assertEqual(job.error, '')
+        self.assertIn('レシピ5/5件', stdout.getvalue())
+        self.assertFalse(Recipe.all_objects.filter(user_id=self.user.id).exists())
+        # 完了したジョブは再実行しない
+        self.assertIsNone(purge(job.id))
+
+    def test_images_are_deleted_unless_shared(self):
+        own = self.save_image('images/own.jpg')
+        rendition = self.save_image('renditions/images/own_100.webp')
+        shared = self.save_image('images/shared.jpg')
+        self.create_recipes(self.user, 1, image='images/own.jpg')
+        self.create_recipes(self.user, 1, image='images/shared.jpg')
+        self.create_recipes(self.other, 1, image='images/shared.jpg')
+        acquire_images(['images/own.jpg', 'images/shared.jpg', 'images/shared.jpg'])
+
+        with self.settings(IMAGE_GC_GRACE_SECONDS=0):
+            job = purge(delete_user(self.user).id)
+
+        self.assertEqual(job.deleted_files, 1)
+        self.assertFalse(os.path.exists(own))
+        self.assertFalse(os.path.exists(rendition))
+        self.assertTrue(os.path.exists(shared))
+        self.assertEqual(
+            list(ImageBlob.objects.values_list('name', 'refcount')),
+            [('images/shared.jpg', 1)]
+        )
+
+    def test_raw_delete(self):
+        """
+        1回のDELETEで削除して行数を返し、材料のシグナルは送らない
+        """
+        recipes = self.create_recipes(self.user, 2)
+        ids = [recipe.id for recipe in recipes]
+        with patch('cook.signals.ingredients_bulk_changed') as changed, \
+                self.assertNumQueries(1):
+            deleted = raw_delete(Ingredient, ids, field='recipe')
+        self.assertEqual(deleted, 6)
+        changed.assert_not_called()
+        self.assertEqual(raw_delete(Recipe, ids + [999999]), 2)
+        self.assertEqual(raw_delete(Recipe, []), 0)
+        self.assertFalse(Recipe.all_objects.filter(id__in=ids).exists())
+
+    def test_delete_query_count_does_not_depend_on_recipe_count(self):
+        """
+        削除のリクエストはレシピ・材料の数によらずクエリ数が一定である
+        """
+        counts = []
+        for count in (1, 50):
+            user = User.objects.create_user(
+                username=f'leaver{count}', password='testpassword'
+            )
+            self.create_recipes(user, count)
+            self.client.force_login(user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('user:user_delete', args=[user.id]))
+            self.assertEqual(response.status_code, 302)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
 class IngredientCreateViewTestCase(TestCase):
     def test_ingredient_creation_page_with_correct_user(self):
         """
@@ -800,9 +3253,422 @@ class IngredientCreateViewTestCase(TestCase):
         pass
 
 
+class IngredientFormsetSizingTestCase(TestCase):
+    """
+    材料のフォームの数は送信されたTOTAL_FORMSで決まり、Redis・セッションを使わない
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Test Recipe',
+            description='This is a test recipe description.',
+            user=self.user
+        )
+        self.url = reverse('cook:ingredient_new', args=[self.recipe.id])
+        self.client.force_login(self.user)
+
+    def get_data(self, total, fill=None, **extra):
+        data = {
+            'ingredients-TOTAL_FORMS': total,
+            'ingredients-INITIAL_FORMS': 0,
+            'ingredients-MIN_NUM_FORMS': 0,
+            'ingredients-MAX_NUM_FORMS': 10,
+            **extra,
+        }
+        for i in range(total if fill is None else fill):
+            data[f'ingredients-{i}-name'] = f'材料{i}'
+            data[f'ingredients-{i}-amount'] = '1個'
+        return data
+
+    def count_forms(self, response):
+        soup = BeautifulSoup(response.content, 'html.parser')
+        return len(soup.select('#formset-container .ingredient-form'))
+
+    def test_get_renders_template_row_without_redis(self):
+        with patch.object(RedisHandler, 'get_value_from_key') as get_value:
+            response = self.client.get(self.url)
+        get_value.assert_not_called()
+        self.assertEqual(self.count_forms(response), IngredientForm.default_form_num)
+        soup = BeautifulSoup(response.content, 'html.parser')
+        template = soup.find('template', id='ingredient-empty-form')
+        self.assertIn('ingredients-__prefix__-name', str(template))
+
+    def test_submit_forms_added_in_browser(self):
+        """
+        ブラウザで追加したフォームも送信時に保存される
+        """
+        with patch.object(RedisHandler, 'set_key_and_value') as set_value:
+            response = self.client.post(
+                self.url, self.get_data(5, submit='')
+            )
+        set_value.assert_not_called()
+        self.assertRedirects(
+            response, reverse('cook:recipe_detail', args=[self.recipe.id])
+        )
+        self.assertEqual(self.recipe.ingredients.count(), 5)
+
+    def test_submit_out_of_range_form_count(self):
+        """
+        最大数を超える・最小数を下回るフォームの数で送信した場合は保存しない
+        """
+        for total in (IngredientForm.min_form_num - 1, IngredientForm.max_form_num + 1):
+            with self.subTest(total=total):
+                response = self.client.post(
+                    self.url, self.get_data(total, submit='')
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context['form'].non_form_errors())
+                self.assertFalse(self.recipe.ingredients.exists())
+
+    def test_resize_without_javascript(self):
+        """
+        JavaScriptが無効な場合は送信された入力を残したままフォームの数を変えて表示する
+        """
+        response = self.client.post(
+            self.url, self.get_data(3, fill=1, add_form='')
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.count_forms(response), 4)
+        self.assertContains(response, 'value="材料0"')
+        self.assertNotIn('form_data', self.client.session)
+
+        response = self.client.post(
+            self.url, self.get_data(IngredientForm.max_form_num, add_form='')
+        )
+        self.assertEqual(self.count_forms(response), IngredientForm.max_form_num)
+        self.assertContains(response, 'これ以上フォームを増やせません。')
+
+        response = self.client.post(
+            self.url, self.get_data(IngredientForm.min_form_num, remove_form='')
+        )
+        self.assertEqual(self.count_forms(response), IngredientForm.min_form_num)
+        self.assertContains(response, 'これ以上フォームを減らせません。')
+
+    @override_settings(INGREDIENT_FORMSET_CLIENT_SIDE=False)
+    def test_server_side_resizing(self):
+        """
+        INGREDIENT_FORMSET_CLIENT_SIDEがFalseの場合はフォームの数をRedisに保存してリダイレクトする
+        """
+        key = f'form_count_{self.user.id}'
+        RedisHandler().set_key_and_value(key, IngredientForm.default_form_num)
+        self.addCleanup(RedisHandler().redis_client.delete, key)
+
+        response = self.client.post(self.url, self.get_data(3, add_form=''))
+        self.assertRedirects(response, self.url)
+        self.assertEqual(RedisHandler().get_value_from_key(key), b'4')
+        self.assertNotContains(
+            self.client.get(self.url), 'id="ingredient-empty-form"'
+        )
+
+
+class SessionEngineTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Test Recipe',
+            description='This is a test recipe description.',
+            user=self.user
+        )
+
+    def test_session_is_read_from_cache(self):
+        """
+        ログイン後のリクエストではセッションをDBから読まない
+        """
+        self.client.login(username='testuser', password='testpassword')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cook:recipe_new'))
+        self.assertEqual(response.context['user'], self.user)
+        self.assertFalse(
+            [query for query in queries if 'django_session' in query['sql']]
+        )
+
+    def test_session_is_stored_compactly(self):
+        """
+        Redisにはorjsonで保存し、大きいセッションは圧縮する
+        """
+        store = SessionStore()
+        store['form_data'] = {f'ingredients-{i}-name': 'じゃがいも' for i in range(10)}
+        store.save(must_create=True)
+        self.addCleanup(store.delete)
+
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+        raw = get_redis_connection(settings.SESSION_CACHE_ALIAS).get(
+            cache.make_key(store.cache_key)
+        )
+        self.assertEqual(orjson.loads(zlib.decompress(raw)), dict(store.items()))
+        self.assertLess(len(raw), len(orjson.dumps(dict(store.items()))))
+        self.assertEqual(
+            cache.ttl(store.cache_key), settings.SESSION_COOKIE_AGE
+        )
+        self.assertEqual(SessionStore(store.session_key)['form_data'], store['form_data'])
+
+    @override_settings(SESSION_MAX_BYTES=100)
+    def test_session_size_limit(self):
+        store = SessionStore()
+        store['form_data'] = 'x' * 100
+        with self.assertRaises(SessionTooLarge):
+            store.save(must_create=True)
+        self.assertFalse(store.exists(store.session_key))
+
+    @override_settings(INGREDIENT_FORMSET_CLIENT_SIDE=False)
+    def test_form_data_stores_only_ingredient_fields(self):
+        key = f'form_count_{self.user.id}'
+        RedisHandler().set_key_and_value(key, IngredientForm.default_form_num)
+        self.addCleanup(RedisHandler().redis_client.delete, key)
+        self.client.force_login(self.user)
+
+        self.client.post(
+            reverse('cook:ingredient_new', args=[self.recipe.id]), {
+                'csrfmiddlewaretoken': 'x' * 64,
+                'ingredients-TOTAL_FORMS': 3,
+                'ingredients-INITIAL_FORMS': 0,
+                'ingredients-0-name': 'じゃがいも',
+                'add_form': '',
+            }
+        )
+        self.assertEqual(self.client.session['form_data'], {
+            'ingredients-TOTAL_FORMS': '3',
+            'ingredients-INITIAL_FORMS': '0',
+            'ingredients-0-name': 'じゃがいも',
+        })
+
+    def test_bench_sessions_command(self):
+        out = StringIO()
+        call_command(
+            'bench_sessions', sessions=5, json=True, form_data=True,
+            engines=['django.contrib.sessions.backends.db', 'cook.sessions'],
+            stdout=out
+        )
+        db, cached = json.loads(out.getvalue())
+        self.assertEqual(db['read_queries'], 1)
+        self.assertEqual(cached['read_queries'], 0)
+        self.assertLess(cached['stored_bytes'], db['stored_bytes'])
+
+
+def bulk_edit_data(ingredients, update=0, create=0, delete=0):
+    """
+    材料の一括編集の送信データ(先頭のupdate件を変更し、末尾のdelete件を削除し、create件を追加する)
+    """
+    ingredients = list(ingredients)
+    data = {
+        'ingredients-TOTAL_FORMS': len(ingredients) + create,
+        'ingredients-INITIAL_FORMS': len(ingredients),
+        'ingredients-MIN_NUM_FORMS': 0,
+        'ingredients-MAX_NUM_FORMS': 500,
+    }
+    for i, ingredient in enumerate(ingredients):
+        data[f'ingredients-{i}-id'] = ingredient.id
+        data[f'ingredients-{i}-name'] = f'{ingredient.name}改' if i < update else ingredient.name
+        data[f'ingredients-{i}-amount'] = ingredient.amount
+        if i >= len(ingredients) - delete:
+            data[f'ingredients-{i}-DELETE'] = 'on'
+    for i in range(len(ingredients), len(ingredients) + create):
+        data[f'ingredients-{i}-name'] = f'追加{i}'
+        data[f'ingredients-{i}-amount'] = '1個'
+    return data
+
+
+class IngredientBulkEditViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.another_user = User.objects.create_user(
+            username='anotheruser',
+            password='testpassword'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Test Recipe',
+            description='This is a test recipe description.',
+            user=self.user
+        )
+        self.url = reverse('cook:ingredient_bulk_edit', args=[self.recipe.id])
+
+    def create_ingredients(self, count):
+        self.recipe.ingredients.all().delete()
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'材料{i}', amount=f'{i}g', recipe=self.recipe)
+            for i in range(count)
+        ])
+        return list(self.recipe.ingredients.order_by('id'))
+
+    def test_only_author_can_edit(self):
+        response = self.client.get(self.url)
+        self.assertRedirects(
+            response, f'{settings.LOGIN_URL}?next={self.url}',
+            fetch_redirect_response=False
+        )
+        self.client.force_login(self.another_user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(
+            self.client.post(self.url, bulk_edit_data([], create=1)).status_code, 403
+        )
+        self.assertFalse(self.recipe.ingredients.exists())
+
+    def test_get_lists_ingredients(self):
+        ingredients = self.create_ingredients(3)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        soup = BeautifulSoup(response.content, 'html.parser')
+        self.assertEqual(
+            [tag['value'] for tag in soup.select('#formset-container input[name$="-id"]')],
+            [str(ingredient.id) for ingredient in ingredients]
+        )
+        self.assertIsNotNone(soup.find('template', id='ingredient-empty-form'))
+
+    def test_update_create_and_delete(self):
+        ingredients = self.create_ingredients(4)
+        self.recipe.refresh_from_db()
+        updated_at = self.recipe.updated_at
+        self.client.force_login(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(
+                self.url, bulk_edit_data(ingredients, update=2, create=2, delete=1)
+            )
+        self.assertRedirects(
+            response, reverse('cook:recipe_detail', args=[self.recipe.id]),
+            fetch_redirect_response=False
+        )
+        self.assertEqual(
+            list(self.recipe.ingredients.order_by('id').values_list('name', flat=True)),
+            ['材料0改', '材料1改', '材料2', '追加4', '追加5']
+        )
+        # 変更・追加した行には辞書のidが設定される
+        self.assertEqual(
+            self.recipe.ingredients.filter(catalog__isnull=False).count(), 4
+        )
+        self.recipe.refresh_from_db()
+        self.assertGreater(self.recipe.updated_at, updated_at)
+        # 検索用のカラムと転置インデックスも材料ごとではなく1回で更新する
+        self.assertIn(
+            self.recipe, search_recipes(Recipe.objects.all(), '追加4')
+        )
+        self.assertEqual(len(callbacks), 2)
+
+    def test_rejects_ingredients_of_another_recipe(self):
+        ingredients = self.create_ingredients(2)
+        other = Recipe.objects.create(
+            name='Other', description='Other recipe', user=self.another_user
+        )
+        other_ingredient = Ingredient.objects.create(
+            name='他の材料', amount='1個', recipe=other
+        )
+        self.client.force_login(self.user)
+
+        response = self.client.post(
+            self.url, bulk_edit_data([*ingredients, other_ingredient], update=3)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_form_errors())
+        other_ingredient.refresh_from_db()
+        self.assertEqual(other_ingredient.name, '他の材料')
+        self.assertEqual(self.recipe.ingredients.filter(name__endswith='改').count(), 0)
+
+    def test_query_count_is_constant(self):
+        """
+        行数によらずクエリ数が一定である
+        """
+        self.client.force_login(self.user)
+        counts = []
+        for count in (3, 60):
+            ingredients = self.create_ingredients(count)
+            data = bulk_edit_data(
+                ingredients, update=count // 3, create=count // 3, delete=count // 3
+            )
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, data)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(
+                self.recipe.ingredients.count(), count - count // 3 + count // 3
+            )
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
 class IngredientEditViewTestCase(TestCase):
-    pass
+    def test_ingredient_of_deleted_recipe_is_not_found(self):
+        """
+        削除を待っているレシピの材料は、投稿者でも編集・削除できない(404)
+        """
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        recipe = Recipe.objects.create(name='Recipe', description='d', user=user)
+        ingredient = Ingredient.objects.create(name='卵', amount='1個', recipe=recipe)
+        delete_recipe(recipe)
+        self.client.force_login(user)
+
+        response = self.client.post(
+            reverse('cook:ingredient_edit', args=[ingredient.id]),
+            {'name': '牛乳', 'amount': '1本'}
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            reverse('cook:ingredient_destroy', args=[ingredient.id])
+        )
+        self.assertEqual(response.status_code, 404)
+        ingredient.refresh_from_db()
+        self.assertEqual(ingredient.name, '卵')
 
 
 class IngredientDeleteViewTestCase(TestCase):
     pass
+
+
+class RedisHandlerTestCase(TestCase):
+    keys = ['test_redis_handler_1', 'test_redis_handler_2']
+
+    def tearDown(self):
+        RedisHandler().redis_client.delete(*self.keys)
+
+    def test_redis_handler_is_lazy(self):
+        """
+        インスタンスを作成しただけではRedisクライアントを作成しない
+        """
+        handler = RedisHandler()
+        self.assertIsNone(handler._redis_client)
+
+    def test_redis_handler_shares_connection_pool(self):
+        """
+        RedisHandlerのインスタンス間でコネクションプールを共有する
+        """
+        self.assertIs(
+            RedisHandler().redis_client.connection_pool,
+            RedisHandler().redis_client.connection_pool
+        )
+
+    def test_set_and_get_values_with_pipeline(self):
+        """
+        複数のキーをまとめて保存・取得できる
+        存在しないキーは結果に含まれない
+        """
+        handler = RedisHandler()
+        handler.set_keys_and_values({self.keys[0]: 3}, ex=60)
+
+        self.assertEqual(
+            handler.get_values_from_keys(self.keys), {self.keys[0]: b'3'}
+        )
+        with self.assertRaises(KeyError):
+            handler.get_value_from_key(self.keys[1])
+
+    async def test_async_redis_handler(self):
+        """
+        asyncio版のRedisHandlerで保存・取得ができる
+        """
+        handler = AsyncRedisHandler()
+        await handler.set_keys_and_values(
+            {self.keys[0]: 1, self.keys[1]: 2}, ex=60
+        )
+
+        self.assertEqual(await handler.get_value_from_key(self.keys[0]), b'1')
+        self.assertEqual(
+            await handler.get_values_from_keys(self.keys),
+            {self.keys[0]: b'1', self.keys[1]: b'2'}
+        )
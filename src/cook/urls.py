@@ -1,17 +1,36 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
+
+if settings.ASYNC_READ_VIEWS:
+    from .async_views import (
+        AsyncRecipeListView as RecipeListView,
+        AsyncRecipeDetailView as RecipeDetailView
+    )
+else:
+    from .views import RecipeListView, RecipeDetailView
 
 app_name = 'cook'
 urlpatterns = [
     # レシピ
     path(
         'recipes/',
-        views.RecipeListView.as_view(),
+        RecipeListView.as_view(),
         name='recipe_list'
     ),
+    path(
+        'recipes/search/',
+        views.RecipeSearchView.as_view(),
+        name='recipe_search'
+    ),
+    path(
+        'recipes/suggest/',
+        views.RecipeSuggestView.as_view(),
+        name='recipe_suggest'
+    ),
     path(
         'recipes/<int:recipe_id>/',
-        views.RecipeDetailView.as_view(),
+        RecipeDetailView.as_view(),
         name='recipe_detail'
     ),
     path(
@@ -19,6 +38,11 @@ urlpatterns = [
         views.RecipeCreateView.as_view(),
         name='recipe_new'
     ),
+    path(
+        'recipes/publish/',
+        views.RecipePublishView.as_view(),
+        name='recipe_publish'
+    ),
     path(
         'recipes/<int:recipe_id>/edit/',
         views.RecipeUpdateView.as_view(),
@@ -29,12 +53,22 @@ urlpatterns = [
         views.RecipeDeleteView.as_view(),
         name='recipe_destroy'
     ),
+    path(
+        'recipes/export/',
+        views.RecipeExportView.as_view(),
+        name='recipe_export'
+    ),
     # 具材
     path(
         'recipes/<int:recipe_id>/ingredients/new/',
         views.IngredientCrateView.as_view(),
         name='ingredient_new'
     ),
+    path(
+        'recipes/<int:recipe_id>/ingredients/edit/',
+        views.IngredientBulkUpdateView.as_view(),
+        name='ingredient_bulk_edit'
+    ),
     path(
         'recipes/ingredients/<int:ingredient_id>/edit/',
         views.IngredientUpdateView.as_view(),
@@ -45,4 +79,15 @@ urlpatterns = [
         views.IngredientDeleteView.as_view(),
         name='ingredient_destroy'
     ),
+    # JSON API(読み取り専用)
+    path(
+        'api/recipes/',
+        api.RecipeApiListView.as_view(),
+        name='api_recipe_list'
+    ),
+    path(
+        'api/recipes/<int:recipe_id>/',
+        api.RecipeApiDetailView.as_view(),
+        name='api_recipe_detail'
+    ),
 ]
@@ -1,3 +1,14 @@
+import logging
+import re
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
+from django.utils.decorators import method_decorator
+from django.template.loader import render_to_string
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.views.generic import (
@@ -5,30 +16,224 @@ from django.views.generic import (
     DetailView,
     CreateView,
     UpdateView,
-    DeleteView
+    DeleteView,
+    View
 )
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.forms import inlineformset_factory
-
+from django.forms import formset_factory, inlineformset_factory
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from . import cache as recipe_cache
+from .catalog import CatalogResolver
+from .conditional import conditional_page, recipe_etag, recipe_last_modified
+from .deletion import delete_recipe
 from .models import Recipe, Ingredient
-from .forms import RecipeForm, IngredientForm
-from .mixins import AuthorRequiredMixin
+from .forms import (
+    RecipeForm,
+    IngredientForm,
+    IngredientFormSet,
+    IngredientBulkForm,
+    IngredientBulkFormSet
+)
+from .export import (
+    CONTENT_TYPES, ExportFilterForm, aexport_recipes, export_recipes
+)
+from .mixins import AuthorRequiredMixin, StaffRequiredMixin
+from .pagination import CursorPaginator
+from .search import search_recipes
+from .signals import batch_ingredient_changes, ingredients_bulk_changed
+from .ingredient_index import IngredientIndex, resolve_catalog_ids, search_database
+
+logger = logging.getLogger(__name__)
 
 
 # Create your views here.
+def resize_ingredient_data(post, adjustment):
+    """
+    材料のフォームの数(TOTAL_FORMS)を増減した送信データと、範囲外の場合のメッセージを返す
+    (JavaScriptが無効でフォームの追加・削除のボタンが送信された場合)
+    """
+    data = post.copy()
+    try:
+        current_count = int(data.get('ingredients-TOTAL_FORMS'))
+    except (TypeError, ValueError):
+        current_count = IngredientForm.default_form_num
+    new_count = current_count + adjustment
+
+    messages = []
+    if new_count > IngredientForm.max_form_num:
+        new_count = IngredientForm.max_form_num
+        messages.append('これ以上フォームを増やせません。')
+    elif new_count < IngredientForm.min_form_num:
+        new_count = IngredientForm.min_form_num
+        messages.append('これ以上フォームを減らせません。')
+    data['ingredients-TOTAL_FORMS'] = new_count
+    return data, messages
+
+
 class RecipeListView(ListView):
     model = Recipe
     paginate_by = 5  # ページネーションの設定
     template_name = 'recipe/list.html'
     context_object_name = 'recipes'
     ordering = ['id']
+    # 'offset'(?page=n)または'cursor'(?after=<cursor>)
+    # Noneの場合はsettings.RECIPE_LIST_PAGINATIONに従う
+    pagination_mode = None
+
+    def get_pagination_mode(self):
+        return self.pagination_mode or getattr(
+            settings, 'RECIPE_LIST_PAGINATION', 'offset'
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.get_pagination_mode() != 'cursor':
+            return super().paginate_queryset(queryset, page_size)
+
+        # カーソルモードではOFFSETとCOUNT(*)を使わずに並び順のキーでシークする
+        paginator = CursorPaginator(
+            queryset, page_size, ordering=self.get_ordering()
+        )
+        try:
+            page = paginator.get_page(
+                after=self.request.GET.get('after') or None,
+                before=self.request.GET.get('before') or None
+            )
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get(self, request, *args, **kwargs):
+        # ページに表示するレシピのIDとページネーションのHTMLをキャッシュし、
+        # ヒットした場合はデータベースにアクセスせずにキャッシュ済みのカードで描画する
+        self.page_cache_key = recipe_cache.get_page_key(
+            'recipe_list', self.get_pagination_mode(), request.GET
+        )
+        cached_page = recipe_cache.get_page(self.page_cache_key)
+        if cached_page is None:
+            return super().get(request, *args, **kwargs)
+        self.object_list = None
+        return self.render_to_response({
+            'view': self,
+            'recipe_cards': recipe_cache.get_cards(cached_page['ids']),
+            'pagination': mark_safe(cached_page['pagination']),
+        })
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        recipes = list(context['recipes'])
+        context['recipe_cards'] = recipe_cache.get_cards(
+            [recipe.id for recipe in recipes], recipes=recipes
+        )
+        context['pagination'] = render_to_string(
+            'common/pagination-button.html', {'page_obj': context['page_obj']}
+        )
+        recipe_cache.set_page(
+            self.page_cache_key,
+            [recipe.id for recipe in recipes],
+            context['pagination']
+        )
+        return context
 
 
+class RecipeSearchView(ListView):
+    paginate_by = 5
+    template_name = 'recipe/search.html'
+    context_object_name = 'recipes'
+
+    def get_search_text(self):
+        return self.request.GET.get('q', '').strip()
+
+    def get_queryset(self):
+        # 検索用のカラム(GINインデックス)で検索し、関連度順に並べる
+        return search_recipes(
+            Recipe.objects.defer('search_vector'), self.get_search_text()
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        search_text = self.get_search_text()
+        context['q'] = search_text
+        # ページネーションのリンクに検索語を引き継ぐ
+        context['page_query'] = urlencode({'q': search_text}) + '&'
+        return context
+
+
+class RecipeSuggestView(ListView):
+    """
+    手持ちの材料から作れるレシピを材料のカバー率順に表示する
+    """
+    template_name = 'recipe/suggest.html'
+    context_object_name = 'results'
+    default_limit = 10
+    max_limit = 50
+
+    def get_ingredient_names(self):
+        text = self.request.GET.get('ingredients', '')
+        return [name for name in re.split(r'[,、\s]+', text) if name]
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.GET.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        return min(max(limit, 1), self.max_limit)
+
+    def get_queryset(self):
+        catalog_ids = resolve_catalog_ids(
+            self.get_ingredient_names(), IngredientIndex.max_names
+        )
+        try:
+            ranking = IngredientIndex().search_catalogs(
+                catalog_ids, limit=self.get_limit()
+            )
+        except (RedisError, ConnectionInterrupted):
+            # Redisに接続できない場合はデータベースで数える(遅いが結果は同じ)
+            logger.warning(
+                'Failed to search ingredient index, falling back to database',
+                exc_info=True
+            )
+            ranking = search_database(catalog_ids, limit=self.get_limit())
+        recipes = Recipe.objects.in_bulk([row[0] for row in ranking])
+        return [
+            {'recipe': recipes[recipe_id], 'match': match, 'missing': missing}
+            for recipe_id, match, missing in ranking
+            if recipe_id in recipes
+        ]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['ingredients'] = self.request.GET.get('ingredients', '')
+        return context
+
+
+@method_decorator(
+    conditional_page(
+        etag_func=recipe_etag, last_modified_func=recipe_last_modified
+    ),
+    name='get'
+)
 class RecipeDetailView(DetailView):
     model = Recipe
     template_name = 'recipe/detail.html'
     pk_url_kwarg = 'recipe_id'
 
+    def get_queryset(self):
+        # 投稿者と材料をまとめて取得し、材料の数によらずクエリ数を一定にする
+        return Recipe.objects.select_related('user').prefetch_related(
+            Prefetch('ingredients', queryset=Ingredient.objects.order_by('id'))
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # 編集・削除ボタンを表示するかどうかはページ単位で一度だけ判定する
+        context['is_author'] = self.object.user_id == self.request.user.id
+        return context
+
 
 class RecipeCreateView(LoginRequiredMixin, CreateView):
     model = Recipe
@@ -41,6 +246,70 @@ class RecipeCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+class RecipePublishView(LoginRequiredMixin, View):
+    """
+    レシピ・画像・材料を1回の送信で登録する
+    レシピと材料は1つのトランザクションで保存し、材料はbulk_createでまとめて登録する
+    """
+    template_name = 'recipe/publish.html'
+    formset_class = inlineformset_factory(
+        Recipe,
+        Ingredient,
+        form=IngredientForm,
+        formset=IngredientFormSet,
+        extra=IngredientForm.default_form_num,
+        max_num=IngredientForm.max_form_num,
+        absolute_max=IngredientForm.max_form_num,
+        can_delete=False
+    )
+
+    def get_formset(self, recipe, data=None):
+        return self.formset_class(
+            data=data, instance=recipe, queryset=Ingredient.objects.none()
+        )
+
+    def render_forms(self, form, formset, messages=()):
+        return render(self.request, self.template_name, {
+            'form': form,
+            'formset': formset,
+            'min_form_num': IngredientForm.min_form_num,
+            'max_form_num': IngredientForm.max_form_num,
+            'messages': list(messages),
+        })
+
+    def get(self, request, *args, **kwargs):
+        return self.render_forms(RecipeForm(), self.get_formset(Recipe()))
+
+    def post(self, request, *args, **kwargs):
+        recipe = Recipe(user=request.user)
+        form = RecipeForm(request.POST, request.FILES, instance=recipe)
+
+        if 'add_form' in request.POST or 'remove_form' in request.POST:
+            # JavaScriptが無効な場合のみ送信される(選択した画像は送り直す必要がある)
+            data, messages = resize_ingredient_data(
+                request.POST, 1 if 'add_form' in request.POST else -1
+            )
+            return self.render_forms(
+                RecipeForm(request.POST, instance=recipe),
+                self.get_formset(recipe, data), messages
+            )
+
+        formset = self.get_formset(recipe, request.POST)
+        # 両方のエラーを表示するため、先にどちらも検証する
+        if not all([form.is_valid(), formset.is_valid()]):
+            return self.render_forms(form, formset)
+
+        # レシピの検索用のカラムは材料を登録した後に1回だけ計算する
+        with transaction.atomic(), batch_ingredient_changes():
+            recipe = form.save()
+            formset.instance = recipe
+            ingredients = formset.save(commit=False)
+            if ingredients:
+                CatalogResolver().assign(ingredients)
+                Ingredient.objects.bulk_create(ingredients)
+        return redirect('cook:recipe_detail', recipe.id)
+
+
 class RecipeUpdateView(AuthorRequiredMixin, UpdateView):
     model = Recipe
     form_class = RecipeForm
@@ -59,19 +328,56 @@ class RecipeDeleteView(AuthorRequiredMixin, DeleteView):
     success_url = reverse_lazy('cook:recipe_list')
     pk_url_kwarg = 'recipe_id'
 
+    def form_valid(self, form):
+        # レシピはすぐに見えなくし、材料・画像とともにバックグラウンドで削除する
+        delete_recipe(self.object)
+        return redirect(self.get_success_url())
+
     def get(self, request, *args, **kwargs):
         # GETリクエストには404 Not Foundを返す
         # ユーザにとってHTTPメソッドは関係がないため
         return render(request, '404.html', status=404)
 
 
+class RecipeExportView(StaffRequiredMixin, View):
+    """
+    レシピと材料をCSV / JSONLで書き出す(スタッフのみ)
+    ?format=csv|jsonl&user=ユーザー名&since=日時&until=日時
+    """
+    batch_size = 1000
+
+    def get(self, request, *args, **kwargs):
+        form = ExportFilterForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        fmt = form.cleaned_data['format']
+        # ASGIでは非同期のイテレータを渡さないと、すべての行を作ってから送信される
+        export = (
+            aexport_recipes if isinstance(request, ASGIRequest) else export_recipes
+        )
+        response = StreamingHttpResponse(
+            export(form.get_queryset(), fmt, self.batch_size),
+            content_type=CONTENT_TYPES[fmt]
+        )
+        filename = f'recipes-{timezone.localdate():%Y%m%d}.{fmt}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 class IngredientCrateView(AuthorRequiredMixin, CreateView):
     template_name = 'ingredient/new.html'
     pk_url_kwarg = 'recipe_id'
     ingredient_form = IngredientForm()
 
     def get_object(self):
-        return get_object_or_404(Recipe, pk=self.kwargs['recipe_id'])
+        # 権限の確認とフォームの作成で使うため、1回だけ取得する
+        if not hasattr(self, '_recipe'):
+            self._recipe = get_object_or_404(Recipe, pk=self.kwargs['recipe_id'])
+        return self._recipe
+
+    def test_func(self):
+        # 投稿者のユーザを取得せずにidで比較する
+        return self.get_object().user_id == self.request.user.id
 
     def get_success_url(self):
         return reverse(
@@ -83,16 +389,53 @@ class IngredientCrateView(AuthorRequiredMixin, CreateView):
         """
         フォームクラスの設定
         """
-        form_nums = self.ingredient_form.get_num_of_forms(self.request.user.id)
+        if settings.INGREDIENT_FORMSET_CLIENT_SIDE:
+            # フォームの数は送信されたTOTAL_FORMSで決まるため、初期表示の数だけ指定する
+            form_nums = IngredientForm.default_form_num
+        else:
+            form_nums = self.ingredient_form.get_num_of_forms(
+                self.request.user.id
+            )
         return inlineformset_factory(
             Recipe,
             Ingredient,
             form=IngredientForm,
+            formset=IngredientFormSet,
             extra=form_nums,
             max_num=IngredientForm.max_form_num,
+            absolute_max=IngredientForm.max_form_num,
             can_delete=False
         )
 
+    def get_context_data(self, **kwargs):
+        return {
+            'min_form_num': IngredientForm.min_form_num,
+            'max_form_num': IngredientForm.max_form_num,
+            'client_side': settings.INGREDIENT_FORMSET_CLIENT_SIDE,
+            **kwargs,
+        }
+
+    def resize_formset(self, request, recipe, form_class):
+        """
+        送信されたTOTAL_FORMSからフォームの数を変えて表示する(JavaScriptが無効な場合)
+        Redis・セッションには保存しない
+        """
+        if 'reset_form' in request.POST:
+            formset = form_class(
+                instance=recipe, queryset=Ingredient.objects.none()
+            )
+            return render(request, self.template_name,
+                          self.get_context_data(form=formset))
+
+        data, messages = resize_ingredient_data(
+            request.POST, 1 if 'add_form' in request.POST else -1
+        )
+        formset = form_class(
+            data=data, instance=recipe, queryset=Ingredient.objects.none()
+        )
+        return render(request, self.template_name,
+                      self.get_context_data(form=formset, messages=messages))
+
     def adjust_form_count(self, request, adjustment):
         """
         フォームの数を調整して、材料フォームのページを表示する
@@ -129,6 +472,15 @@ class IngredientCrateView(AuthorRequiredMixin, CreateView):
         # ユーザがリロードした際に意図しないフォームの追加を防ぐためにrenderではなくredirect
         return redirect(redirect_url)
 
+    def store_form_data(self, request):
+        """
+        入力中の材料をセッションに保存する(CSRFトークン・ボタンは保存しない)
+        """
+        request.session['form_data'] = {
+            key: value for key, value in request.POST.items()
+            if key.startswith('ingredients-')
+        }
+
     def get(self, request, *args, **kwargs):
         recipe = self.get_object()
         form_data = request.session.pop('form_data', None)
@@ -158,7 +510,7 @@ class IngredientCrateView(AuthorRequiredMixin, CreateView):
 
         return render(request,
                       self.template_name,
-                      {'form': formset, 'messages': messages}
+                      self.get_context_data(form=formset, messages=messages)
                       )
 
     def post(self, request, *args, **kwargs):
@@ -167,16 +519,19 @@ class IngredientCrateView(AuthorRequiredMixin, CreateView):
         formset = form_class(data=request.POST, instance=recipe,
                              queryset=Ingredient.objects.none())
 
+        if settings.INGREDIENT_FORMSET_CLIENT_SIDE and any(
+            name in request.POST for name in ('add_form', 'remove_form', 'reset_form')
+        ):
+            return self.resize_formset(request, recipe, form_class)
+
         if 'add_form' in request.POST:
             # フォームを追加
-            request.session['form_data'] = request.POST
-            request.session.modified = True
+            self.store_form_data(request)
             return self.adjust_form_count(request, 1)
 
         elif 'remove_form' in request.POST:
             # フォームを減少
-            request.session['form_data'] = request.POST
-            request.session.modified = True
+            self.store_form_data(request)
             return self.adjust_form_count(request, -1)
 
         elif 'reset_form' in request.POST:
@@ -187,28 +542,121 @@ class IngredientCrateView(AuthorRequiredMixin, CreateView):
             return redirect('cook:ingredient_new', recipe.id)
 
         if formset.is_valid():
-            formset.save()
+            # 行ごとに保存せず、材料の辞書の参照・保存・レシピの更新をまとめて行う
+            with transaction.atomic():
+                ingredients = formset.save(commit=False)
+                if ingredients:
+                    CatalogResolver().assign(ingredients)
+                    Ingredient.objects.bulk_create(ingredients)
+                    ingredients_bulk_changed(recipe.id)
             return redirect('cook:recipe_detail', self.kwargs['recipe_id'])
         else:
             # formset.is_validで引っかかった内容についてエラーとして表示
             return render(
                 request,
                 self.template_name,
-                {'form': formset, 'errors': formset.errors}
+                self.get_context_data(form=formset, errors=formset.errors)
             )
 
 
-class IngredientUpdateView(AuthorRequiredMixin, UpdateView):
+class IngredientBulkUpdateView(AuthorRequiredMixin, View):
+    """
+    レシピの材料をまとめて編集・追加・削除する
+    投稿者の確認はレシピの1回の取得で行い、保存は1つのトランザクションで行う
+    """
+    template_name = 'ingredient/bulk_edit.html'
+    max_form_num = 500
+    form_class = formset_factory(
+        IngredientBulkForm,
+        formset=IngredientBulkFormSet,
+        extra=0,
+        can_delete=True,
+        max_num=max_form_num,
+        absolute_max=max_form_num,
+        validate_max=True
+    )
+
+    def get_object(self):
+        if not hasattr(self, 'object'):
+            self.object = get_object_or_404(
+                Recipe.objects.only('id', 'name', 'user_id'),
+                pk=self.kwargs['recipe_id']
+            )
+        return self.object
+
+    def test_func(self):
+        # 投稿者のユーザを取得せずにidで比較する
+        return self.get_object().user_id == self.request.user.id
+
+    def get_formset(self, data=None):
+        return self.form_class(
+            data=data,
+            prefix='ingredients',
+            ingredients=self.get_object().ingredients.order_by('id')
+        )
+
+    def render_formset(self, formset, messages=()):
+        return render(self.request, self.template_name, {
+            'recipe': self.get_object(),
+            'form': formset,
+            'min_form_num': 0,
+            'max_form_num': self.max_form_num,
+            'messages': list(messages),
+        })
+
+    def get(self, request, *args, **kwargs):
+        return self.render_formset(self.get_formset())
+
+    def post(self, request, *args, **kwargs):
+        if 'add_form' in request.POST:
+            # JavaScriptが無効な場合のみ送信される
+            data = request.POST.copy()
+            try:
+                total = int(data.get('ingredients-TOTAL_FORMS'))
+            except (TypeError, ValueError):
+                total = 0
+            data['ingredients-TOTAL_FORMS'] = min(total + 1, self.max_form_num)
+            return self.render_formset(self.get_formset(data))
+
+        with transaction.atomic():
+            formset = self.get_formset(request.POST)
+            if not formset.is_valid():
+                return self.render_formset(formset)
+            formset.save(self.get_object())
+        return redirect('cook:recipe_detail', self.kwargs['recipe_id'])
+
+
+class IngredientAuthorMixin(AuthorRequiredMixin):
+    """
+    材料の編集・削除ビューの共通部分
+    get_objectは権限の確認・保存・リダイレクト先で何度も呼ばれるため、
+    材料とレシピを1回のクエリで取得して使い回す
+    """
     model = Ingredient
-    form_class = IngredientForm
-    template_name = 'ingredient/edit.html'
     pk_url_kwarg = 'ingredient_id'
 
+    def get_queryset(self):
+        # 削除済みのレシピ(Recipe.objectsから見えないレシピ)の材料は編集・削除できない
+        return Ingredient.objects.filter(
+            recipe__in=Recipe.objects.all()
+        ).select_related('recipe')
+
+    def get_object(self, queryset=None):
+        if not hasattr(self, '_ingredient'):
+            self._ingredient = super().get_object(queryset)
+        return self._ingredient
+
     def get_recipe_object(self):
         return self.get_object().recipe
 
-    def get_user_object(self):
-        return self.get_recipe_object().user
+    def test_func(self):
+        # 投稿者のユーザを取得せずにidで比較する
+        return self.get_recipe_object().user_id == self.request.user.id
+
+
+class IngredientUpdateView(IngredientAuthorMixin, UpdateView):
+    form_class = IngredientForm
+    template_name = 'ingredient/edit.html'
 
     def get_success_url(self):
         return reverse(
@@ -217,16 +665,7 @@ class IngredientUpdateView(AuthorRequiredMixin, UpdateView):
         )
 
 
-class IngredientDeleteView(AuthorRequiredMixin, DeleteView):
-    model = Ingredient
-    pk_url_kwarg = 'ingredient_id'
-
-    def get_recipe_object(self):
-        return self.get_object().recipe
-
-    def get_user_object(self):
-        return self.get_recipe_object().user
-
+class IngredientDeleteView(IngredientAuthorMixin, DeleteView):
     def get_success_url(self):
         ingredient = self.get_object()
         recipe = ingredient.recipe
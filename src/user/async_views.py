@@ -0,0 +1,66 @@
+"""
+ユーザの一覧・詳細ページの非同期版(cook.async_viewsを参照)
+"""
+from django.db.models import Max
+from django.http import Http404
+from django.shortcuts import aget_object_or_404
+from django.template.response import TemplateResponse
+from django.utils.decorators import method_decorator
+
+from cook.async_views import AsyncMultipleObjectMixin
+from cook.conditional import conditional_page, make_etag
+from cook.models import Recipe
+from .views import (
+    VISIBLE_RECIPES, UserListView, UserDetailView, visible_recipe_count, visible_users
+)
+
+
+async def auser_detail_etag(request, pk):
+    """
+    user.views.user_detail_etagの非同期版
+    """
+    row = await visible_users().filter(pk=pk).annotate(
+        latest=Max('recipes__updated_at', filter=VISIBLE_RECIPES),
+        recipe_count=visible_recipe_count()
+    ).values_list('username', 'is_superuser', 'latest', 'recipe_count').afirst()
+    if row is None:
+        return None
+    username, is_superuser, latest, recipe_count = row
+    if is_superuser and not request.user.is_superuser:
+        return None
+    return make_etag(
+        request, pk, username, latest and latest.isoformat(), recipe_count
+    )
+
+
+class AsyncUserListView(AsyncMultipleObjectMixin, UserListView):
+
+    async def get(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        context = await self.aget_list_context(self.get_queryset())
+        return TemplateResponse(request, self.template_name, context)
+
+
+@method_decorator(conditional_page(etag_func=auser_detail_etag), name='get')
+class AsyncUserDetailView(UserDetailView):
+
+    async def get(self, request, *args, **kwargs):
+        user = await aget_object_or_404(
+            visible_users().annotate(
+                recipe_count=visible_recipe_count()
+            ),
+            id=self.kwargs['pk']
+        )
+        if user.is_superuser and not request.user.is_superuser:
+            raise Http404
+        recipes = [
+            recipe async for recipe in Recipe.objects.filter(
+                user=user
+            ).order_by('-posted_at', '-id')
+        ]
+        return TemplateResponse(request, self.template_name, {
+            'object': user,
+            'user': user,
+            'recipes': recipes,
+            'view': self,
+        })
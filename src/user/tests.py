@@ -1,3 +1,222 @@
+from django.urls import reverse
 from django.test import TestCase
+from django.contrib.auth import get_user_model
+
+from cook.deletion import delete_recipe
+from cook.models import DeletionJob, Recipe
+from cook.tests import create_async_request
+from .async_views import AsyncUserListView, AsyncUserDetailView
+
+
+User = get_user_model()
+
 
 # Create your tests here.
+class UserRecipeCountQueryTestCase(TestCase):
+    list_link = reverse('user:user_list')
+
+    def _create_users(self, recipe_num):
+        users = []
+        for i in range(5):
+            user = User.objects.create_user(
+                username=f'user{i}_{recipe_num}',
+                password='testpassword'
+            )
+            Recipe.objects.bulk_create([
+                Recipe(
+                    name=f'Recipe {j}',
+                    description=f'Description {j}',
+                    user=user
+                )
+                for j in range(recipe_num)
+            ])
+            users.append(user)
+        return users
+
+    def test_user_list_query_count_is_constant(self):
+        """
+        ユーザ一覧ページのクエリ数が各ユーザの投稿数に依存しない
+        (件数の取得 + ユーザと投稿数の取得)
+        """
+        for recipe_num in [1, 50]:
+            with self.subTest(recipe_num=recipe_num):
+                User.objects.all().delete()
+                self._create_users(recipe_num)
+                with self.assertNumQueries(2):
+                    response = self.client.get(self.list_link)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, f'投稿数：{recipe_num}', 5)
+
+    def test_user_detail_query_count_is_constant(self):
+        """
+        ユーザ詳細ページのクエリ数が投稿数に依存しない
+        (ログインユーザ + ETag用の集計 + ユーザと投稿数の取得 + レシピ一覧の取得。セッションはRedisから読む)
+        """
+        for recipe_num in [1, 50]:
+            with self.subTest(recipe_num=recipe_num):
+                User.objects.all().delete()
+                user = self._create_users(recipe_num)[0]
+                self.client.force_login(user)
+                with self.assertNumQueries(4):
+                    response = self.client.get(
+                        reverse('user:user_detail', kwargs={'pk': user.id})
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, f'投稿数：{recipe_num}')
+
+
+class UserDetailConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Recipe', description='Description', user=self.user
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('user:user_detail', kwargs={'pk': self.user.id})
+
+    def test_user_detail_not_modified(self):
+        """
+        ETagが一致した場合は304を返す
+        """
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_user_detail_etag_changes_on_recipe_delete(self):
+        """
+        レシピの削除でETagが変わる
+        """
+        etag = self.client.get(self.url)['ETag']
+        self.recipe.delete()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'まだ何も投稿していません。')
+
+    def test_user_detail_etag_changes_on_recipe_hidden(self):
+        """
+        削除を待っているレシピは投稿数に数えず、ETagも変わる
+        """
+        etag = self.client.get(self.url)['ETag']
+        delete_recipe(self.recipe)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'まだ何も投稿していません。')
+
+
+class UserDeleteViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='leaver',
+            password='testpassword'
+        )
+        Recipe.objects.create(
+            name='Recipe', description='Description', user=self.user
+        )
+        self.url = reverse('user:user_delete', kwargs={'pk': self.user.id})
+
+    def test_delete_hides_user_and_logs_out(self):
+        """
+        ユーザはすぐに一覧・詳細に表示されなくなり、レシピ・ユーザの行はコミット後に削除する
+        """
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(self.url)
+
+        self.assertRedirects(response, reverse('user:user_list'))
+        self.assertNotIn('_auth_user_id', self.client.session)
+        self.assertNotContains(self.client.get(reverse('user:user_list')), 'leaver')
+        self.assertEqual(
+            self.client.get(
+                reverse('user:user_detail', kwargs={'pk': self.user.id})
+            ).status_code,
+            404
+        )
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+        self.assertTrue(User.objects.filter(id=self.user.id).exists())
+
+        with self.settings(DELETION_BACKGROUND=False):
+            for callback in callbacks:
+                callback()
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertFalse(Recipe.all_objects.exists())
+        self.assertIsNotNone(DeletionJob.objects.get(object_id=self.user.id).finished_at)
+
+    def test_deactivated_user_is_still_listed(self):
+        """
+        管理者が無効にしただけのユーザ(削除のジョブがない)は一覧・詳細に表示する
+        """
+        User.objects.filter(id=self.user.id).update(is_active=False)
+
+        self.assertContains(self.client.get(reverse('user:user_list')), 'leaver')
+        self.assertEqual(
+            self.client.get(
+                reverse('user:user_detail', kwargs={'pk': self.user.id})
+            ).status_code,
+            200
+        )
+
+    def test_other_user_cannot_delete(self):
+        other = User.objects.create_user(username='other', password='testpassword')
+        self.client.force_login(other)
+
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, 403)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        self.assertFalse(DeletionJob.objects.exists())
+
+
+class AsyncUserViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.admin = User.objects.create_superuser(
+            username='admin',
+            password='adminpassword'
+        )
+        Recipe.objects.create(
+            name='Recipe', description='Description', user=self.user
+        )
+
+    async def test_user_list(self):
+        """
+        非同期版のユーザ一覧でもsuperuserは表示されない
+        """
+        response = await AsyncUserListView.as_view()(create_async_request('/'))
+        response.render()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'testuser')
+        self.assertNotContains(response, 'admin')
+        self.assertContains(response, '投稿数：1')
+
+    async def test_user_detail(self):
+        view = AsyncUserDetailView.as_view()
+        # ヘッダーのリンクはログイン中のユーザを前提とする
+        response = await view(
+            create_async_request('/', user=self.user), pk=self.user.id
+        )
+        response.render()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Recipe')
+
+        response = await view(
+            create_async_request(
+                '/', user=self.user, headers={'If-None-Match': response['ETag']}
+            ),
+            pk=self.user.id
+        )
+        self.assertEqual(response.status_code, 304)
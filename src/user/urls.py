@@ -1,5 +1,14 @@
+from django.conf import settings
 from django.urls import path
-from .views import UserListView, UserDetailView, UserUpdateView, UserDeleteView
+from .views import UserUpdateView, UserDeleteView
+
+if settings.ASYNC_READ_VIEWS:
+    from .async_views import (
+        AsyncUserListView as UserListView,
+        AsyncUserDetailView as UserDetailView
+    )
+else:
+    from .views import UserListView, UserDetailView
 
 app_name = 'user'
 urlpatterns = [
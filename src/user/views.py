@@ -2,11 +2,53 @@ from django.shortcuts import render, redirect
 from django.views.generic import ListView, DetailView, UpdateView, DeleteView
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.http import Http404
+from django.contrib.auth import logout
+from django.db.models import Count, Max, Q
+from django.utils.decorators import method_decorator
 
-from cook.models import Recipe
+from cook.conditional import conditional_page, make_etag
+from cook.deletion import delete_user
+from cook.models import DeletionJob, Recipe
 from user.mixins import UserPermissionMixin
 
+# 削除済み(cook.deletionで削除を待っている)レシピは数えない
+VISIBLE_RECIPES = Q(recipes__deleted_at__isnull=True)
+
+
+def visible_users():
+    """
+    削除を待っている(cook.deletionのジョブがある)ユーザを除いたユーザ
+    管理者が無効にしただけのユーザ(is_active=False)はこれまでどおり表示する
+    """
+    return User.objects.exclude(id__in=DeletionJob.objects.filter(
+        kind=DeletionJob.KIND_USER
+    ).values('object_id'))
+
+
+def visible_recipe_count():
+    return Count('recipes', filter=VISIBLE_RECIPES)
+
+
+def user_detail_etag(request, pk):
+    """
+    ユーザ名・投稿数・レシピの最終更新日時から1クエリでETagを作る
+    レシピの削除は最終更新日時に現れないため、Last-Modifiedは使わずに投稿数で検出する
+    """
+    row = visible_users().filter(pk=pk).annotate(
+        latest=Max('recipes__updated_at', filter=VISIBLE_RECIPES),
+        recipe_count=visible_recipe_count()
+    ).values_list('username', 'is_superuser', 'latest', 'recipe_count').first()
+    if row is None:
+        return None
+    username, is_superuser, latest, recipe_count = row
+    if is_superuser and not request.user.is_superuser:
+        return None
+    return make_etag(
+        request, pk, username, latest and latest.isoformat(), recipe_count
+    )
+
 
 # Create your views here.
 class UserListView(ListView):
@@ -16,13 +58,19 @@ class UserListView(ListView):
     paginate_by = 5
 
     # 現在ログイン中のユーザがsuperuserでない場合はsuperuser以外のuser一覧を返す
+    # 投稿数はユーザの取得と同じクエリで集計する
     def get_queryset(self):
+        # 削除したユーザは表示しない
+        queryset = visible_users().annotate(
+            recipe_count=visible_recipe_count()
+        ).order_by('id')
         if not self.request.user.is_superuser:
-            return User.objects.exclude(is_superuser=True)
+            return queryset.exclude(is_superuser=True)
 
-        return User.objects.all()
+        return queryset
 
 
+@method_decorator(conditional_page(etag_func=user_detail_etag), name='get')
 class UserDetailView(DetailView):
     models = User
     context_object_name = 'user'
@@ -30,7 +78,12 @@ class UserDetailView(DetailView):
 
     def get_object(self):
         # 現在ログイン中のユーザがsuperuserでない場合はadminユーザだったら404を返す
-        user = get_object_or_404(User, id=self.kwargs['pk'])
+        user = get_object_or_404(
+            visible_users().annotate(
+                recipe_count=visible_recipe_count()
+            ),
+            id=self.kwargs['pk']
+        )
         if user.is_superuser and not self.request.user.is_superuser:
             raise Http404
         return user
@@ -38,20 +91,25 @@ class UserDetailView(DetailView):
     # ユーザとユーザのレシピをパラメータとして渡す
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.get_object()
-        recipes = Recipe.objects.filter(user=user)
+        recipes = Recipe.objects.filter(user=self.object).order_by(
+            '-posted_at', '-id'
+        )
         context['recipes'] = recipes
         return context
 
 
 class UserUpdateView(UserPermissionMixin, UpdateView):
-    models = User
+    model = User
+    fields = ['username', 'email']
     context_object_name = 'user'
-    template_name = 'user/update.html'
+    template_name = 'user/edit.html'
+
+    def get_success_url(self):
+        return reverse('user:user_detail', kwargs={'pk': self.object.pk})
 
 
 class UserDeleteView(UserPermissionMixin, DeleteView):
-    models = User
+    model = User
     context_object_name = 'user'
     template_name = 'user/delete.html'
 
@@ -60,7 +118,9 @@ class UserDeleteView(UserPermissionMixin, DeleteView):
         return render(request, '404.html')
 
     # POSTメソッドはユーザ削除
+    # ユーザとレシピはすぐに見えなくし、レシピ・材料・画像はバックグラウンドで削除する
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
-        self.object.delete()
+        delete_user(self.object)
+        logout(request)
         return redirect('user:user_list')